@@ -0,0 +1,113 @@
+""" Runtime allocation counts of closure-heavy programs.
+
+    Counts the ModuleCells (boxed variables) and W_Conts (closures and
+    continuations) allocated while running each program. Only meaningful
+    untranslated: the constructors are wrapped to count.
+
+    Usage: python -m rasm.bench.bench_alloc [file.scm ...]
+           (defaults to the closure scripts and the programs below)
+"""
+import os
+import sys
+from StringIO import StringIO
+from rasm.lang.env import ModuleCell
+from rasm.rt.code import W_Cont
+from rasm.compiler.parser import parse_string
+from rasm.compiler.astbuilder import Builder
+from rasm.compiler.cps import Rewriter
+from rasm.compiler.codegen import compile_all
+from rasm.rt.image import prelude_image, get_report_env
+from rasm.rt.execution import Frame
+
+MAKE_ADDER = '''
+(define (make-adder n) (lambda (x) (+ x n)))
+(define (loop i acc)
+  (if (< i 2000)
+      (loop (+ i 1) (+ acc ((make-adder i) 1)))
+      acc))
+(loop 0 0)
+'''
+
+COUNT_UP = '''
+(define (count-up n)
+  (define c 0)
+  (define (loop i)
+    (if (< i n)
+        (begin (set! c (+ c i))
+               (loop (+ i 1)))
+        c))
+  (loop 0))
+(count-up 2000)
+'''
+
+MAP_CLOSURE = '''
+(define (iota n acc) (if (= n 0) acc (iota (- n 1) (cons n acc))))
+(define (scale k lst) (map (lambda (x) (* x k)) lst))
+(length (scale 3 (iota 2000 '())))
+'''
+
+class Counter(object):
+    def __init__(self, cls):
+        self.cls = cls
+        self.count = 0
+        self.orig_init = cls.__init__
+
+    def install(self):
+        counter = self
+        orig_init = self.orig_init
+        def counting_init(self, *args):
+            counter.count += 1
+            orig_init(self, *args)
+        self.cls.__init__ = counting_init
+
+    def uninstall(self):
+        self.cls.__init__ = self.orig_init
+
+def run_source(source):
+    nodelist = Builder(parse_string(source)).getast()
+    cpsform = Rewriter(nodelist, toplevel=True).run()
+    w_maincont, proto_w = compile_all(cpsform, get_report_env(),
+                                      prelude_image.proto_w)
+    return Frame(w_maincont, proto_w).run()
+
+def count_allocs(source):
+    cells = Counter(ModuleCell)
+    conts = Counter(W_Cont)
+    cells.install()
+    conts.install()
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        run_source(source)
+    finally:
+        sys.stdout = stdout
+        cells.uninstall()
+        conts.uninstall()
+    return cells.count, conts.count
+
+def default_programs():
+    root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    programs = []
+    for name in ['closure2.scm', 'counter.scm', 'callcc.scm']:
+        filename = os.path.join(root, 'script', name)
+        programs.append((name, open(filename).read()))
+    programs.append(('make-adder', MAKE_ADDER))
+    programs.append(('count-up', COUNT_UP))
+    programs.append(('map-closure', MAP_CLOSURE))
+    return programs
+
+def main(argv):
+    if len(argv) > 1:
+        programs = [(os.path.basename(filename), open(filename).read())
+                    for filename in argv[1:]]
+    else:
+        programs = default_programs()
+    print '%-16s %12s %12s' % ('program', 'ModuleCell', 'W_Cont')
+    for name, source in programs:
+        cells, conts = count_allocs(source)
+        print '%-16s %12d %12d' % (name, cells, conts)
+    return 0
+
+if __name__ == '__main__':
+    main(sys.argv)
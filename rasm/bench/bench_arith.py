@@ -0,0 +1,115 @@
+""" Integer arithmetic with boxed and with tagged ints.
+
+    Runs loops, factorial and fib untranslated, once in a build with
+    boxed W_Integers and once with tagged W_SmallInts (RASM_SMALLINT=1,
+    in a child process since the switch is read at import), and reports
+    the best of 3 times of each. The fact and fib-iter programs go past
+    the machine ints and into W_BigInts, the others never overflow.
+    Untranslated, a W_SmallInt is an object as well: this checks that
+    both builds work and what the overflow checks cost, the gain of
+    tagging only shows translated.
+
+    Usage: python -m rasm.bench.bench_arith [n]
+"""
+import os
+import sys
+import time
+import subprocess
+from rasm.compiler.parser import parse_string
+from rasm.compiler.astbuilder import Builder
+from rasm.compiler.cps import Rewriter
+from rasm.compiler.codegen import compile_all
+from rasm.rt.image import prelude_image, get_report_env
+from rasm.rt.execution import Frame
+
+LOOP = '''
+(define (loop i s)
+  (if (< i 1) s
+      (loop (- i 1) (+ s (* i 3)))))
+(loop %d 0)
+'''
+
+FIBO = '''
+(define (fibo n)
+  (if (< n 2) n
+      (+ (fibo (- n 1))
+         (fibo (- n 2)))))
+(fibo %d)
+'''
+
+# fact 20 is the largest that fits in 64 bits.
+FACT = '''
+(define (fact n) (if (< n 1) 1 (* n (fact (- n 1)))))
+(define (repeat i n r) (if (< i 1) r (repeat (- i 1) n (fact n))))
+(repeat %d %d 0)
+'''
+
+FIB_ITER = '''
+(define (fib n a b) (if (< n 1) a (fib (- n 1) b (+ a b))))
+(define (repeat i n r) (if (< i 1) r (repeat (- i 1) n (fib n 0 1))))
+(repeat %d %d 0)
+'''
+
+def programs(n):
+    return [('loop', LOOP % n),
+            ('fibo', FIBO % 16),
+            ('fact 20', FACT % (n / 200, 20)),
+            ('fact 60', FACT % (n / 200, 60)),
+            ('fib-iter 90', FIB_ITER % (n / 1000, 90)),
+            ('fib-iter 300', FIB_ITER % (n / 1000, 300))]
+
+def compile_source(source):
+    nodelist = Builder(parse_string(source)).getast()
+    cpsform = Rewriter(nodelist, toplevel=True).run()
+    return compile_all(cpsform, get_report_env(), prelude_image.proto_w)
+
+def measure(source):
+    best = 0.0
+    w_ret = None
+    for i in range(3):
+        w_maincont, proto_w = compile_source(source)
+        frame = Frame(w_maincont, proto_w)
+        t0 = time.time()
+        w_ret = frame.run()
+        elapsed = time.time() - t0
+        if i == 0 or elapsed < best:
+            best = elapsed
+    return w_ret.to_string(), best
+
+def run_child(n, tagged):
+    env = dict(os.environ)
+    env['RASM_SMALLINT'] = '1' if tagged else '0'
+    output = subprocess.Popen([sys.executable, '-m', 'rasm.bench.bench_arith',
+                               '--child', str(n)], env=env,
+                              stdout=subprocess.PIPE).communicate()[0]
+    results = {}
+    for line in output.splitlines():
+        if line.startswith('result '):
+            _, name, digits, elapsed = line.split(' ', 3)
+            results[name.replace('_', ' ')] = (int(digits), float(elapsed))
+    return results
+
+def main(argv):
+    if len(argv) > 2 and argv[1] == '--child':
+        for name, source in programs(int(argv[2])):
+            result, elapsed = measure(source)
+            print 'result %s %d %f' % (name.replace(' ', '_'), len(result),
+                                       elapsed)
+        return 0
+    try:
+        n = int(argv[1])
+    except (IndexError, ValueError):
+        n = 20000
+    boxed = run_child(n, False)
+    tagged = run_child(n, True)
+    print '%-14s %8s %10s %10s' % ('program', 'digits', 'boxed(s)',
+                                   'tagged(s)')
+    for name, _ in programs(n):
+        digits, t_boxed = boxed[name]
+        digits_tagged, t_tagged = tagged[name]
+        assert digits == digits_tagged
+        print '%-14s %8d %10.3f %10.3f' % (name, digits, t_boxed, t_tagged)
+    return 0
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,116 @@
+""" The bulk vector primitives against the same loops in Scheme.
+
+    Each program runs its operation reps times over int vectors of n
+    items, once as a Scheme loop over vector-ref and vector-set! and
+    once through vector-sum, vector-dot, vector-map!, vector-fill! or
+    vector-copy!. Reports the best of 3 times, which include building
+    the vectors (the setup row), and the W_Ints allocated less those of
+    the setup. Untranslated; the counts are only meaningful without
+    RASM_SMALLINT.
+
+    Usage: python -m rasm.bench.bench_bulk [n] [reps]
+"""
+import sys
+import time
+from rasm.lang.model import W_Integer
+from rasm.compiler.parser import parse_string
+from rasm.compiler.astbuilder import Builder
+from rasm.compiler.cps import Rewriter
+from rasm.compiler.codegen import compile_all
+from rasm.rt.image import prelude_image, get_report_env
+from rasm.rt.execution import Frame
+from rasm.bench.bench_alloc import Counter
+
+SETUP = '''
+(define n %d)
+(define (iota! v i)
+  (if (< i n) (begin (vector-set! v i i) (iota! v (+ i 1))) v))
+(define a (iota! (make-vector n 0) 0))
+(define b (iota! (make-vector n 0) 0))
+(define (repeat k thunk)
+  (if (< k 1) 0 (begin (thunk) (repeat (- k 1) thunk))))
+'''
+
+LOOPS = [
+    ('sum', '''
+(define (sum v i acc)
+  (if (< i n) (sum v (+ i 1) (+ acc (vector-ref v i))) acc))
+(repeat %d (lambda () (sum a 0 0)))''',
+     '(repeat %d (lambda () (vector-sum a)))'),
+    ('dot', '''
+(define (dot x y i acc)
+  (if (< i n)
+      (dot x y (+ i 1) (+ acc (* (vector-ref x i) (vector-ref y i))))
+      acc))
+(repeat %d (lambda () (dot a b 0 0)))''',
+     '(repeat %d (lambda () (vector-dot a b)))'),
+    ('map!', '''
+(define (add! x y i)
+  (if (< i n)
+      (begin (vector-set! x i (+ (vector-ref x i) (vector-ref y i)))
+             (add! x y (+ i 1)))
+      x))
+(repeat %d (lambda () (add! a b 0)))''',
+     '(repeat %d (lambda () (vector-map! + a b)))'),
+    ('fill!', '''
+(define (fill! v x i)
+  (if (< i n) (begin (vector-set! v i x) (fill! v x (+ i 1))) v))
+(repeat %d (lambda () (fill! a 7 0)))''',
+     '(repeat %d (lambda () (vector-fill! a 7)))'),
+    ('copy!', '''
+(define (copy! dst src i)
+  (if (< i n)
+      (begin (vector-set! dst i (vector-ref src i)) (copy! dst src (+ i 1)))
+      dst))
+(repeat %d (lambda () (copy! a b 0)))''',
+     '(repeat %d (lambda () (vector-copy! a 0 b)))'),
+]
+
+def compile_source(source):
+    nodelist = Builder(parse_string(source)).getast()
+    cpsform = Rewriter(nodelist, toplevel=True).run()
+    return compile_all(cpsform, get_report_env(), prelude_image.proto_w)
+
+def measure(source):
+    ints = Counter(W_Integer)
+    ints.install()
+    try:
+        w_maincont, proto_w = compile_source(source)
+        Frame(w_maincont, proto_w).run()
+    finally:
+        ints.uninstall()
+    best = 0.0
+    for i in range(3):
+        w_maincont, proto_w = compile_source(source)
+        frame = Frame(w_maincont, proto_w)
+        t0 = time.time()
+        frame.run()
+        elapsed = time.time() - t0
+        if i == 0 or elapsed < best:
+            best = elapsed
+    return ints.count, best
+
+def main(argv):
+    try:
+        n = int(argv[1])
+    except (IndexError, ValueError):
+        n = 1000
+    try:
+        reps = int(argv[2])
+    except (IndexError, ValueError):
+        reps = 10
+    setup = SETUP % n
+    base_ints, base_time = measure(setup)
+    print '%-8s %24s %24s' % ('op', 'W_Ints loop -> bulk',
+                              'time(s) loop -> bulk')
+    print '%-8s %24s %11.3f' % ('setup', '', base_time)
+    for name, loop, bulk in LOOPS:
+        loop_ints, loop_time = measure(setup + loop % reps)
+        bulk_ints, bulk_time = measure(setup + bulk % reps)
+        print '%-8s %11d -> %-9d %11.3f -> %-9.3f' % (
+                name, loop_ints - base_ints, bulk_ints - base_ints,
+                loop_time, bulk_time)
+    return 0
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,64 @@
+""" Cold compile vs. warm cache load of script/*.scm.
+
+    Hashing the source is reported on its own: untranslated, the pure
+    python md5 dominates both paths.
+
+    Usage: python -m rasm.bench.bench_cache [iterations]
+"""
+import sys
+import os
+import glob
+import time
+from rasm.compiler.parser import parse_string
+from rasm.compiler.astbuilder import Builder
+from rasm.compiler.cps import Rewriter
+from rasm.compiler.codegen import compile_all
+from rasm.compiler.cache import dump_program, load_program, source_hash
+from rasm.rt.image import prelude_image, get_report_env
+
+SCRIPT_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'script')
+
+def cold(source, w_module):
+    nodelist = Builder(parse_string(source)).getast()
+    cpsform = Rewriter(nodelist, toplevel=True).run()
+    return compile_all(cpsform, w_module, prelude_image.proto_w)
+
+def warm(srchash, data, w_module):
+    return load_program(data, srchash, w_module, prelude_image)
+
+def main(argv):
+    try:
+        iterations = int(argv[1])
+    except (IndexError, ValueError):
+        iterations = 50
+    print '%-16s %10s %10s %10s %8s' % ('script', 'hash(ms)', 'cold(ms)',
+                                        'warm(ms)', 'bytes')
+    for path in sorted(glob.glob(os.path.join(SCRIPT_DIR, '*.scm'))):
+        source = open(path).read()
+        w_module = get_report_env()
+        w_maincont, proto_w = cold(source, w_module)
+        srchash = source_hash(source)
+        data = dump_program(w_maincont, proto_w, srchash, prelude_image)
+
+        t0 = time.time()
+        for i in xrange(iterations):
+            source_hash(source)
+        t_hash = (time.time() - t0) / iterations
+
+        t0 = time.time()
+        for i in xrange(iterations):
+            cold(source, w_module)
+        t_cold = (time.time() - t0) / iterations
+
+        t0 = time.time()
+        for i in xrange(iterations):
+            warm(srchash, data, w_module)
+        t_warm = (time.time() - t0) / iterations
+
+        print '%-16s %10.2f %10.2f %10.2f %8d' % (
+                os.path.basename(path), t_hash * 1000,
+                t_cold * 1000, t_warm * 1000, len(data))
+    return 0
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,73 @@
+""" Global call sites and their inline caches.
+
+    Runs script/fibo.scm and script/loop.scm style programs, whose
+    recursive calls go through GETGLOBALCONT, untranslated, and reports
+    the best of 3 times and the hits and misses of the call caches.
+    Every call site should miss once, when its cache is first filled.
+
+    Usage: python -m rasm.bench.bench_callcache [fibo-n] [loop-n]
+"""
+import sys
+import time
+from rasm.compiler.parser import parse_string
+from rasm.compiler.astbuilder import Builder
+from rasm.compiler.cps import Rewriter
+from rasm.compiler.codegen import compile_all
+from rasm.rt.image import prelude_image, get_report_env
+from rasm.rt.code import callcache_stats
+from rasm.rt.execution import Frame
+
+FIBO = '''
+(define (fibo n)
+  (if (< n 2) n
+      (+ (fibo (- n 1))
+         (fibo (- n 2)))))
+(fibo %d)
+'''
+
+LOOP = '''
+(define (sum n s)
+  (if (< n 1) s
+      (sum (- n 1) (+ s n))))
+(sum %d 0)
+'''
+
+def compile_source(source):
+    nodelist = Builder(parse_string(source)).getast()
+    cpsform = Rewriter(nodelist, toplevel=True).run()
+    return compile_all(cpsform, get_report_env(), prelude_image.proto_w)
+
+def measure(source):
+    best = 0.0
+    for i in range(3):
+        w_maincont, proto_w = compile_source(source)
+        callcache_stats.reset()
+        frame = Frame(w_maincont, proto_w)
+        t0 = time.time()
+        w_ret = frame.run()
+        elapsed = time.time() - t0
+        if i == 0 or elapsed < best:
+            best = elapsed
+    return w_ret.to_string(), best
+
+def main(argv):
+    try:
+        fibo_n = int(argv[1])
+    except (IndexError, ValueError):
+        fibo_n = 18
+    try:
+        loop_n = int(argv[2])
+    except (IndexError, ValueError):
+        loop_n = 30000
+    print '%-12s %10s %10s %10s %8s' % ('program', 'result', 'time(s)',
+                                        'hits', 'misses')
+    for name, source in [('fibo %d' % fibo_n, FIBO % fibo_n),
+                         ('loop %d' % loop_n, LOOP % loop_n)]:
+        result, elapsed = measure(source)
+        print '%-12s %10s %10.3f %10d %8d' % (name, result, elapsed,
+                                              callcache_stats.hits,
+                                              callcache_stats.misses)
+    return 0
+
+if __name__ == '__main__':
+    main(sys.argv)
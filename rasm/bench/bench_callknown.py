@@ -0,0 +1,82 @@
+""" Calls through CALLKNOWN against calls through CONT.
+
+    script/fibo.scm and script/loop.scm call toplevel functions, which
+    any later define may replace, so codegen cannot know their callee.
+    This runs the same functions defined inside a main lambda, compiled
+    with and without known_calls, untranslated, and reports the
+    instructions run and the best of 3 times.
+
+    Usage: python -m rasm.bench.bench_callknown [fibo-n] [loop-n]
+"""
+import sys
+import time
+from rasm.compiler.parser import parse_string
+from rasm.compiler.astbuilder import Builder
+from rasm.compiler.cps import Rewriter
+from rasm.compiler.codegen import compile_all
+from rasm.rt.image import prelude_image, get_report_env
+from rasm.bench.bench_dispatch import CountingFrame
+from rasm.rt.execution import Frame
+
+FIBO = '''
+(define (main)
+  (define (fibo n)
+    (if (< n 2) n
+        (+ (fibo (- n 1))
+           (fibo (- n 2)))))
+  (fibo %d))
+(main)
+'''
+
+LOOP = '''
+(define (main)
+  (define (sum n s)
+    (if (< n 1) s
+        (sum (- n 1) (+ s n))))
+  (sum %d 0))
+(main)
+'''
+
+def compile_source(source, known_calls):
+    nodelist = Builder(parse_string(source)).getast()
+    cpsform = Rewriter(nodelist, toplevel=True).run()
+    return compile_all(cpsform, get_report_env(), prelude_image.proto_w,
+                       known_calls=known_calls)
+
+def measure(source, known_calls):
+    w_maincont, proto_w = compile_source(source, known_calls)
+    counter = CountingFrame(w_maincont, proto_w)
+    w_ret = counter.run()
+    best = 0.0
+    for i in range(3):
+        w_maincont, proto_w = compile_source(source, known_calls)
+        frame = Frame(w_maincont, proto_w)
+        t0 = time.time()
+        frame.run()
+        elapsed = time.time() - t0
+        if i == 0 or elapsed < best:
+            best = elapsed
+    return w_ret.to_string(), counter.count, best
+
+def main(argv):
+    try:
+        fibo_n = int(argv[1])
+    except (IndexError, ValueError):
+        fibo_n = 18
+    try:
+        loop_n = int(argv[2])
+    except (IndexError, ValueError):
+        loop_n = 30000
+    print '%-12s %10s %22s %22s' % ('program', 'result', 'instructions',
+                                    'time(s)')
+    for name, source in [('fibo %d' % fibo_n, FIBO % fibo_n),
+                         ('loop %d' % loop_n, LOOP % loop_n)]:
+        result, count_cont, t_cont = measure(source, False)
+        result_known, count_known, t_known = measure(source, True)
+        assert result == result_known
+        print '%-12s %10s %10d -> %-9d %10.3f -> %-9.3f' % (
+                name, result, count_cont, count_known, t_cont, t_known)
+    return 0
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,87 @@
+""" Calls with their arguments put in place against calls through the
+    stack.
+
+    Compiles each program with and without place_args and runs it
+    untranslated, alternating, reporting the instructions run and the
+    best of 5 times. The loops pass along locals that stay in their
+    slots and closures, which are put in place without a move in CONT.
+
+    Usage: python -m rasm.bench.bench_cont [n]
+"""
+import sys
+import time
+from rasm.compiler.parser import parse_string
+from rasm.compiler.astbuilder import Builder
+from rasm.compiler.cps import Rewriter
+from rasm.compiler.codegen import compile_all
+from rasm.rt.image import prelude_image, get_report_env
+from rasm.bench.bench_dispatch import CountingFrame
+from rasm.rt.execution import Frame
+
+# Four arguments, three of them in place already.
+STEADY = '''
+(define (loop i a b c)
+  (if (< i 1) (+ a (+ b c))
+      (loop (- i 1) a b c)))
+(loop %d 1 2 3)
+'''
+
+# A new continuation per call.
+CONTS = '''
+(define (count i)
+  (if (< i 1) 0
+      (+ 1 (count (- i 1)))))
+(count %d)
+'''
+
+# Closures passed along.
+CLOSURES = '''
+(define (loop i f g)
+  (if (< i 1) (f (g i))
+      (loop (- i 1) g f)))
+(loop %d (lambda (x) (+ x 1)) (lambda (x) (+ x 2)))
+'''
+
+def compile_source(source, place_args):
+    nodelist = Builder(parse_string(source)).getast()
+    cpsform = Rewriter(nodelist, toplevel=True).run()
+    return compile_all(cpsform, get_report_env(), prelude_image.proto_w,
+                       place_args=place_args)
+
+def count(source, place_args):
+    w_maincont, proto_w = compile_source(source, place_args)
+    counter = CountingFrame(w_maincont, proto_w)
+    w_ret = counter.run()
+    return w_ret.to_string(), counter.count
+
+def timed(source, place_args):
+    w_maincont, proto_w = compile_source(source, place_args)
+    frame = Frame(w_maincont, proto_w)
+    t0 = time.time()
+    frame.run()
+    return time.time() - t0
+
+def main(argv):
+    try:
+        n = int(argv[1])
+    except (IndexError, ValueError):
+        n = 20000
+    print '%-12s %10s %22s %22s' % ('program', 'result', 'instructions',
+                                    'time(s)')
+    for name, source in [('steady', STEADY % n), ('conts', CONTS % (n / 4)),
+                         ('closures', CLOSURES % n)]:
+        result, count_stack = count(source, False)
+        result_placed, count_placed = count(source, True)
+        assert result == result_placed
+        best = [0.0, 0.0]
+        for i in range(5):
+            for j in range(2):
+                elapsed = timed(source, j == 1)
+                if i == 0 or elapsed < best[j]:
+                    best[j] = elapsed
+        print '%-12s %10s %10d -> %-9d %10.3f -> %-9.3f' % (
+                name, result, count_stack, count_placed, best[0], best[1])
+    return 0
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,91 @@
+""" CPS conversion time on synthetic programs, and compile time on
+    deeply nested ones.
+
+    Each shape is compiled at two sizes; with linear passes the time per
+    form (or per level of nesting) stays flat. The nested shapes are one
+    form nested `depth` deep, far past the recursion limit, and go
+    through the whole compiler: astbuilder, cps with simplify, codegen.
+
+    Usage: python -m rasm.bench.bench_cps [forms [depth]]
+"""
+import sys
+import time
+from rasm.compiler.parser import parse_string
+from rasm.compiler.astbuilder import Builder
+from rasm.compiler.cps import Rewriter
+from rasm.compiler.codegen import compile_all
+from rasm.rt.image import prelude_image, get_report_env
+
+def toplevel_forms(n):
+    # n toplevel forms, each one a non-tail call.
+    return '\n'.join(['(display (f %d))' % i for i in xrange(n)])
+
+def long_body(n):
+    # A lambda whose body is n non-tail calls.
+    body = ' '.join(['(g (f %d))' % i for i in xrange(n)])
+    return '(define (h) %s 0)' % body
+
+def wide_call(n):
+    # One call with n non-atomic arguments.
+    return '(g %s)' % ' '.join(['(f %d)' % i for i in xrange(n)])
+
+def nest(head, inner, tail, depth):
+    return head * depth + inner + tail * depth
+
+NESTED = [
+    ('calls', lambda d: '(define (f x) x)' + nest('(f ', '0', ')', d)),
+    ('primitives', lambda d: nest('(+ 1 ', '0', ')', d)),
+    ('ifs', lambda d: nest('(+ 1 (if #t ', '0', ' 0))', d)),
+    ('lets', lambda d: nest('((lambda (x) (+ x ', '0', ')) 1)', d)),
+    ('begins', lambda d: nest('(begin (define x 1) ', 'x', ')', d)),
+    ('quoted', lambda d: "(car '%s)" % nest('(', '', ')', d)),
+]
+
+def time_cps(source):
+    nodelist = Builder(parse_string(source)).getast()
+    t0 = time.time()
+    Rewriter(nodelist, toplevel=True).run()
+    return time.time() - t0
+
+def time_phases(source):
+    exprs_w = parse_string(source)
+    t0 = time.time()
+    nodelist = Builder(exprs_w).getast()
+    t1 = time.time()
+    cpsform = Rewriter(nodelist, toplevel=True).run()
+    t2 = time.time()
+    compile_all(cpsform, get_report_env(), prelude_image.proto_w)
+    t3 = time.time()
+    return t1 - t0, t2 - t1, t3 - t2
+
+def main(argv):
+    try:
+        forms = int(argv[1])
+    except (IndexError, ValueError):
+        forms = 10000
+    try:
+        depth = int(argv[2])
+    except (IndexError, ValueError):
+        depth = 10000
+    print '%-14s %8s %10s %12s' % ('shape', 'forms', 'time(ms)', 'us/form')
+    for name, make in [('toplevel', toplevel_forms), ('body', long_body),
+                       ('wide-call', wide_call)]:
+        for n in [forms, forms * 2]:
+            elapsed = time_cps(make(n))
+            print '%-14s %8d %10.1f %12.2f' % (name, n, elapsed * 1000,
+                                               elapsed * 1e6 / n)
+    print
+    print '%-14s %8s %10s %10s %12s %12s' % ('nested', 'depth', 'ast(ms)',
+                                             'cps(ms)', 'codegen(ms)',
+                                             'us/level')
+    for name, make in NESTED:
+        for d in [depth, depth * 2]:
+            t_ast, t_cps, t_codegen = time_phases(make(d))
+            total = t_ast + t_cps + t_codegen
+            print '%-14s %8d %10.1f %10.1f %12.1f %12.2f' % (
+                name, d, t_ast * 1000, t_cps * 1000, t_codegen * 1000,
+                total * 1e6 / d)
+    return 0
+
+if __name__ == '__main__':
+    main(sys.argv)
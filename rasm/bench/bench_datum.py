@@ -0,0 +1,73 @@
+""" Printing and equal? on big data, before and after datum.py.
+
+    Times to_string() and equal_w() on a flat list of n ints and on n
+    pairs nested in the car, with the recursive versions that pairs had
+    before (copied below) and with datum.py, untranslated, best of 3.
+    'overflow' means the recursive version ran out of stack.
+
+    Usage: python -m rasm.bench.bench_datum [n]
+"""
+import sys
+import time
+from rasm.lang.model import W_Int, W_Pair, list_to_pair, w_nil, w_false
+from rasm.lang.datum import to_string, equal
+
+def old_to_string(w_x):
+    if not isinstance(w_x, W_Pair):
+        return w_x.to_string()
+    items_w, w_rest = w_x.to_list()
+    head = '(' + ' '.join([old_to_string(w_item) for w_item in items_w])
+    if w_rest.is_null():
+        return head + ')'
+    else:
+        return head + ' . ' + old_to_string(w_rest) + ')'
+
+def old_equal(w_x, w_y):
+    if not isinstance(w_x, W_Pair):
+        return w_x.equal_w(w_y).to_bool()
+    if isinstance(w_y, W_Pair):
+        if old_equal(w_x.w_car, w_y.w_car):
+            return old_equal(w_x.w_cdr, w_y.w_cdr)
+    return False
+
+def flat(n):
+    return list_to_pair([W_Int(i) for i in xrange(n)])
+
+def nested(n):
+    w_x = w_nil
+    for i in xrange(n):
+        w_x = W_Pair(w_x, w_nil)
+    return w_x
+
+def measure(func, *args):
+    best = 0.0
+    for i in range(3):
+        t0 = time.time()
+        try:
+            func(*args)
+        except RuntimeError:
+            return 'overflow'
+        elapsed = time.time() - t0
+        if i == 0 or elapsed < best:
+            best = elapsed
+    return '%.3f' % best
+
+def main(argv):
+    try:
+        n = int(argv[1])
+    except (IndexError, ValueError):
+        n = 10 ** 6
+    print '%-8s %-8s %24s' % ('data', 'task', 'time(s) recursive/datum')
+    for name, build in [('flat', flat), ('nested', nested)]:
+        w_x = build(n)
+        w_y = build(n)
+        print '%-8s %-8s %12s %11s' % (name, 'print',
+                                       measure(old_to_string, w_x),
+                                       measure(to_string, w_x))
+        print '%-8s %-8s %12s %11s' % (name, 'equal',
+                                       measure(old_equal, w_x, w_y),
+                                       measure(equal, w_x, w_y))
+    return 0
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,74 @@
+""" Interpreter dispatch speed on fibo.
+
+    Runs (fibo n) untranslated and reports the time and the number of
+    instructions executed per second. Given the path of a translated
+    interp-c (without the JIT, i.e. -O2), also times it on
+    script/fibo.scm.
+
+    Usage: python -m rasm.bench.bench_dispatch [n] [path/to/interp-c]
+"""
+import os
+import sys
+import time
+import subprocess
+from rasm.compiler.parser import parse_string
+from rasm.compiler.astbuilder import Builder
+from rasm.compiler.cps import Rewriter
+from rasm.compiler.codegen import compile_all
+from rasm.rt.image import prelude_image, get_report_env
+from rasm.rt.execution import Frame
+
+FIBO = '''
+(define (fibo n)
+  (if (< n 2) n
+      (+ (fibo (- n 1))
+         (fibo (- n 2)))))
+(fibo %d)
+'''
+
+class CountingFrame(Frame):
+    """ Counts the instructions it runs. """
+    count = 0
+
+    def dispatch(self, code):
+        self.count += 1
+        Frame.dispatch(self, code)
+
+def compile_source(source):
+    nodelist = Builder(parse_string(source)).getast()
+    cpsform = Rewriter(nodelist, toplevel=True).run()
+    return compile_all(cpsform, get_report_env(), prelude_image.proto_w)
+
+def main(argv):
+    try:
+        n = int(argv[1])
+    except (IndexError, ValueError):
+        n = 18
+    w_maincont, proto_w = compile_source(FIBO % n)
+    frame = CountingFrame(w_maincont, proto_w)
+    frame.run()
+    count = frame.count
+
+    best = 0.0
+    for i in range(3):
+        w_maincont, proto_w = compile_source(FIBO % n)
+        frame = Frame(w_maincont, proto_w)
+        t0 = time.time()
+        w_ret = frame.run()
+        elapsed = time.time() - t0
+        if i == 0 or elapsed < best:
+            best = elapsed
+    print '(fibo %d) = %s, %d instructions' % (n, w_ret.to_string(), count)
+    print 'untranslated: %.3f s, %.0f insns/s' % (best, count / best)
+
+    if len(argv) > 2:
+        root = os.path.dirname(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__))))
+        t0 = time.time()
+        subprocess.check_call([argv[2], os.path.join(root, 'script',
+                                                     'fibo.scm')])
+        print 'translated, script/fibo.scm: %.3f s' % (time.time() - t0)
+    return 0
+
+if __name__ == '__main__':
+    main(sys.argv)
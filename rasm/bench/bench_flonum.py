@@ -0,0 +1,88 @@
+""" Flonum kernels through the generic ops against the fl ops.
+
+    Runs script/nbody.scm and script/mandelbrot.scm, scaled down, as
+    written (fl+ fl- fl* fl/ fl<, which check for W_Floats only) and
+    with those replaced by + - * / <, which try W_Ints first, untranslated,
+    and reports the best of 3 times. Both must print the same.
+
+    Usage: python -m rasm.bench.bench_flonum [nbody-steps] [mandelbrot-size]
+"""
+import os
+import sys
+import time
+from StringIO import StringIO
+from rasm.compiler.parser import parse_string
+from rasm.compiler.astbuilder import Builder
+from rasm.compiler.cps import Rewriter
+from rasm.compiler.codegen import compile_all
+from rasm.rt.image import prelude_image, get_report_env
+from rasm.rt.execution import Frame
+
+SCRIPT_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'script')
+
+GENERIC = [('(fl+ ', '(+ '), ('(fl- ', '(- '), ('(fl* ', '(* '),
+           ('(fl/ ', '(/ '), ('(fl< ', '(< ')]
+
+def load_script(name, param, value):
+    """ The script, with its (define param ...) set to value. """
+    with open(os.path.join(SCRIPT_DIR, name)) as f:
+        lines = f.read().split('\n')
+    prefix = '(define %s ' % param
+    for i in range(len(lines)):
+        if lines[i].startswith(prefix):
+            lines[i] = '%s%d)' % (prefix, value)
+    return '\n'.join(lines)
+
+def generic(source):
+    for fl_op, op in GENERIC:
+        source = source.replace(fl_op, op)
+    return source
+
+def compile_source(source):
+    nodelist = Builder(parse_string(source)).getast()
+    cpsform = Rewriter(nodelist, toplevel=True).run()
+    return compile_all(cpsform, get_report_env(), prelude_image.proto_w)
+
+def measure(source):
+    best = 0.0
+    output = ''
+    for i in range(3):
+        w_maincont, proto_w = compile_source(source)
+        frame = Frame(w_maincont, proto_w)
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            t0 = time.time()
+            frame.run()
+            elapsed = time.time() - t0
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        if i == 0 or elapsed < best:
+            best = elapsed
+    return output, best
+
+def main(argv):
+    try:
+        steps = int(argv[1])
+    except (IndexError, ValueError):
+        steps = 50
+    try:
+        size = int(argv[2])
+    except (IndexError, ValueError):
+        size = 20
+    programs = [('nbody %d' % steps,
+                 load_script('nbody.scm', 'steps', steps)),
+                ('mandelbrot %d' % size,
+                 load_script('mandelbrot.scm', 'size', size))]
+    print '%-16s %22s' % ('program', 'generic -> fl time(s)')
+    for name, source in programs:
+        output, t_generic = measure(generic(source))
+        output_fl, t_fl = measure(source)
+        assert output == output_fl
+        print '%-16s %10.3f -> %-9.3f %s' % (
+                name, t_generic, t_fl, ' '.join(output.split()))
+    return 0
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,92 @@
+""" Hash tables against association lists.
+
+    For each size n, builds an equal? hash table and an alist of n int
+    keys, then looks up `lookups` keys spread over them, with
+    hashtable-ref and with assoc. Untranslated, one run each; assoc is
+    skipped ('-') where it would walk more than ASSOC_BUDGET pairs.
+
+    Memory per entry is what a 64-bit translated build would allocate
+    for the table or the alist itself, keys and values not included:
+    one word per slot of the index table and per item of the three
+    dense lists for the table, and two 3-word pairs for the alist.
+
+    Usage: python -m rasm.bench.bench_hashtable [lookups] [n ...]
+"""
+import sys
+import time
+from rasm.compiler.parser import parse_string
+from rasm.compiler.astbuilder import Builder
+from rasm.compiler.cps import Rewriter
+from rasm.compiler.codegen import compile_all
+from rasm.rt.image import prelude_image, get_report_env
+from rasm.rt.execution import Frame
+
+WORD = 8
+ASSOC_BUDGET = 10 ** 6
+
+TABLE = '''
+(define t (make-equal-hashtable))
+(define (fill i)
+  (if (< i %(n)d) (begin (hashtable-set! t i i) (fill (+ i 1))) t))
+(fill 0)
+(define (look j found)
+  (if (< j %(lookups)d)
+      (look (+ j 1)
+            (if (hashtable-ref t (* j %(stride)d) #f) (+ found 1) found))
+      found))
+(cons (look 0 0) t)
+'''
+
+ALIST = '''
+(define (build i acc)
+  (if (< i 0) acc (build (- i 1) (cons (cons i i) acc))))
+(define a (build (- %(n)d 1) '()))
+(define (look j found)
+  (if (< j %(lookups)d)
+      (look (+ j 1)
+            (if (assoc (* j %(stride)d) a) (+ found 1) found))
+      found))
+(cons (look 0 0) a)
+'''
+
+def compile_source(source):
+    nodelist = Builder(parse_string(source)).getast()
+    cpsform = Rewriter(nodelist, toplevel=True).run()
+    return compile_all(cpsform, get_report_env(), prelude_image.proto_w)
+
+def run(source):
+    w_maincont, proto_w = compile_source(source)
+    frame = Frame(w_maincont, proto_w)
+    t0 = time.time()
+    w_ret = frame.run()
+    return w_ret, time.time() - t0
+
+def table_words(w_table):
+    return len(w_table.indices) + 3 * len(w_table.keys_w)
+
+def main(argv):
+    try:
+        lookups = int(argv[1])
+    except (IndexError, ValueError):
+        lookups = 100
+    sizes = [int(arg) for arg in argv[2:]]
+    if not sizes:
+        sizes = [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6]
+    print '%-9s %8s %18s %24s' % ('n', 'found', 'time(s) table/assoc',
+                                  'bytes/entry table/alist')
+    for n in sizes:
+        params = {'n': n, 'lookups': lookups, 'stride': n // lookups}
+        w_ret, t_table = run(TABLE % params)
+        found = w_ret.car_w().to_int()
+        per_entry = table_words(w_ret.cdr_w()) * WORD / float(n)
+        t_alist = '-'
+        if n * lookups / 2 <= ASSOC_BUDGET:
+            w_ret, elapsed = run(ALIST % params)
+            assert w_ret.car_w().to_int() == found
+            t_alist = '%.3f' % elapsed
+        print '%-9d %8d %9.3f %8s %12.1f %11d' % (
+                n, found, t_table, t_alist, per_entry, 6 * WORD)
+    return 0
+
+if __name__ == '__main__':
+    main(sys.argv)
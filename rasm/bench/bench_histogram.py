@@ -0,0 +1,131 @@
+""" Opcode pair and triple frequencies.
+
+    Runs a small workload untranslated, compiled without the
+    superinstructions, and prints the most frequent opcodes, opcode
+    pairs and opcode triples as a share of all the instructions run.
+    This is what compiler/peephole.py picks its sequences from. Then
+    counts the instructions run with the superinstructions on, and times
+    both.
+
+    Usage: python -m rasm.bench.bench_histogram [top]
+"""
+import sys
+import time
+from rasm.rt.code import codenames
+from rasm.compiler.parser import parse_string
+from rasm.compiler.astbuilder import Builder
+from rasm.compiler.cps import Rewriter
+from rasm.compiler.codegen import compile_all
+from rasm.rt.image import prelude_image, get_report_env
+from rasm.rt.execution import Frame
+
+WORKLOAD = [
+    ('fibo', '''
+(define (fibo n)
+  (if (< n 2) n
+      (+ (fibo (- n 1))
+         (fibo (- n 2)))))
+(fibo 15)
+'''),
+    ('sum', '''
+(define (sum n s)
+  (if (< n 1) s
+      (sum (- n 1) (+ s n))))
+(sum 5000 0)
+'''),
+    ('map', '''
+(define (iota n acc)
+  (if (= n 0) acc
+      (iota (- n 1) (cons n acc))))
+(length (reverse (map (lambda (x) (* x 3)) (iota 500 '()))))
+'''),
+]
+
+class HistogramFrame(Frame):
+    """ Counts the opcodes it runs, and the pairs and triples of them. """
+    def __init__(self, w_cont, proto_w, histogram):
+        Frame.__init__(self, w_cont, proto_w)
+        self.histogram = histogram
+
+    def dispatch(self, insns):
+        self.histogram.record(insns[self.pc])
+        Frame.dispatch(self, insns)
+
+class Histogram(object):
+    def __init__(self):
+        self.total = 0
+        self.singles = {}
+        self.pairs = {}
+        self.triples = {}
+        self.prev1 = self.prev2 = -1
+
+    def record(self, opcode):
+        self.total += 1
+        count(self.singles, (opcode,))
+        if self.prev1 != -1:
+            count(self.pairs, (self.prev1, opcode))
+            if self.prev2 != -1:
+                count(self.triples, (self.prev2, self.prev1, opcode))
+        self.prev2 = self.prev1
+        self.prev1 = opcode
+
+    def report(self, top):
+        for title, table in [('opcodes', self.singles),
+                             ('pairs', self.pairs),
+                             ('triples', self.triples)]:
+            print title
+            items = sorted(table.items(), key=lambda item: -item[1])
+            for key, n in items[:top]:
+                print '%7.2f%%  %s' % (100.0 * n / self.total,
+                                       ' '.join([codenames[opcode]
+                                                 for opcode in key]))
+            print
+
+def count(table, key):
+    table[key] = table.get(key, 0) + 1
+
+def compile_source(source, fuse):
+    nodelist = Builder(parse_string(source)).getast()
+    cpsform = Rewriter(nodelist, toplevel=True).run()
+    return compile_all(cpsform, get_report_env(), prelude_image.proto_w,
+                       fuse=fuse)
+
+def measure(source, fuse):
+    """ Returns the instruction count and the best of 3 run times. """
+    histogram = Histogram()
+    w_maincont, proto_w = compile_source(source, fuse)
+    HistogramFrame(w_maincont, proto_w, histogram).run()
+    best = 0.0
+    for i in range(3):
+        w_maincont, proto_w = compile_source(source, fuse)
+        frame = Frame(w_maincont, proto_w)
+        t0 = time.time()
+        frame.run()
+        elapsed = time.time() - t0
+        if i == 0 or elapsed < best:
+            best = elapsed
+    return histogram.total, best
+
+def main(argv):
+    try:
+        top = int(argv[1])
+    except (IndexError, ValueError):
+        top = 15
+    histogram = Histogram()
+    for name, source in WORKLOAD:
+        w_maincont, proto_w = compile_source(source, False)
+        HistogramFrame(w_maincont, proto_w, histogram).run()
+    print '%d instructions' % histogram.total
+    print
+    histogram.report(top)
+
+    print '%-10s %22s %22s' % ('program', 'instructions', 'time(s)')
+    for name, source in WORKLOAD:
+        plain, t_plain = measure(source, False)
+        fused, t_fused = measure(source, True)
+        print '%-10s %10d -> %-9d %10.3f -> %-9.3f' % (name, plain, fused,
+                                                      t_plain, t_fused)
+    return 0
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,75 @@
+""" Loop throughput of the translated interpreter against C.
+
+    Runs the same counting loop as rvirt-polytype/loopsum.c, written as
+    a self tail call, on a translated interp-c (pypy's translate.py -Ojit
+    targetinterp.py), and loopsum.c compiled with cc -O2. Reports
+    nanoseconds per iteration; with the loop header known to the JIT the
+    ratio should stay within a small factor.
+
+    Usage: python -m rasm.bench.bench_loop [path/to/interp-c] [log2(n)]
+"""
+import os
+import sys
+import time
+import tempfile
+import subprocess
+
+LOOP = '''
+(define (loop i n)
+  (if (< i n)
+      (loop (+ i 1) n)
+      i))
+(display (loop 0 %d))
+(newline)
+'''
+
+def repo_root():
+    return os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+
+def timed(args):
+    t0 = time.time()
+    out = subprocess.check_output(args)
+    return time.time() - t0, out.strip()
+
+def main(argv):
+    root = repo_root()
+    try:
+        interp = argv[1]
+    except IndexError:
+        interp = os.path.join(root, 'interp-c')
+    try:
+        log2n = int(argv[2])
+    except (IndexError, ValueError):
+        log2n = 27
+    n = 1 << log2n
+    if not os.path.exists(interp):
+        print '%s not found: translate targetinterp.py with -Ojit first' % (
+            interp)
+        return 1
+
+    tmpdir = tempfile.mkdtemp()
+    scm = os.path.join(tmpdir, 'loop.scm')
+    f = open(scm, 'w')
+    f.write(LOOP % n)
+    f.close()
+    exe = os.path.join(tmpdir, 'loopsum')
+    subprocess.check_call(['cc', '-O2', '-include', 'stdio.h',
+                           '-include', 'stdlib.h', '-o', exe,
+                           os.path.join(root, 'rvirt-polytype', 'loopsum.c')])
+
+    # The first run writes the bytecode cache.
+    timed([interp, scm])
+    t_interp, out_interp = timed([interp, scm])
+    t_c, out_c = timed([exe, str(log2n)])
+    assert out_interp == out_c, (out_interp, out_c)
+
+    print 'iterations: %d' % n
+    print '%-10s %10s %10s' % ('', 'time(s)', 'ns/iter')
+    for name, t in [('interp-c', t_interp), ('loopsum.c', t_c)]:
+        print '%-10s %10.3f %10.2f' % (name, t, t * 1e9 / n)
+    print 'ratio: %.1fx' % (t_interp / t_c)
+    return 0
+
+if __name__ == '__main__':
+    main(sys.argv)
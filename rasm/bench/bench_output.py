@@ -0,0 +1,96 @@
+""" Output ports, buffered against a write per call.
+
+    Runs a loop that displays the ints up to n, one per line, to the
+    current output port (stdout, sent to /dev/null) and to a file port.
+    Each runs once with the ports' buffer and once with BUFFER_SIZE set
+    to 0, which hands every display and newline to os.write() as it
+    comes, like the print statements that PRINT and NEWLINE were.
+    Untranslated, one run each; reports the time and the number of
+    os.write() calls.
+
+    Usage: python -m rasm.bench.bench_output [n]
+"""
+import os
+import sys
+import tempfile
+import time
+from rasm.compiler.parser import parse_string
+from rasm.compiler.astbuilder import Builder
+from rasm.compiler.cps import Rewriter
+from rasm.compiler.codegen import compile_all
+from rasm.rt.image import prelude_image, get_report_env
+from rasm.rt.execution import Frame
+from rasm.lang import port
+
+STDOUT = '''
+(define (loop i)
+  (if (< i %(n)d) (begin (display i) (newline) (loop (+ i 1)))))
+(loop 0)
+'''
+
+FILE = '''
+(define p (open-output-file "%(path)s"))
+(define (loop i)
+  (if (< i %(n)d) (begin (display i p) (newline p) (loop (+ i 1)))))
+(loop 0)
+(close-output-port p)
+'''
+
+class WriteCounter(object):
+    def __init__(self):
+        self.count = 0
+        self.saved = os.write
+
+    def write(self, fd, data):
+        self.count += 1
+        return self.saved(fd, data)
+
+def compile_source(source):
+    nodelist = Builder(parse_string(source)).getast()
+    cpsform = Rewriter(nodelist, toplevel=True).run()
+    return compile_all(cpsform, get_report_env(), prelude_image.proto_w)
+
+def measure(source, buffer_size):
+    w_maincont, proto_w = compile_source(source)
+    frame = Frame(w_maincont, proto_w)
+    counter = WriteCounter()
+    saved_size = port.BUFFER_SIZE
+    saved_stdout = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    sys.stdout.flush()
+    os.dup2(devnull, 1)
+    port.BUFFER_SIZE = buffer_size
+    os.write = counter.write
+    try:
+        t0 = time.time()
+        frame.run()
+        elapsed = time.time() - t0
+    finally:
+        os.write = counter.saved
+        port.BUFFER_SIZE = saved_size
+        os.dup2(saved_stdout, 1)
+        os.close(saved_stdout)
+        os.close(devnull)
+    return elapsed, counter.count
+
+def main(argv):
+    try:
+        n = int(argv[1])
+    except (IndexError, ValueError):
+        n = 10 ** 6
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    params = {'n': n, 'path': path}
+    print '%-8s %-10s %10s %10s' % ('port', 'buffer', 'time(s)', 'writes')
+    try:
+        for name, program in [('stdout', STDOUT), ('file', FILE)]:
+            for buffer_size in [port.BUFFER_SIZE, 0]:
+                elapsed, writes = measure(program % params, buffer_size)
+                print '%-8s %-10d %10.3f %10d' % (name, buffer_size, elapsed,
+                                                  writes)
+    finally:
+        os.remove(path)
+    return 0
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,40 @@
+""" Parse throughput benchmark.
+
+    Usage: python -m rasm.bench.bench_parse [megabytes]
+"""
+import sys
+import time
+from rasm.compiler.parser import Reader, StringSource
+
+SAMPLE = '''
+;; generated
+(define (fibo n)
+  (if (< n 2) n
+      (+ (fibo (- n 1))
+         (fibo (- n 2)))))
+(define alist '((a 1) (b 2) (c . 3) (d -4)))
+(display (assoc 'c alist))
+'''
+
+def make_source(nbytes):
+    return SAMPLE * (nbytes // len(SAMPLE) + 1)
+
+def main(argv):
+    try:
+        megabytes = int(argv[1])
+    except (IndexError, ValueError):
+        megabytes = 4
+    source = make_source(megabytes * 1024 * 1024)
+    t0 = time.time()
+    reader = Reader(StringSource(source))
+    count = 0
+    while reader.read() is not None:
+        count += 1
+    elapsed = time.time() - t0
+    mb = len(source) / (1024.0 * 1024.0)
+    print '%.1f MB, %d toplevel forms in %.2fs: %.2f MB/s' % (
+            mb, count, elapsed, mb / elapsed)
+    return 0
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,50 @@
+""" Code size saved by peephole.py, per proto.
+
+    Compiles every program three times: as codegen emits it, folded,
+    and folded and fused, and prints the bytecode size of each proto
+    that the passes shrink (the prelude image's protos are not counted).
+
+    Usage: python -m rasm.bench.bench_peephole [file.scm ...]
+           (defaults to script/*.scm)
+"""
+import os
+import sys
+from rasm.compiler.parser import parse_string
+from rasm.compiler.astbuilder import Builder
+from rasm.compiler.cps import Rewriter
+from rasm.compiler.codegen import compile_all
+from rasm.rt.image import prelude_image, get_report_env
+from rasm.bench.bench_simplify import default_files
+
+def compile_protos(source, fold, fuse):
+    nodelist = Builder(parse_string(source)).getast()
+    cpsform = Rewriter(nodelist, toplevel=True).run()
+    w_maincont, proto_w = compile_all(cpsform, get_report_env(),
+                                      prelude_image.proto_w,
+                                      fold=fold, fuse=fuse)
+    return [w_maincont.w_proto] + proto_w[len(prelude_image.proto_w):]
+
+def main(argv):
+    filenames = argv[1:] or default_files()
+    print '%-32s %8s %8s %8s' % ('proto', 'bytes', 'folded', 'fused')
+    totals = [0, 0, 0]
+    for filename in filenames:
+        source = open(filename).read()
+        # Codegen is deterministic: the protos come in the same order.
+        plain = compile_protos(source, False, False)
+        folded = compile_protos(source, True, False)
+        fused = compile_protos(source, True, True)
+        print os.path.basename(filename)
+        for i in range(len(plain)):
+            sizes = [len(plain[i].code), len(folded[i].code),
+                     len(fused[i].code)]
+            for j in range(3):
+                totals[j] += sizes[j]
+            if sizes[1] < sizes[0]:
+                print '  %-30s %8d %8d %8d' % (plain[i].name, sizes[0],
+                                               sizes[1], sizes[2])
+    print '%-32s %8d %8d %8d' % ('total', totals[0], totals[1], totals[2])
+    return 0
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,101 @@
+""" Reading a big file of data through an input port.
+
+    Writes a file of about `megabytes` MB of records like
+    (record 17 "name-17" (x . -17) #t), one per line, then times a
+    Scheme loop that reads them all with read and counts them. The file
+    is read with os.read() in INPUT_CHUNK_SIZE chunks and, with --mmap,
+    also through a memory map. Untranslated, one run each.
+
+    Untranslated, rmmap copies what it reads a byte at a time through
+    ll2ctypes, so the --mmap row only means something for small files.
+    There are no floats in the records for the same reason: reading one
+    goes through strtod() and ll2ctypes.
+
+    Usage: python -m rasm.bench.bench_read [megabytes] [--mmap]
+"""
+import os
+import sys
+import tempfile
+import time
+from rasm.compiler.parser import parse_string
+from rasm.compiler.astbuilder import Builder
+from rasm.compiler.cps import Rewriter
+from rasm.compiler.codegen import compile_all
+from rasm.rt.image import prelude_image, get_report_env
+from rasm.rt.execution import Frame
+from rasm.lang import port
+
+RECORD = '(record %d "name-%d" (x . -%d) #t)\n'
+
+COUNT = '''
+(define p (open-input-file "%s"))
+(define (count n) (skip (read p) n))
+(define (skip x n) (if (eof-object? x) n (count (+ n 1))))
+(define n (count 0))
+(close-input-port p)
+n
+'''
+
+def write_data(path, size):
+    """ Returns the number of records written. """
+    f = open(path, 'w')
+    written = 0
+    i = 0
+    lines = []
+    while written < size:
+        line = RECORD % (i, i, i)
+        lines.append(line)
+        written += len(line)
+        i += 1
+        if len(lines) == 10000:
+            f.write(''.join(lines))
+            lines = []
+    f.write(''.join(lines))
+    f.close()
+    return i
+
+def compile_source(source):
+    nodelist = Builder(parse_string(source)).getast()
+    cpsform = Rewriter(nodelist, toplevel=True).run()
+    return compile_all(cpsform, get_report_env(), prelude_image.proto_w)
+
+def measure(path, mmap_threshold):
+    w_maincont, proto_w = compile_source(COUNT % path)
+    frame = Frame(w_maincont, proto_w)
+    saved = port.MMAP_THRESHOLD
+    port.MMAP_THRESHOLD = mmap_threshold
+    try:
+        t0 = time.time()
+        w_count = frame.run()
+        elapsed = time.time() - t0
+    finally:
+        port.MMAP_THRESHOLD = saved
+    return w_count.to_int(), elapsed
+
+def main(argv):
+    args = [arg for arg in argv[1:] if arg != '--mmap']
+    try:
+        megabytes = float(args[0])
+    except (IndexError, ValueError):
+        megabytes = 100.0
+    size = int(megabytes * 1024 * 1024)
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        records = write_data(path, size)
+        modes = [('read', sys.maxint)]
+        if '--mmap' in argv:
+            modes.append(('mmap', 0))
+        print '%-6s %10s %10s %10s' % ('source', 'records', 'time(s)',
+                                       'MB/s')
+        for name, mmap_threshold in modes:
+            count, elapsed = measure(path, mmap_threshold)
+            assert count == records
+            print '%-6s %10d %10.3f %10.2f' % (name, count, elapsed,
+                                               megabytes / elapsed)
+    finally:
+        os.remove(path)
+    return 0
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,61 @@
+""" Static opcode counts with and without the simplify pass.
+
+    For every program, counts the protos and the instructions generated
+    for it (the prelude image's protos are not counted), and among the
+    latter the BUILDCONT/CONT pairs that simplify.py is after.
+
+    Usage: python -m rasm.bench.bench_simplify [file.scm ...]
+           (defaults to script/*.scm)
+"""
+import os
+import sys
+import glob
+from rasm.rt.code import Op, fetch
+from rasm.compiler.parser import parse_string
+from rasm.compiler.astbuilder import Builder
+from rasm.compiler.cps import Rewriter
+from rasm.compiler.codegen import compile_all
+from rasm.rt.image import prelude_image, get_report_env
+
+def compile_protos(source, optimize):
+    nodelist = Builder(parse_string(source)).getast()
+    cpsform = Rewriter(nodelist, toplevel=True, optimize=optimize).run()
+    # Continuations on the control stack would not count as BUILDCONTs.
+    w_maincont, proto_w = compile_all(cpsform, get_report_env(),
+                                      prelude_image.proto_w,
+                                      stack_conts=False)
+    return [w_maincont.w_proto] + proto_w[len(prelude_image.proto_w):]
+
+def count_ops(proto_w):
+    total = buildcont = cont = 0
+    for w_proto in proto_w:
+        code = w_proto.code
+        pc = 0
+        while pc < len(code):
+            opcode, _, pc = fetch(code, pc)
+            total += 1
+            if opcode == Op.BUILDCONT:
+                buildcont += 1
+            elif opcode == Op.CONT:
+                cont += 1
+    return len(proto_w), total, buildcont, cont
+
+def default_files():
+    root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    return sorted(glob.glob(os.path.join(root, 'script', '*.scm')))
+
+def main(argv):
+    filenames = argv[1:] or default_files()
+    print '%-16s %14s %14s %14s %14s' % ('program', 'protos', 'ops',
+                                         'BUILDCONT', 'CONT')
+    for filename in filenames:
+        source = open(filename).read()
+        before = count_ops(compile_protos(source, False))
+        after = count_ops(compile_protos(source, True))
+        columns = ['%6d -> %-4d' % (before[i], after[i]) for i in range(4)]
+        print '%-16s %s' % (os.path.basename(filename), ' '.join(columns))
+    return 0
+
+if __name__ == '__main__':
+    main(sys.argv)
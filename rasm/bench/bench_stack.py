@@ -0,0 +1,125 @@
+""" Continuations on the control stack against continuations on the heap.
+
+    Runs script/fibo.scm and the generator of script/callcc.scm, with a
+    smaller n and a longer list, compiled with and without stack_conts,
+    untranslated. Reports the W_Conts allocated (closures, heap
+    continuations and the ones call/cc reifies), the entries pushed on
+    the control stack, and the best of 3 times. fibo never reifies its
+    stack; the generator does on every element.
+
+    Usage: python -m rasm.bench.bench_stack [fibo-n] [callcc-n]
+"""
+import sys
+import time
+from StringIO import StringIO
+from rasm.rt.code import W_Cont
+from rasm.compiler.parser import parse_string
+from rasm.compiler.astbuilder import Builder
+from rasm.compiler.cps import Rewriter
+from rasm.compiler.codegen import compile_all
+from rasm.rt.image import prelude_image, get_report_env
+from rasm.rt.execution import Frame
+from rasm.bench.bench_alloc import Counter
+
+FIBO = '''
+(define (fibo n)
+  (if (< n 2) n
+      (+ (fibo (- n 1))
+         (fibo (- n 2)))))
+(fibo %d)
+'''
+
+CALLCC = '''
+(define (for-each proc lst)
+  (if (null? lst) #f
+      (begin
+        (proc (car lst))
+        (for-each proc (cdr lst)))))
+
+(define (iota n acc) (if (< n 1) acc (iota (- n 1) (cons n acc))))
+
+(define (generate-one-element-at-a-time lst)
+  (define (control-state return)
+    (for-each
+      (lambda (element)
+        (set! return (call/cc
+                       (lambda (resume-here)
+                        (set! control-state resume-here)
+                        (return element)))))
+      lst)
+    (return 'you-fell-off-the-end))
+  (lambda ()
+    (call/cc control-state)))
+
+(define (sum gen acc)
+  (define x (gen))
+  (if (eq? x 'you-fell-off-the-end) acc
+      (sum gen (+ acc x))))
+
+(sum (generate-one-element-at-a-time (iota %d '())) 0)
+'''
+
+class PushCountingFrame(Frame):
+    """ Counts the continuations it pushes on the control stack. """
+    pushes = 0
+
+    def pushcont(self, index):
+        self.pushes += 1
+        return Frame.pushcont(self, index)
+
+def compile_source(source, stack_conts):
+    nodelist = Builder(parse_string(source)).getast()
+    cpsform = Rewriter(nodelist, toplevel=True).run()
+    return compile_all(cpsform, get_report_env(), prelude_image.proto_w,
+                       stack_conts=stack_conts)
+
+def count(source, stack_conts):
+    w_maincont, proto_w = compile_source(source, stack_conts)
+    conts = Counter(W_Cont)
+    conts.install()
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        frame = PushCountingFrame(w_maincont, proto_w)
+        w_ret = frame.run()
+    finally:
+        sys.stdout = stdout
+        conts.uninstall()
+    return w_ret.to_string(), conts.count, frame.pushes
+
+def timed(source, stack_conts):
+    w_maincont, proto_w = compile_source(source, stack_conts)
+    frame = Frame(w_maincont, proto_w)
+    t0 = time.time()
+    frame.run()
+    return time.time() - t0
+
+def main(argv):
+    try:
+        fibo_n = int(argv[1])
+    except (IndexError, ValueError):
+        fibo_n = 18
+    try:
+        callcc_n = int(argv[2])
+    except (IndexError, ValueError):
+        callcc_n = 2000
+    print '%-14s %10s %20s %10s %20s' % ('program', 'result', 'W_Cont',
+                                         'pushed', 'time(s)')
+    for name, source in [('fibo %d' % fibo_n, FIBO % fibo_n),
+                         ('callcc %d' % callcc_n, CALLCC % callcc_n)]:
+        result, heap_conts, _ = count(source, False)
+        result_stack, stack_heap_conts, pushes = count(source, True)
+        assert result == result_stack
+        best = [0.0, 0.0]
+        for i in range(3):
+            for j in range(2):
+                elapsed = timed(source, j == 1)
+                if i == 0 or elapsed < best[j]:
+                    best[j] = elapsed
+        print '%-14s %10s %9d -> %-8d %10d %9.3f -> %-8.3f' % (
+                name, result, heap_conts, stack_heap_conts, pushes,
+                best[0], best[1])
+    return 0
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,53 @@
+""" Startup latency of an empty script.
+
+    'primitives' is the old startup (prelude.py only, no Scheme stdlib),
+    'stdlib' builds the same environment as the image but compiles
+    stdlib.scm at startup, and 'image' copies the prebuilt image.
+
+    Usage: python -m rasm.bench.bench_startup [iterations]
+"""
+import sys
+import time
+from rasm.compiler.parser import parse_string
+from rasm.compiler.astbuilder import Builder
+from rasm.compiler.cps import Rewriter
+from rasm.compiler.codegen import compile_all
+from rasm.rt.prelude import get_primitive_env
+from rasm.rt.image import (prelude_image, get_report_env, run_stdlib,
+                           load_stdlib_source)
+from rasm.rt.execution import Frame
+
+def run_empty(w_module, base_proto_w):
+    nodelist = Builder(parse_string('')).getast()
+    cpsform = Rewriter(nodelist, toplevel=True).run()
+    w_maincont, proto_w = compile_all(cpsform, w_module, base_proto_w)
+    Frame(w_maincont, proto_w).run()
+
+def start_primitives():
+    run_empty(get_primitive_env(), None)
+
+def start_stdlib():
+    w_module = get_primitive_env()
+    proto_w = run_stdlib(load_stdlib_source(), w_module)
+    run_empty(w_module, proto_w)
+
+def start_image():
+    run_empty(get_report_env(), prelude_image.proto_w)
+
+def main(argv):
+    try:
+        iterations = int(argv[1])
+    except (IndexError, ValueError):
+        iterations = 100
+    for name, func in [('primitives', start_primitives),
+                       ('stdlib', start_stdlib),
+                       ('image', start_image)]:
+        t0 = time.time()
+        for i in xrange(iterations):
+            func()
+        elapsed = (time.time() - t0) / iterations
+        print '%-12s %8.3f ms' % (name, elapsed * 1000)
+    return 0
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,77 @@
+""" Calls to continuations with upvals.
+
+    In CPS every return is a call to a continuation, and most of those
+    continuations have upvals: the values live across the call and the
+    continuation to return to. Runs a closure heavy and a call/cc heavy
+    loop untranslated and reports the best of 3 times, and fibo, whose
+    continuations each carry two upvals.
+
+    Usage: python -m rasm.bench.bench_upval [n]
+"""
+import sys
+import time
+from rasm.compiler.parser import parse_string
+from rasm.compiler.astbuilder import Builder
+from rasm.compiler.cps import Rewriter
+from rasm.compiler.codegen import compile_all
+from rasm.rt.image import prelude_image, get_report_env
+from rasm.rt.execution import Frame
+
+CLOSURES = '''
+(define (make-adder n)
+  (lambda (x) (+ x n)))
+(define (compose f g)
+  (lambda (x) (f (g x))))
+(define (loop i acc)
+  (if (< i 1) acc
+      (loop (- i 1) ((compose (make-adder i) (make-adder 1)) acc))))
+(loop %d 0)
+'''
+
+CALLCC = '''
+(define (loop i acc)
+  (if (< i 1) acc
+      (loop (- i 1) (+ acc (call/cc (lambda (k) (k i)))))))
+(loop %d 0)
+'''
+
+FIBO = '''
+(define (fibo n)
+  (if (< n 2) n
+      (+ (fibo (- n 1))
+         (fibo (- n 2)))))
+(fibo %d)
+'''
+
+def compile_source(source):
+    nodelist = Builder(parse_string(source)).getast()
+    cpsform = Rewriter(nodelist, toplevel=True).run()
+    return compile_all(cpsform, get_report_env(), prelude_image.proto_w)
+
+def measure(source):
+    best = 0.0
+    for i in range(3):
+        w_maincont, proto_w = compile_source(source)
+        frame = Frame(w_maincont, proto_w)
+        t0 = time.time()
+        w_ret = frame.run()
+        elapsed = time.time() - t0
+        if i == 0 or elapsed < best:
+            best = elapsed
+    return w_ret.to_string(), best
+
+def main(argv):
+    try:
+        n = int(argv[1])
+    except (IndexError, ValueError):
+        n = 10000
+    print '%-16s %12s %10s' % ('program', 'result', 'time(s)')
+    for name, source in [('closures %d' % n, CLOSURES % n),
+                         ('call/cc %d' % n, CALLCC % n),
+                         ('fibo 18', FIBO % 18)]:
+        result, elapsed = measure(source)
+        print '%-16s %12s %10.3f' % (name, result, elapsed)
+    return 0
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,119 @@
+""" Vectors against lists of pairs.
+
+    Builds n ints as a list and as a vector, reports the memory each
+    takes, then times summing them in order and reading every index,
+    untranslated, best of 3.
+
+    Memory is what a 64-bit translated build would allocate, counted
+    from the objects built: one word of GC header per object, a word
+    per field, the resizable list behind a vector's storage as a
+    3-word struct plus an array of n items with a 2-word header, and no
+    W_Int boxes with RASM_SMALLINT=1.
+
+    Usage: python -m rasm.bench.bench_vector [n]
+"""
+import sys
+import time
+from rasm.compiler.parser import parse_string
+from rasm.compiler.astbuilder import Builder
+from rasm.compiler.cps import Rewriter
+from rasm.compiler.codegen import compile_all
+from rasm.rt.image import prelude_image, get_report_env
+from rasm.rt.execution import Frame
+from rasm.lang.model import W_Pair, W_Integer
+from rasm.lang.vector import W_Vector, object_strategy
+
+WORD = 8
+
+BUILD = '''
+(define (build-list i acc)
+  (if (< i 1) acc (build-list (- i 1) (cons i acc))))
+(define (fill! v i)
+  (if (< i (vector-length v))
+      (begin (vector-set! v i (+ i 1)) (fill! v (+ i 1)))
+      v))
+(define n %d)
+'''
+
+PROGRAMS = [
+    ('build', 'list', '(build-list n (quote ()))'),
+    ('build', 'vector', '(fill! (make-vector n 0) 0)'),
+    ('sum', 'list', '''
+(define (sum lst acc)
+  (if (null? lst) acc (sum (cdr lst) (+ acc (car lst)))))
+(sum (build-list n '()) 0)'''),
+    ('sum', 'vector', '''
+(define (sum v i acc)
+  (if (< i (vector-length v)) (sum v (+ i 1) (+ acc (vector-ref v i))) acc))
+(sum (fill! (make-vector n 0) 0) 0 0)'''),
+    ('index', 'list', '''
+(define lst (build-list n '()))
+(define (touch i acc)
+  (if (< i n) (touch (+ i 1) (+ acc (list-ref lst i))) acc))
+(touch 0 0)'''),
+    ('index', 'vector', '''
+(define v (fill! (make-vector n 0) 0))
+(define (touch i acc)
+  (if (< i n) (touch (+ i 1) (+ acc (vector-ref v i))) acc))
+(touch 0 0)'''),
+]
+
+def compile_source(source):
+    nodelist = Builder(parse_string(source)).getast()
+    cpsform = Rewriter(nodelist, toplevel=True).run()
+    return compile_all(cpsform, get_report_env(), prelude_image.proto_w)
+
+def box_words(w_x):
+    if isinstance(w_x, W_Integer):
+        return 2
+    return 0
+
+def memory(w_value):
+    """ Bytes, as the docstring above says. """
+    words = 0
+    if isinstance(w_value, W_Vector):
+        n = w_value.length()
+        words = 3 + 3 + 2 + n
+        if w_value.strategy is object_strategy:
+            for i in range(n):
+                words += box_words(w_value.getitem(i))
+    else:
+        while isinstance(w_value, W_Pair):
+            words += 3 + box_words(w_value.w_car)
+            w_value = w_value.w_cdr
+    return words * WORD
+
+def measure(source):
+    best = 0.0
+    w_ret = None
+    for i in range(3):
+        w_maincont, proto_w = compile_source(source)
+        frame = Frame(w_maincont, proto_w)
+        t0 = time.time()
+        w_ret = frame.run()
+        elapsed = time.time() - t0
+        if i == 0 or elapsed < best:
+            best = elapsed
+    return w_ret, best
+
+def main(argv):
+    try:
+        n = int(argv[1])
+    except (IndexError, ValueError):
+        n = 300
+    print '%-8s %-8s %12s %10s %12s' % ('task', 'data', 'result',
+                                        'time(s)', 'memory(B)')
+    for task, data, body in PROGRAMS:
+        w_ret, elapsed = measure(BUILD % n + body)
+        if task == 'build':
+            result = '%d items' % n
+            size = '%d' % memory(w_ret)
+        else:
+            result = w_ret.to_string()
+            size = ''
+        print '%-8s %-8s %12s %10.3f %12s' % (task, data, result, elapsed,
+                                              size)
+    return 0
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,48 @@
+""" Compile time of protos with many constants.
+
+    Compiles a program of n toplevel defines of distinct quoted symbols,
+    whose main proto has 2n constants (the names and the symbols), for
+    n up to 10000, and runs it once to check the last one. The constant
+    pool is a dict, so the time per constant should stay flat.
+
+    Usage: python -m rasm.bench.bench_wide [n ...]
+"""
+import sys
+import time
+from rasm.compiler.parser import parse_string
+from rasm.compiler.astbuilder import Builder
+from rasm.compiler.cps import Rewriter
+from rasm.compiler.codegen import compile_all
+from rasm.rt.image import prelude_image, get_report_env
+from rasm.rt.execution import Frame
+
+def make_program(n):
+    lines = ["(define g%d 'c%d)" % (i, i) for i in xrange(n)]
+    lines.append('g%d' % (n - 1))
+    return '\n'.join(lines)
+
+def compile_source(source):
+    nodelist = Builder(parse_string(source)).getast()
+    cpsform = Rewriter(nodelist, toplevel=True).run()
+    return compile_all(cpsform, get_report_env(), prelude_image.proto_w)
+
+def main(argv):
+    sizes = [int(arg) for arg in argv[1:]] or [1000, 2000, 5000, 10000]
+    print '%8s %8s %10s %10s %12s' % ('n', 'consts', 'bytes', 'time(s)',
+                                      'us/const')
+    for n in sizes:
+        source = make_program(n)
+        t0 = time.time()
+        w_maincont, proto_w = compile_source(source)
+        elapsed = time.time() - t0
+        w_proto = w_maincont.w_proto
+        nb_consts = len(w_proto.const_w)
+        w_ret = Frame(w_maincont, proto_w).run()
+        assert w_ret.to_string() == 'c%d' % (n - 1)
+        print '%8d %8d %10d %10.3f %12.1f' % (n, nb_consts,
+                                              len(w_proto.code), elapsed,
+                                              elapsed * 1e6 / nb_consts)
+    return 0
+
+if __name__ == '__main__':
+    main(sys.argv)
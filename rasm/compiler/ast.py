@@ -10,6 +10,16 @@ class Node(object):
     def to_string(self):
         return '(Node)'
 
+    def children(self):
+        """ The subexpressions, in evaluation order. A lambda's body is
+            not one: the passes queue those.
+        """
+        return []
+
+    def rebuild(self, children):
+        """ A copy with the given children in place of children(). """
+        return self
+
 class If(Node):
     def __init__(self, fst, snd, trd=None):
         if trd is None:
@@ -22,6 +32,12 @@ class If(Node):
         return '(If %s %s %s)' % (self.fst.to_string(), self.snd.to_string(),
                                                         self.trd.to_string())
 
+    def children(self):
+        return [self.fst, self.snd, self.trd]
+
+    def rebuild(self, children):
+        return If(children[0], children[1], children[2])
+
 class Seq(Node):
     def __init__(self, nodelist):
         self.nodelist = nodelist
@@ -29,6 +45,12 @@ class Seq(Node):
     def to_string(self):
         return '(Seq %s)' % show_list(self.nodelist, lparen='', rparen='')
 
+    def children(self):
+        return self.nodelist
+
+    def rebuild(self, children):
+        return Seq(children)
+
 
 class Apply(Node):
     def __init__(self, proc, args):
@@ -39,6 +61,12 @@ class Apply(Node):
         return '(Apply %s %s)' % (self.proc.to_string(),
                                   show_list(self.args, lparen='[', rparen=']'))
 
+    def children(self):
+        return [self.proc] + self.args
+
+    def rebuild(self, children):
+        return Apply(children[0], children[1:])
+
 class PrimitiveOp(Node):
     def __init__(self, proc, args):
         self.proc = proc
@@ -49,7 +77,17 @@ class PrimitiveOp(Node):
                                         show_list(self.args,
                                                   lparen='[', rparen=']'))
 
+    def children(self):
+        # self.proc names the operation, it is not evaluated.
+        return self.args
+
+    def rebuild(self, children):
+        return PrimitiveOp(self.proc, children)
+
 class Def(Node):
+    # Set by cps.py on the defines that go to the module.
+    toplevel = False
+
     def __init__(self, name, form):
         self.name = name
         self.form = form
@@ -57,6 +95,14 @@ class Def(Node):
     def to_string(self):
         return '(Def %s %s)' % (self.name.to_string(), self.form.to_string())
 
+    def children(self):
+        return [self.form]
+
+    def rebuild(self, children):
+        newdef = Def(self.name, children[0])
+        newdef.toplevel = self.toplevel
+        return newdef
+
 class Sete(Node):
     def __init__(self, name, form):
         self.name = name
@@ -65,11 +111,19 @@ class Sete(Node):
     def to_string(self):
         return '(Set! %s %s)' % (self.name.to_string(), self.form.to_string())
 
+    def children(self):
+        return [self.form]
+
+    def rebuild(self, children):
+        return Sete(self.name, children[0])
+
 class Lambda(Node):
-    def __init__(self, formals, body, name='#f'):
+    def __init__(self, formals, body, name='#f', is_cont=False):
         self.name = name
         self.formals = formals
         self.body = body
+        # Made by cps.py for the rest of a computation, see escape.py.
+        self.is_cont = is_cont
 
     def to_string(self):
         return '(Lambda %s %s %s)' % (self.name, show_list(self.formals,
@@ -99,3 +153,47 @@ def show_list(nodelist, lparen='(', rparen=')'):
             ' '.join([node.to_string() for node in nodelist]) +
             rparen)
 
+
+class Mapper(object):
+    """ Maps a tree to a new one bottom up, from an explicit stack rather
+        than recursively. replace() may swap a node for another one to
+        map in its place, and leave() gets each node with its children
+        mapped already.
+    """
+    def replace(self, node):
+        return node
+
+    def leave(self, node, children):
+        raise NotImplementedError
+
+    def map(self, node):
+        todo = [node]
+        # For each node on todo: -1 to enter it, or the number of its
+        # children that are mapped on values.
+        nb_children = [-1]
+        values = []
+        while todo:
+            node = todo.pop()
+            n = nb_children.pop()
+            if n >= 0:
+                start = len(values) - n
+                assert start >= 0
+                children = values[start:]
+                del values[start:]
+                values.append(self.leave(node, children))
+                continue
+            while True:
+                newnode = self.replace(node)
+                if newnode is node:
+                    break
+                node = newnode
+            children = node.children()
+            if not children:
+                values.append(self.leave(node, children))
+                continue
+            todo.append(node)
+            nb_children.append(len(children))
+            for i in xrange(len(children) - 1, -1, -1):
+                todo.append(children[i])
+                nb_children.append(-1)
+        return values.pop()
@@ -1,5 +1,6 @@
-from rasm.lang.model import (W_Root, W_Int, W_Boolean, W_Unspecified, W_Eof,
-                             W_Pair, W_Nil, W_Symbol,
+from rasm.lang.model import (W_Root, W_Int, W_BigInt, W_Float, W_Boolean,
+                             W_String, W_Char, W_Unspecified, W_Eof, W_Pair,
+                             W_Nil, W_Symbol,
                              symbol, list_to_pair,
                              w_nil, w_true, w_false, w_unspec,
                              W_ValueError, W_TypeError)
@@ -13,29 +14,118 @@ class Builder(object):
 
     def getast(self):
         for w_expr in self.exprs_w:
-            self.astlist.append(w_expr.to_ast())
+            self.astlist.append(build_ast(w_expr))
         self.exprs_w = None
         return self.astlist
 
+def build_ast(w_expr):
+    """ The subforms of a form are built from an explicit stack rather
+        than recursively, so that deep nesting does not hit the recursion
+        limit. to_ast() returns the node of an atom, or pushes a Pending
+        for a compound form and returns None.
+    """
+    stack = []
+    node = w_expr.to_ast(stack)
+    while True:
+        if node is not None:
+            if not stack:
+                return node
+            stack[-1].nodes.append(node)
+        pending = stack[-1]
+        i = len(pending.nodes)
+        if i < len(pending.subforms_w):
+            node = pending.subforms_w[i].to_ast(stack)
+        else:
+            stack.pop()
+            node = pending.finish()
+
+class Pending(object):
+    """ A form whose subforms are being built. """
+    def __init__(self, subforms_w):
+        self.subforms_w = subforms_w
+        self.nodes = []
+
+    def finish(self):
+        raise NotImplementedError
+
+class PendingIf(Pending):
+    def finish(self):
+        return If(self.nodes[0], self.nodes[1], self.nodes[2])
+
+class PendingDef(Pending):
+    """ For (define (name formals...) body...), the lambda is pushed
+        right above and is the one node.
+    """
+    def __init__(self, w_name, subforms_w):
+        Pending.__init__(self, subforms_w)
+        self.w_name = w_name
+
+    def finish(self):
+        form = self.nodes[0]
+        if isinstance(form, Lambda):
+            form.name = self.w_name.sval
+        return Def(Var(self.w_name), form)
+
+class PendingSete(Pending):
+    def __init__(self, w_name, subforms_w):
+        Pending.__init__(self, subforms_w)
+        self.w_name = w_name
+
+    def finish(self):
+        return Sete(Var(self.w_name), self.nodes[0])
+
+class PendingLambda(Pending):
+    def __init__(self, argnodes, subforms_w):
+        Pending.__init__(self, subforms_w)
+        self.argnodes = argnodes
+
+    def finish(self):
+        return Lambda(self.argnodes, self.nodes)
+
+class PendingSeq(Pending):
+    def finish(self):
+        return Seq(self.nodes)
+
+class PendingPrimitive(Pending):
+    def __init__(self, w_proc, subforms_w):
+        Pending.__init__(self, subforms_w)
+        self.w_proc = w_proc
+
+    def finish(self):
+        from rasm.compiler.codegen import optional_ports
+        args = self.nodes
+        tagname = self.w_proc.sval
+        if tagname in optional_ports:
+            arity, port_name = optional_ports[tagname]
+            if len(args) == arity:
+                args.append(PrimitiveOp(Var(symbol(port_name)), []))
+        return PrimitiveOp(Var(self.w_proc), args)
+
+class PendingApply(Pending):
+    """ The procedure is the first subform. """
+    def finish(self):
+        return Apply(self.nodes[0], self.nodes[1:])
+
 class __extend__(W_Root):
-    def to_ast(self):
+    def to_ast(self, stack):
         raise NotImplementedError
 
-class __extend__(W_Int, W_Unspecified, W_Boolean, W_Eof):
-    def to_ast(self):
+class __extend__(W_Int, W_BigInt, W_Float, W_String, W_Char,
+                 W_Unspecified, W_Boolean, W_Eof):
+    def to_ast(self, stack):
         return Const(self)
 
 class __extend__(W_Symbol):
-    def to_ast(self):
+    def to_ast(self, stack):
         return Var(self)
 
 class __extend__(W_Nil):
-    def to_ast(self):
+    def to_ast(self, stack):
         raise W_ValueError('illegal empty application', self,
                            'to_ast()').wrap()
 
 class __extend__(W_Pair):
-    def to_ast(self):
+    def to_ast(self, stack):
         from rasm.compiler.codegen import primitivemap
         items_w, w_rest = self.to_list()
         if not w_rest.is_null():
@@ -47,43 +137,40 @@ class __extend__(W_Pair):
             # special forms
             tagname = w_proc.sval
             if tagname == 'if':
-                return build_if(self, w_args)
+                return build_if(self, w_args, stack)
             elif tagname == 'define':
-                return build_def(self, w_args)
+                return build_def(self, w_args, stack)
             elif tagname == 'set!':
-                return build_sete(self, w_args)
+                return build_sete(self, w_args, stack)
             elif tagname == 'quote':
                 return build_quote(self, w_args)
             elif tagname == 'lambda':
-                return build_lambda(self, w_args)
+                return build_lambda(self, w_args, stack)
             elif tagname == 'begin':
-                return build_seq(self, w_args)
+                return build_seq(self, w_args, stack)
             elif tagname in primitivemap: # XXX: should consider set!
-                return PrimitiveOp(w_proc.to_ast(),
-                                   [w_x.to_ast() for w_x in w_args])
+                stack.append(PendingPrimitive(w_proc, w_args))
+                return None
 
         # normal application
-        procnode = w_proc.to_ast()
-        argnodes = [w_x.to_ast() for w_x in w_args]
-        return Apply(procnode, argnodes)
+        stack.append(PendingApply(items_w))
+        return None
 
 
 ################################################################################
 # Implementations
 ################################################################################
 
-def build_if(w_form, w_args):
+def build_if(w_form, w_args, stack):
     if not len(w_args) in (2, 3):
         raise W_ValueError('if requires 2 or 3 args',
                            w_form, 'build_if()').wrap()
     if len(w_args) == 2:
-        w_fst, w_snd = w_args
-        w_trd = w_unspec
-    else:
-        w_fst, w_snd, w_trd = w_args
-    return If(w_fst.to_ast(), w_snd.to_ast(), w_trd.to_ast())
+        w_args = w_args + [w_unspec]
+    stack.append(PendingIf(w_args))
+    return None
 
-def build_def(w_form, w_args):
+def build_def(w_form, w_args, stack):
     if len(w_args) < 2:
         raise W_ValueError('define requires at least 2 args',
                            w_form, 'build_def()').wrap()
@@ -92,24 +179,21 @@ def build_def(w_form, w_args):
         if len(w_args) != 2:
             raise W_ValueError('define variable requires 2 args',
                                w_form, 'build_def()').wrap()
-        w_name = w_first
-        form = w_args[1].to_ast()
+        stack.append(PendingDef(w_first, [w_args[1]]))
+        return None
     elif isinstance(w_first, W_Pair): # is pair, we are defining lambda
         name_formals_w, w_rest = w_first.to_list()
         w_name = name_formals_w[0]
+        if not isinstance(w_name, W_Symbol):
+            raise W_TypeError('Symbol', w_name, 'build_def()').wrap()
         formals_w = list_to_pair(name_formals_w[1:], w_rest)
         w_lambda_form = [formals_w] + w_args[1:]
-        form = build_lambda(w_form, w_lambda_form)
+        stack.append(PendingDef(w_name, []))
+        return build_lambda(w_form, w_lambda_form, stack)
     else:
         raise W_TypeError('Pair or Symbol', w_first, 'build_def()').wrap()
 
-    if not isinstance(w_name, W_Symbol):
-        raise W_TypeError('Symbol', w_name, 'build_def()').wrap()
-    if isinstance(form, Lambda):
-        form.name = w_name.sval
-    return Def(Var(w_name), form)
-
-def build_sete(w_form, w_args):
+def build_sete(w_form, w_args, stack):
     if len(w_args) != 2:
         raise W_ValueError('set! requires 2 args',
                            w_form, 'build_sete()').wrap()
@@ -117,7 +201,8 @@ def build_sete(w_form, w_args):
     if not isinstance(w_first, W_Symbol):
         raise W_TypeError('Symbol', w_first, 'build_sete()').wrap()
 
-    return Sete(Var(w_first), w_args[1].to_ast())
+    stack.append(PendingSete(w_first, [w_args[1]]))
+    return None
 
 def build_quote(w_form, w_args):
     if len(w_args) != 1:
@@ -125,7 +210,7 @@ def build_quote(w_form, w_args):
                            w_form, 'build_quote()').wrap()
     return Const(w_args[0])
 
-def build_lambda(w_form, w_args):
+def build_lambda(w_form, w_args, stack):
     w_formals = w_args[0]
     body_w = w_args[1:]
     posargs_w, w_rest = w_formals.to_list()
@@ -138,8 +223,9 @@ def build_lambda(w_form, w_args):
         if not isinstance(w_arg, W_Symbol):
             raise W_TypeError('Symbol', w_arg, 'build_lambda()').wrap()
         argnodes[i] = Var(w_arg)
-    return Lambda(argnodes, [w_x.to_ast() for w_x in body_w])
-
-def build_seq(w_form, w_args):
-    return Seq([w_x.to_ast() for w_x in w_args])
+    stack.append(PendingLambda(argnodes, body_w))
+    return None
 
+def build_seq(w_form, w_args, stack):
+    stack.append(PendingSeq(w_args))
+    return None
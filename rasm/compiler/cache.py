@@ -0,0 +1,383 @@
+""" cache.py
+
+    On-disk cache for compiled programs.
+
+    A cache file holds the proto table returned by compile_all. It is keyed
+    by the md5 of the source, of the opcode table, of the compiler's own
+    source and of the prelude image the program was compiled against, so
+    a stale cache is simply ignored and rebuilt. The image's own protos,
+    which head the table, are not written out. Layout (integers are
+    little-endian):
+
+        magic 'RASMC', version u8,
+        source hash, opcode table hash, compiler hash,
+        image hash (16 bytes each),
+        u32 nb_image_protos, main proto, u32 nb_protos, protos...
+
+    with each proto being
+
+        name, code (strings: u32 length + bytes),
+        u32 nb_upvals, upval_descr (u32 each),
+        nb_args u32, nb_locals u32, u32 nb_consts, consts...
+
+    Constants are tagged values; lists are written flat (items then tail)
+    so long quoted lists don't recurse, and nested ones are written and
+    read from a stack.
+"""
+import os
+from pypy.rlib.rstring import StringBuilder
+from pypy.rlib.rarithmetic import intmask
+from pypy.rlib.rmd5 import RMD5
+from pypy.rlib.streamio import open_file_as_stream, StreamError
+from pypy.rlib.rbigint import rbigint
+from pypy.rlib.rfloat import string_to_float
+from rasm.lang.model import (W_Int, W_BigInt, W_Float, W_Pair, W_Symbol,
+                             W_String, W_Char, symbol,
+                             w_nil, w_true, w_false, w_unspec, w_eof,
+                             wrap_int, wrap_bigint)
+from rasm.rt.code import W_Proto, W_Cont, BytecodeError, codehash
+from rasm.compiler.parser import CHUNK_SIZE
+
+MAGIC = 'RASMC'
+VERSION = 7
+
+NO_IMAGE_HASH = '\0' * 16
+
+TAG_INT = 'i'
+TAG_BIGINT = 'b'
+TAG_FLOAT = 'd'
+TAG_SYMBOL = 's'
+TAG_STRING = 'q'
+TAG_CHAR = 'c'
+TAG_LIST = 'l'
+TAG_NIL = 'n'
+TAG_TRUE = 't'
+TAG_FALSE = 'f'
+TAG_UNSPEC = 'u'
+TAG_EOF = 'e'
+
+class CacheError(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+def source_hash(source):
+    return RMD5(source).digest()
+
+def file_hash(filename):
+    """ source_hash() of a file, read a chunk at a time. """
+    md5 = RMD5()
+    fp = open_file_as_stream(filename)
+    try:
+        while True:
+            chunk = fp.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            md5.update(chunk)
+    finally:
+        fp.close()
+    return md5.digest()
+
+# The modules that decide what ends up in the protos: the compiler
+# passes, the bytecode encoding of rt/code.py and the constants of
+# lang/model.py. Paths are relative to the rasm package. Hashed at import
+# time, so that any change to them makes the old caches stale.
+COMPILER_MODULES = ['compiler/parser.py', 'compiler/syntax.py',
+                    'compiler/ast.py', 'compiler/astbuilder.py',
+                    'compiler/cps.py', 'compiler/simplify.py',
+                    'compiler/escape.py', 'compiler/codegen.py',
+                    'compiler/peephole.py', 'rt/code.py', 'lang/model.py']
+
+def compiler_hash():
+    md5 = RMD5()
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for path in COMPILER_MODULES:
+        f = open(os.path.join(root, path))
+        try:
+            md5.update(f.read())
+        finally:
+            f.close()
+    return md5.digest()
+
+compilerhash = compiler_hash()
+
+def cache_path(filename):
+    return filename + 'c'
+
+################################################################################
+# Writing
+
+class Dumper(object):
+    def __init__(self):
+        self.builder = StringBuilder()
+
+    def getvalue(self):
+        return self.builder.build()
+
+    def byte(self, c):
+        self.builder.append(c)
+
+    def u32(self, i):
+        assert i >= 0
+        for shift in [0, 8, 16, 24]:
+            self.builder.append(chr((i >> shift) & 0xff))
+
+    def i64(self, i):
+        for shift in [0, 8, 16, 24, 32, 40, 48, 56]:
+            self.builder.append(chr((i >> shift) & 0xff))
+
+    def string(self, s):
+        self.u32(len(s))
+        self.builder.append(s)
+
+    def value(self, w_val):
+        todo = [w_val]
+        while todo:
+            w_val = todo.pop()
+            if isinstance(w_val, W_Pair):
+                items_w, w_rest = w_val.to_list()
+                self.byte(TAG_LIST)
+                self.u32(len(items_w))
+                todo.append(w_rest)
+                for i in xrange(len(items_w) - 1, -1, -1):
+                    todo.append(items_w[i])
+            else:
+                self.atom(w_val)
+
+    def atom(self, w_val):
+        if isinstance(w_val, W_Int):
+            self.byte(TAG_INT)
+            self.i64(w_val.to_int())
+        elif isinstance(w_val, W_BigInt):
+            # In decimal: the digits of an rbigint depend on the build.
+            self.byte(TAG_BIGINT)
+            self.string(w_val.bigval.str())
+        elif isinstance(w_val, W_Float):
+            # The shortest repr reads back to the same float.
+            self.byte(TAG_FLOAT)
+            self.string(w_val.to_string())
+        elif isinstance(w_val, W_Symbol):
+            self.byte(TAG_SYMBOL)
+            self.string(w_val.sval)
+        elif isinstance(w_val, W_String):
+            self.byte(TAG_STRING)
+            self.string(w_val.sval)
+        elif isinstance(w_val, W_Char):
+            self.byte(TAG_CHAR)
+            self.byte(w_val.chval)
+        elif w_val is w_nil:
+            self.byte(TAG_NIL)
+        elif w_val is w_true:
+            self.byte(TAG_TRUE)
+        elif w_val is w_false:
+            self.byte(TAG_FALSE)
+        elif w_val is w_unspec:
+            self.byte(TAG_UNSPEC)
+        elif w_val is w_eof:
+            self.byte(TAG_EOF)
+        else:
+            raise CacheError('cannot serialize %s' % w_val.to_string())
+
+    def proto(self, w_proto):
+        self.string(w_proto.name)
+        self.string(w_proto.code)
+        if w_proto.upval_descr:
+            self.u32(len(w_proto.upval_descr))
+            for index in w_proto.upval_descr:
+                self.u32(index)
+        else:
+            self.u32(0)
+        self.u32(w_proto.nb_args)
+        self.u32(w_proto.nb_locals)
+        if w_proto.const_w:
+            self.u32(len(w_proto.const_w))
+            for w_val in w_proto.const_w:
+                self.value(w_val)
+        else:
+            self.u32(0)
+
+def image_key(image):
+    if image is None:
+        return NO_IMAGE_HASH, 0
+    return image.hash, len(image.proto_w)
+
+def dump_program(w_maincont, proto_w, srchash, image=None):
+    imagehash, nb_base = image_key(image)
+    dumper = Dumper()
+    dumper.builder.append(MAGIC)
+    dumper.byte(chr(VERSION))
+    dumper.builder.append(srchash)
+    dumper.builder.append(codehash)
+    dumper.builder.append(compilerhash)
+    dumper.builder.append(imagehash)
+    dumper.u32(nb_base)
+    dumper.proto(w_maincont.w_proto)
+    dumper.u32(len(proto_w) - nb_base)
+    for i in xrange(nb_base, len(proto_w)):
+        dumper.proto(proto_w[i])
+    return dumper.getvalue()
+
+################################################################################
+# Reading
+
+class Loader(object):
+    def __init__(self, data, w_module):
+        self.data = data
+        self.pos = 0
+        self.w_module = w_module
+
+    def take(self, n):
+        start = self.pos
+        stop = start + n
+        if n < 0 or stop > len(self.data):
+            raise CacheError('truncated cache')
+        assert start >= 0
+        assert stop >= 0
+        self.pos = stop
+        return self.data[start:stop]
+
+    def byte(self):
+        start = self.pos
+        if start >= len(self.data):
+            raise CacheError('truncated cache')
+        self.pos = start + 1
+        return self.data[start]
+
+    def u32(self):
+        i = 0
+        for shift in [0, 8, 16, 24]:
+            i |= ord(self.byte()) << shift
+        assert i >= 0
+        return i
+
+    def i64(self):
+        i = 0
+        for shift in [0, 8, 16, 24, 32, 40, 48, 56]:
+            i |= ord(self.byte()) << shift
+        return intmask(i)
+
+    def string(self):
+        return self.take(self.u32())
+
+    def value(self):
+        lists = []     # the lists being read: items, then the tail
+        counts = []    # how much of each is read
+        while True:
+            tag = self.byte()
+            if tag == TAG_LIST:
+                lists.append([None] * (self.u32() + 1))
+                counts.append(0)
+                continue
+            w_val = self.atom(tag)
+            while True:
+                if not lists:
+                    return w_val
+                items_w = lists[-1]
+                items_w[counts[-1]] = w_val
+                counts[-1] += 1
+                if counts[-1] < len(items_w):
+                    break
+                lists.pop()
+                counts.pop()
+                w_val = items_w[-1]
+                for i in xrange(len(items_w) - 2, -1, -1):
+                    w_val = W_Pair(items_w[i], w_val)
+
+    def atom(self, tag):
+        if tag == TAG_INT:
+            # Builds with and without tagged ints share caches: either
+            # may have written what does not fit in the other's W_Int.
+            return wrap_int(self.i64())
+        elif tag == TAG_BIGINT:
+            return wrap_bigint(rbigint.fromdecimalstr(self.string()))
+        elif tag == TAG_FLOAT:
+            return W_Float(string_to_float(self.string()))
+        elif tag == TAG_SYMBOL:
+            return symbol(self.string())
+        elif tag == TAG_STRING:
+            return W_String(self.string())
+        elif tag == TAG_CHAR:
+            return W_Char(self.byte())
+        elif tag == TAG_NIL:
+            return w_nil
+        elif tag == TAG_TRUE:
+            return w_true
+        elif tag == TAG_FALSE:
+            return w_false
+        elif tag == TAG_UNSPEC:
+            return w_unspec
+        elif tag == TAG_EOF:
+            return w_eof
+        raise CacheError('unknown constant tag %d' % ord(tag))
+
+    def proto(self):
+        name = self.string()
+        code = self.string()
+        upval_descr = [0] * self.u32()
+        for i in xrange(len(upval_descr)):
+            upval_descr[i] = self.u32()
+        nb_args = self.u32()
+        nb_locals = self.u32()
+        const_w = [None] * self.u32()
+        for i in xrange(len(const_w)):
+            const_w[i] = self.value()
+        w_proto = W_Proto(code, nb_args, nb_locals, upval_descr, const_w,
+                          self.w_module)
+        w_proto.name = name
+        return w_proto
+
+def load_program(data, srchash, w_module, image=None):
+    """ Returns (w_maincont, proto_w) like compile_all, or raises
+        CacheError if the data is stale or malformed.
+    """
+    imagehash, nb_base = image_key(image)
+    loader = Loader(data, w_module)
+    if loader.take(len(MAGIC)) != MAGIC:
+        raise CacheError('bad magic')
+    if ord(loader.byte()) != VERSION:
+        raise CacheError('version mismatch')
+    if loader.take(len(srchash)) != srchash:
+        raise CacheError('source changed')
+    if loader.take(len(codehash)) != codehash:
+        raise CacheError('opcode table changed')
+    if loader.take(len(compilerhash)) != compilerhash:
+        raise CacheError('compiler changed')
+    if (loader.take(len(imagehash)) != imagehash or
+            loader.u32() != nb_base):
+        raise CacheError('prelude image changed')
+    w_mainproto = loader.proto()
+    proto_w = [None] * (nb_base + loader.u32())
+    for i in xrange(nb_base):
+        proto_w[i] = image.proto_w[i]
+    for i in xrange(nb_base, len(proto_w)):
+        proto_w[i] = loader.proto()
+        proto_w[i].index = i
+    if loader.pos != len(data):
+        raise CacheError('trailing data')
+    return W_Cont(w_mainproto, None), proto_w
+
+################################################################################
+# Files
+
+def read_cache(path, srchash, w_module, image=None):
+    """ Returns (w_maincont, proto_w), or (None, None) on a cache miss. """
+    try:
+        fp = open_file_as_stream(path, 'rb')
+        try:
+            data = fp.readall()
+        finally:
+            fp.close()
+        return load_program(data, srchash, w_module, image)
+    except (OSError, StreamError, CacheError, BytecodeError):
+        return None, None
+
+def write_cache(path, w_maincont, proto_w, srchash, image=None):
+    """ Best effort: a cache that cannot be written is not an error. """
+    try:
+        data = dump_program(w_maincont, proto_w, srchash, image)
+        fp = open_file_as_stream(path, 'wb')
+        try:
+            fp.write(data)
+        finally:
+            fp.close()
+    except (OSError, StreamError, CacheError):
+        pass
@@ -7,34 +7,116 @@ from rasm.compiler.ast import (Node, If, Seq, Apply, Def, Sete, Lambda,
                                Var, Const, PrimitiveOp)
 from rasm.lang.model import symbol
 from rasm.lang.env import ModuleDict
-from rasm.rt.code import Op, W_Proto, W_Cont
-
-def compile_all(node, module_w):
+from rasm.compiler.peephole import peephole
+from rasm.compiler.simplify import Census
+from rasm.compiler.escape import stack_conts as find_stack_conts
+from rasm.rt.code import Op, W_Proto, W_Cont, emit
+
+def compile_all(node, module_w, base_proto_w=None, fold=True, fuse=True,
+                known_calls=True, place_args=True, stack_conts=True):
+    """ base_proto_w, if given, becomes the head of the proto table.
+        This is how programs share the prelude image's protos.
+        fold and fuse switch the passes of peephole.py, known_calls the
+        use of CALLKNOWN, place_args that of SETARG and stack_conts that
+        of PUSHCONT.
+    """
     interp = AbstractInterpreter(args=None, node=node)
     interp.module_w = module_w
+    interp.fold = fold
+    interp.fuse = fuse
+    interp.place_args = place_args
+    census = Census()
+    census.run(node)
+    interp.setnames = census.sets
+    interp.free = census.free
+    if known_calls:
+        interp.candidates = known_candidates(census)
+    if stack_conts:
+        interp.stack_conts = find_stack_conts(node, census)
+    if base_proto_w:
+        for w_proto in base_proto_w:
+            interp.proto_w.append(w_proto)
     toplevel = interp.interp()
     proto_w = [None] * len(interp.proto_w)
     for i in xrange(len(interp.proto_w)):
         proto_w[i] = interp.proto_w[i]
     return W_Cont(toplevel, None), proto_w
 
+def known_candidates(census):
+    """ The local variables that only ever hold one lambda: defined to
+        it and never set!, or, which is how cps.py writes internal
+        function defines, defined once and set! to it once. A formal of
+        the same name would hold something else, so those are left out.
+    """
+    names = {}
+    for w_name, nb_defs in census.defs.items():
+        if nb_defs != 1 or w_name in census.formals:
+            continue
+        nb_sets = census.sets.get(w_name, 0)
+        if ((nb_sets == 0 and w_name in census.deflambdas) or
+                (nb_sets == 1 and w_name in census.setlambdas)):
+            names[w_name] = None
+    return names
+
 class AbstractInterpreter(object):
     def __init__(self, args, node, parent=None):
         self.parent = parent
         if parent:
             self.proto_w = parent.proto_w
             self.module_w = parent.module_w
+            self.fold = parent.fold
+            self.fuse = parent.fuse
+            self.place_args = parent.place_args
+            self.setnames = parent.setnames
+            self.candidates = parent.candidates
+            self.free = parent.free
+            self.stack_conts = parent.stack_conts
+            self.lambda_index = parent.lambda_index
         else:
             self.proto_w = []
             self.module_w = None
+            self.fold = True
+            self.fuse = True
+            self.place_args = True
+            self.setnames = {}
+            self.candidates = {}
+            self.free = {}
+            self.stack_conts = {}
+            self.lambda_index = {}
         self.args = args
         self.node = node
         self.localmap = {}
         self.nb_locals = 0
+        self.upvalmap = {}
+        self.upvalowner = {}
+        self.globalnames = {}
         self.upval_descr = []
+        # Locals that nested lambdas capture, and locals that are set!
+        # here or in a nested lambda. Only those that are both need a
+        # ModuleCell, the others are captured by value.
+        self.captured = {}
+        self.assigned = {}
         self.code = []
+        # Index of a wide branch in code -> its EXTENDED_ARG prefix, see
+        # patchbranch(), and the bytes these prefixes take in all.
+        self.prefixes = {}
+        self.prefix_size = 0
+        self.branch_prefix_size = {}
         self.const_w = []
+        self.const_index = {}
         self.pending_lambdas = []
+        # The actions left to compile the body, see visit().
+        self.todo = []
+        # Name -> Lambda, for the locals that hold that lambda wherever
+        # they are used from here on, and for the upvals that held it
+        # when this lambda was made.
+        self.known = {}
+        self.outer_known = {}
+        # (name, what it was known as before) for each addition to
+        # known, so that a branch can undo its own.
+        self.known_log = []
+        self.proto_index = -1
+        self.name = None
         # Set argument.
         if args:
             for argnode in args:
@@ -46,185 +128,622 @@ class AbstractInterpreter(object):
     def emitbyte(self, u8):
         self.code.append(chr(u8))
 
-    def emitshort(self, i16):
-        self.emitbyte(i16 & 0xff)
-        self.emitbyte((i16 >> 8) & 0xff)
-
-    def dummyshort(self):
-        res = len(self.code)
-        self.emitbyte(0)
-        self.emitbyte(0)
-        return res, res + 2
-
-    def codeptr(self):
-        return len(self.code)
-
-    def patchshort(self, index, i16):
-        self.code[index] = chr(i16 & 0xff)
-        self.code[index + 1] = chr((i16 >> 8) & 0xff)
+    def emit(self, opcode, oparg=0):
+        emit(self.code, opcode, oparg)
+
+    def emitbranch(self, opcode):
+        """ Emits a branch with a dummy offset, to be patched by
+            patchbranch() once the code branched over is there.
+        """
+        index = len(self.code)
+        self.emit(opcode, 0)
+        self.branch_prefix_size[index] = self.prefix_size
+        return index
+
+    def patchbranch(self, index):
+        """ Makes the branch at index go to the end of the code. Branches
+            are patched inner ones first, so the prefixes added since
+            this one was emitted are those of the code it branches over.
+        """
+        inner = self.prefix_size - self.branch_prefix_size[index]
+        del self.branch_prefix_size[index]
+        offset = len(self.code) + inner - (index + 3)
+        self.code[index + 1] = chr(offset & 0xff)
+        self.code[index + 2] = chr((offset >> 8) & 0xff)
+        if offset >> 16:
+            # Branches are relative, so the code branched over can be
+            # shifted to make room for the prefix. That is left to
+            # final_code(), so that it is done once per lambda.
+            prefix = []
+            emit(prefix, Op.EXTENDED_ARG, offset >> 16)
+            self.prefixes[index] = prefix
+            self.prefix_size += len(prefix)
+
+    def final_code(self):
+        """ The code with the prefixes of the wide branches in place. """
+        if not self.prefixes:
+            return self.code
+        code = []
+        for i in xrange(len(self.code)):
+            prefix = self.prefixes.get(i, None)
+            if prefix is not None:
+                code.extend(prefix)
+            code.append(self.code[i])
+        return code
 
     def intern_const(self, w_val):
-        try:
-            return self.const_w.index(w_val)
-        except ValueError:
+        index = self.const_index.get(w_val, -1)
+        if index == -1:
+            index = len(self.const_w)
             self.const_w.append(w_val)
-            return len(self.const_w) - 1
+            self.const_index[w_val] = index
+        return index
 
     def def_item(self, w_name, toplevel=False):
         if toplevel:
             const_index = self.intern_const(w_name)
-            self.emitbyte(Op.SETGLOBAL)
-            self.emitbyte(const_index)
+            self.emit(Op.SETGLOBAL, const_index)
             return
         if w_name not in self.localmap:
             self.localmap[w_name] = self.nb_locals
             self.nb_locals += 1
         local_index = self.localmap[w_name]
-        self.emitbyte(Op.STORE)
-        self.emitbyte(local_index)
+        self.emit(Op.STORE, local_index)
 
     def set_item(self, w_name):
         # Is a local?
         if w_name in self.localmap:
+            self.assigned[w_name] = None
             local_index = self.localmap[w_name]
-            self.emitbyte(Op.STORE)
-            self.emitbyte(local_index)
+            self.emit(Op.STORE, local_index)
             return
         # Need to pull upval?
-        if self.parent:
-            upval_index = len(self.upval_descr)
-            if self.parent.pull_upval(self, w_name):
-                # Could pull the upval to here.
-                self.emitbyte(Op.SETUPVAL)
-                self.emitbyte(upval_index)
-                return
+        upval_index = self.lookup_upval(w_name)
+        if upval_index >= 0:
+            self.upvalowner[w_name].assigned[w_name] = None
+            self.emit(Op.SETUPVAL, upval_index)
+            return
         # No parent, or is global
         const_index = self.intern_const(w_name)
-        self.emitbyte(Op.SETGLOBAL)
-        self.emitbyte(const_index)
+        self.emit(Op.SETGLOBAL, const_index)
 
     def lookup_item(self, w_name):
         if w_name in self.localmap:
             local_index = self.localmap[w_name]
-            self.emitbyte(Op.LOAD)
-            self.emitbyte(local_index)
+            self.emit(Op.LOAD, local_index)
+            return
+        upval_index = self.lookup_upval(w_name)
+        if upval_index >= 0:
+            self.emit(Op.GETUPVAL, upval_index)
             return
-        if self.parent:
-            upval_index = len(self.upval_descr)
-            if self.parent.pull_upval(self, w_name):
-                self.emitbyte(Op.GETUPVAL)
-                self.emitbyte(upval_index)
-                return
         const_index = self.intern_const(w_name)
-        self.emitbyte(Op.GETGLOBAL)
-        self.emitbyte(const_index)
-
-    def pull_upval(self, child, w_name):
-        if w_name in self.localmap or (self.parent and
-                self.parent.pull_upval(self, w_name)):
-            from_index = self.localmap[w_name]
-            to_index = len(child.upval_descr) + child.nb_locals # XXX
-            child.upval_descr.append(from_index)
-            child.localmap[w_name] = to_index
+        self.emit(Op.GETGLOBAL, const_index)
+
+    def lookup_upval(self, w_name):
+        """ Returns the upval index of w_name, pulling it through the
+            enclosing lambdas if needed, or -1 if it is a global.
+            Enclosing lambdas are complete by now (see interp), so what
+            is found out about them is remembered.
+        """
+        if w_name in self.upvalmap:
+            return self.upvalmap[w_name]
+        if w_name in self.globalnames:
+            return -1
+        path = []
+        interp = self
+        while True:
+            path.append(interp)
+            interp = interp.parent
+            if interp is None or w_name in interp.globalnames:
+                for passed in path:
+                    passed.globalnames[w_name] = None
+                return -1
+            if w_name in interp.localmap:
+                from_index = interp.localmap[w_name]
+                owner = interp
+                owner.captured[w_name] = None
+                break
+            if w_name in interp.upvalmap:
+                from_index = interp.nb_locals + interp.upvalmap[w_name]
+                owner = interp.upvalowner[w_name]
+                break
+        upval_index = -1
+        for i in xrange(len(path) - 1, -1, -1):
+            passed = path[i]
+            upval_index = len(passed.upval_descr)
+            passed.upval_descr.append(from_index)
+            passed.upvalmap[w_name] = upval_index
+            passed.upvalowner[w_name] = owner
+            from_index = passed.nb_locals + upval_index
+        return upval_index
+
+    def defined_lambda(self, node):
+        """ If node binds a local of known_candidates() to its lambda,
+            returns the name, else None.
+        """
+        if isinstance(node, Def):
+            if node.toplevel:
+                return None
+            w_name = node.name.w_form
+            form = node.form
+        elif isinstance(node, Sete):
+            w_name = node.name.w_form
+            form = node.form
+            # The define must be in this lambda.
+            if w_name not in self.localmap:
+                return None
+        else:
+            return None
+        if isinstance(form, Lambda) and w_name in self.candidates:
+            return w_name
+        return None
+
+    def declare_known(self, nodelist, start):
+        """ Marks the names bound by a run of lambda definitions from
+            nodelist[start] as known. Nothing runs in between them, so
+            each of these lambdas can call the others.
+        """
+        for i in xrange(start, len(nodelist)):
+            node = nodelist[i]
+            w_name = self.defined_lambda(node)
+            if w_name is None:
+                break
+            assert isinstance(node, Def) or isinstance(node, Sete)
+            lam = node.form
+            assert isinstance(lam, Lambda)
+            self.known_log.append((w_name, self.known.get(w_name, None)))
+            self.known[w_name] = lam
+
+    def forget_known(self, mark):
+        """ Undoes what declare_known() did since known_log had mark
+            entries.
+        """
+        while len(self.known_log) > mark:
+            w_name, lam = self.known_log.pop()
+            if lam is None:
+                del self.known[w_name]
+            else:
+                self.known[w_name] = lam
+
+    def known_callee(self, node):
+        """ The proto index of the lambda that node calls if codegen
+            knows it, or -1. Raises if the argument count is wrong.
+        """
+        proc = node.proc
+        if not isinstance(proc, Var):
+            return -1
+        w_name = proc.w_form
+        if w_name in self.localmap:
+            lam = self.known.get(w_name, None)
+        elif w_name in self.upvalmap:
+            lam = self.outer_known.get(w_name, None)
+        else:
+            return -1
+        if lam is None:
+            return -1
+        if len(node.args) != len(lam.formals):
+            raise W_ValueError('%d arguments for %d formals' % (
+                                   len(node.args), len(lam.formals)),
+                               w_name, 'Apply.accept_interp()').wrap()
+        return self.lambda_index[lam]
+
+    def arg_actions(self, node):
+        """ The actions that evaluate the arguments of the call node.
+            The call is a tail call, so once nothing left to evaluate
+            reads a local, its slot is free to take an argument of the
+            callee's. With place_args, the last arguments, from the first
+            that is a local, an upval or a lambda on, go straight to
+            their slots (LOADARG, GETUPVALARG, BUILDCONTARG and
+            PUSHCONTARG after peephole.py).
+            CONT moves the ones before, pushed as usual, to the slots
+            below; see Frame.transfer(). A local that is in its slot
+            already stays there, unless it is the last argument: SETARG
+            counts the arguments up to the highest slot it writes.
+            The placed arguments go in an order where none overwrites a
+            slot that another still reads: scheme leaves it unspecified.
+            Where there is none, all are pushed.
+        """
+        first = len(node.args)
+        order = None
+        if self.place_args:
+            first = self.first_placed(node)
+            order = self.placement(node, first)
+        if order is None:
+            return visit_all(node.args)
+        assert first >= 0
+        actions = visit_all(node.args[:first])
+        # The slots must be locals, or the temporaries would overlap.
+        actions.append(ReserveSlots(len(node.args)))
+        for index in order:
+            actions.append(Visit(node.args[index]))
+            actions.append(Emit(Op.SETARG, index))
+        return actions
+
+    def first_placed(self, node):
+        first = len(node.args)
+        while first > 0 and self.is_placeable(node.args[first - 1]):
+            first -= 1
+        return first
+
+    def placement(self, node, first):
+        """ The arguments from first on that arg_actions() puts in place,
+            in order, or None if they cannot be.
+        """
+        nb_args = len(node.args)
+        if first == nb_args:
+            return None
+        pending = []
+        for i in xrange(first, nb_args):
+            arg = node.args[i]
+            # A local never set! is never boxed, so its slot holds the
+            # value itself.
+            if (i < nb_args - 1 and isinstance(arg, Var) and
+                    self.localmap.get(arg.w_form, -1) == i and
+                    arg.w_form not in self.setnames):
+                continue
+            pending.append(i)
+        reads = {}
+        for i in pending:
+            reads[i] = {}
+            self.local_reads(node.args[i], reads[i])
+        # The callee is evaluated last, on top of the arguments.
+        callee_reads = {}
+        self.local_reads(node.proc, callee_reads)
+        order = []
+        while pending:
+            index = -1
+            for i in pending:
+                if i in callee_reads:
+                    continue
+                index = i
+                for j in pending:
+                    if j != i and i in reads[j]:
+                        index = -1
+                        break
+                if index != -1:
+                    break
+            if index == -1:
+                return None
+            order.append(index)
+            pending.remove(index)
+        return order
+
+    def is_placeable(self, node):
+        """ Whether a fused instruction puts node in place. """
+        if isinstance(node, Lambda):
             return True
-        return False # is global
+        if isinstance(node, Var):
+            w_name = node.w_form
+            return w_name in self.localmap or self.lookup_upval(w_name) >= 0
+        return False
+
+    def local_reads(self, node, reads):
+        todo = [node]
+        while todo:
+            todo.pop().local_reads(self, reads, todo)
 
     def visit(self, node):
-        node.accept_interp(self)
+        """ Compiles node. Its subexpressions are compiled from an
+            explicit stack of actions rather than recursively, since CPS
+            code can nest primitives and ifs arbitrarily deep.
+        """
+        self.todo.append(Visit(node))
+        while self.todo:
+            self.todo.pop().run(self)
+
+    def schedule(self, actions):
+        """ Runs actions, in order, before the ones scheduled earlier. """
+        for i in xrange(len(actions) - 1, -1, -1):
+            self.todo.append(actions[i])
 
     def interp(self, name=None):
-        self.visit(self.node)
-        for lambda_node, proto_index in self.pending_lambdas:
-            new_interp = AbstractInterpreter(args=lambda_node.formals,
-                                             node=lambda_node.body[0],
-                                             parent=self)
-            self.proto_w[proto_index] = new_interp.interp(name=lambda_node.name)
-        self.pending_lambdas = None
-        w_proto = build_proto(self)
-        if w_proto.name == '#f' and name:
-            w_proto.name = name
-        return w_proto
+        # Nested lambdas are compiled from a worklist rather than
+        # recursively: CPS code nests a continuation per call. A lambda
+        # is compiled after its parent, as it may pull upvals from it,
+        # and protos are built last since that can add upvals to any
+        # enclosing lambda.
+        self.name = name
+        done = []
+        worklist = [self]
+        while worklist:
+            interp = worklist.pop()
+            interp.visit(interp.node)
+            for lambda_node, proto_index, known in interp.pending_lambdas:
+                new_interp = AbstractInterpreter(args=lambda_node.formals,
+                                                 node=lambda_node.body[0],
+                                                 parent=interp)
+                new_interp.proto_index = proto_index
+                new_interp.outer_known = known
+                new_interp.name = lambda_node.name
+                worklist.append(new_interp)
+            interp.pending_lambdas = None
+            done.append(interp)
+        for interp in done:
+            if interp is not self:
+                self.proto_w[interp.proto_index] = build_proto(interp)
+        return build_proto(self)
 
 def build_proto(interp):
-    code = ''.join(interp.code)
+    # Box the locals that are both captured and assigned on entry, so
+    # that every closure shares them. This is only known once all the
+    # nested lambdas are compiled. Branch offsets are relative, so the
+    # code can be prefixed.
+    boxcode = []
+    for w_name, local_index in interp.localmap.items():
+        if w_name in interp.captured and w_name in interp.assigned:
+            emit(boxcode, Op.BOX, local_index)
+    code = ''.join(boxcode + interp.final_code())
+    if interp.fold or interp.fuse:
+        code = peephole(code, interp.fold, interp.fuse)
 
     if interp.args:
         nb_args = len(interp.args)
     else:
         nb_args = 0
 
-    upval_descr = ['\0'] * len(interp.upval_descr)
-    for i, index in enumerate(interp.upval_descr):
-        upval_descr[i] = chr(index)
+    upval_descr = [0] * len(interp.upval_descr)
+    for i in xrange(len(interp.upval_descr)):
+        upval_descr[i] = interp.upval_descr[i]
 
     const_w = [None] * len(interp.const_w)
     for i in xrange(len(interp.const_w)): # XXX PyPy hack
         const_w[i] = interp.const_w[i]
 
-    return W_Proto(code, nb_args, interp.nb_locals,
-                   upval_descr, const_w, interp.module_w)
+    w_proto = W_Proto(code, nb_args, interp.nb_locals,
+                      upval_descr, const_w, interp.module_w)
+    if interp.name:
+        w_proto.name = interp.name
+    w_proto.index = interp.proto_index
+    return w_proto
+
+
+class Action(object):
+    """ A step of compiling a lambda body, see visit(). """
+    def run(self, interp):
+        raise NotImplementedError
+
+class Visit(Action):
+    def __init__(self, node):
+        self.node = node
+
+    def run(self, interp):
+        self.node.accept_interp(interp)
+
+def visit_all(nodelist):
+    actions = []
+    for node in nodelist:
+        actions.append(Visit(node))
+    return actions
+
+class EmitByte(Action):
+    def __init__(self, opcode):
+        self.opcode = opcode
+
+    def run(self, interp):
+        interp.emitbyte(self.opcode)
+
+class Emit(Action):
+    def __init__(self, opcode, oparg):
+        self.opcode = opcode
+        self.oparg = oparg
+
+    def run(self, interp):
+        interp.emit(self.opcode, self.oparg)
+
+class ReserveSlots(Action):
+    def __init__(self, nb_slots):
+        self.nb_slots = nb_slots
+
+    def run(self, interp):
+        if interp.nb_locals < self.nb_slots:
+            interp.nb_locals = self.nb_slots
 
 
 class __extend__(Node):
     def accept_interp(self, interp):
+        """ Emits the code of this node, or schedules actions that do. """
         raise NotImplementedError
 
 
+class IfThen(Action):
+    """ After the test: branch over the consequent. """
+    def __init__(self, node):
+        self.node = node
+
+    def run(self, interp):
+        patch_index = interp.emitbranch(Op.BRANCHIFNOT)
+        # What is defined on one branch is not on the other.
+        mark = len(interp.known_log)
+        interp.schedule([Visit(self.node.snd), IfElse(patch_index, mark),
+                         Visit(self.node.trd), RestoreKnown(mark)])
+
+class IfElse(Action):
+    def __init__(self, patch_index, mark):
+        self.patch_index = patch_index
+        self.mark = mark
+
+    def run(self, interp):
+        interp.patchbranch(self.patch_index)
+        interp.forget_known(self.mark)
+
+class RestoreKnown(Action):
+    def __init__(self, mark):
+        self.mark = mark
+
+    def run(self, interp):
+        interp.forget_known(self.mark)
+
 class __extend__(If):
     def accept_interp(self, interp):
-        interp.visit(self.fst)
-        interp.emitbyte(Op.BRANCHIFNOT)
-        patch_index, jump_from = interp.dummyshort()
-        interp.visit(self.snd)
-        interp.patchshort(patch_index, interp.codeptr() - jump_from)
-        interp.visit(self.trd)
+        interp.schedule([Visit(self.fst), IfThen(self)])
+
+class SeqItem(Action):
+    """ Compiles nodelist[i] and the ones after it. Only the last
+        form's value is kept.
+    """
+    def __init__(self, nodelist, i):
+        self.nodelist = nodelist
+        self.i = i
+
+    def run(self, interp):
+        nodelist = self.nodelist
+        i = self.i
+        if i == 0 or interp.defined_lambda(nodelist[i - 1]) is None:
+            interp.declare_known(nodelist, i)
+        if i < len(nodelist) - 1:
+            interp.schedule([Visit(nodelist[i]), EmitByte(Op.POP),
+                             SeqItem(nodelist, i + 1)])
+        else:
+            interp.schedule([Visit(nodelist[i])])
 
 class __extend__(Seq):
     def accept_interp(self, interp):
-        for node in self.nodelist:
-            interp.visit(node)
+        if self.nodelist:
+            interp.schedule([SeqItem(self.nodelist, 0)])
+
+class __extend__(Node):
+    def local_reads(self, interp, reads, todo):
+        """ Collects the slots of interp's locals that evaluating this
+            argument may read, pushing the subexpressions that decide it
+            on todo. Anything but the forms below counts as reading them
+            all.
+        """
+        for local_index in interp.localmap.values():
+            reads[local_index] = None
+
+class __extend__(Var):
+    def local_reads(self, interp, reads, todo):
+        local_index = interp.localmap.get(self.w_form, -1)
+        if local_index != -1:
+            reads[local_index] = None
+
+class __extend__(Const):
+    def local_reads(self, interp, reads, todo):
+        pass
+
+class __extend__(PrimitiveOp):
+    def local_reads(self, interp, reads, todo):
+        for arg in self.args:
+            todo.append(arg)
+
+# A Lambda may capture any of the locals: which ones is only known once
+# it is compiled, after the enclosing lambda. Walking its body instead
+# would take time quadratic in the nesting of CPS continuations.
+
+class Call(Action):
+    """ With the arguments and the callee evaluated, enters the callee. """
+    def __init__(self, node):
+        self.node = node
+
+    def run(self, interp):
+        proto_index = interp.known_callee(self.node)
+        if proto_index == -1:
+            interp.emitbyte(Op.CONT)
+        else:
+            interp.emit(Op.CALLKNOWN, proto_index)
 
 class __extend__(Apply):
     def accept_interp(self, interp):
-        for arg in self.args:
-            interp.visit(arg)
-        interp.visit(self.proc)
-        interp.emitbyte(Op.CONT)
+        interp.schedule(interp.arg_actions(self) +
+                        [Visit(self.proc), Call(self)])
 
 class __extend__(PrimitiveOp):
     def accept_interp(self, interp):
-        for arg in self.args:
-            interp.visit(arg)
-        interp.emitbyte(primitivemap[self.proc.w_form.sval])
+        interp.schedule(visit_all(self.args) +
+                        [EmitByte(primitivemap[self.proc.w_form.sval])])
 
 primitivemap = {
     '+': Op.IADD,
     '-': Op.ISUB,
     '*': Op.IMUL,
     '/': Op.IDIV,
+    'fl+': Op.FADD,
+    'fl-': Op.FSUB,
+    'fl*': Op.FMUL,
+    'fl/': Op.FDIV,
+    'fl<': Op.FLT,
+    'flsqrt': Op.FSQRT,
+    'exact->inexact': Op.TOFLOAT,
     'cons': Op.CONS,
     'car': Op.CAR,
     'cdr': Op.CDR,
+    'make-vector': Op.MAKEVECTOR,
+    'vector-ref': Op.VECTORREF,
+    'vector-set!': Op.VECTORSET,
+    'vector-length': Op.VECTORLENGTH,
+    'vector?': Op.VECTORP,
+    'vector-sum': Op.VECTORSUM,
+    'vector-dot': Op.VECTORDOT,
+    'vector-map!': Op.VECTORMAP,
+    'vector-fill!': Op.VECTORFILL,
+    'vector-copy!': Op.VECTORCOPY,
+    'make-eq-hashtable': Op.MAKEEQHASHTABLE,
+    'make-equal-hashtable': Op.MAKEEQUALHASHTABLE,
+    'hashtable-ref': Op.HASHTABLEREF,
+    'hashtable-set!': Op.HASHTABLESET,
+    'hashtable-delete!': Op.HASHTABLEDELETE,
+    'hashtable-contains?': Op.HASHTABLECONTAINS,
+    'hashtable-count': Op.HASHTABLECOUNT,
+    'hashtable-keys': Op.HASHTABLEKEYS,
+    'hashtable-values': Op.HASHTABLEVALUES,
+    'current-output-port': Op.CURRENTOUTPUTPORT,
+    'open-output-file': Op.OPENOUTPUTFILE,
+    'close-output-port': Op.CLOSEOUTPUTPORT,
+    'flush-output': Op.FLUSHOUTPUT,
+    'display': Op.DISPLAY,
+    'write-string': Op.WRITESTRING,
+    'write-char': Op.WRITECHAR,
+    'newline': Op.WRITENEWLINE,
+    'current-input-port': Op.CURRENTINPUTPORT,
+    'open-input-file': Op.OPENINPUTFILE,
+    'close-input-port': Op.CLOSEINPUTPORT,
+    'read': Op.READ,
+    'eof-object?': Op.EOFP,
     '<': Op.LT,
     'eq?': Op.IS,
     'equal?': Op.EQUAL,
 }
 
+# The primitives whose last argument, a port, may be left out: how many
+# arguments they take without it, and the primitive that the astbuilder
+# passes in its place.
+optional_ports = {
+    'flush-output': (0, 'current-output-port'),
+    'display': (1, 'current-output-port'),
+    'write-string': (1, 'current-output-port'),
+    'write-char': (1, 'current-output-port'),
+    'newline': (0, 'current-output-port'),
+    'read': (0, 'current-input-port'),
+}
+
+class DefItem(Action):
+    def __init__(self, w_name, toplevel):
+        self.w_name = w_name
+        self.toplevel = toplevel
+
+    def run(self, interp):
+        interp.def_item(self.w_name, self.toplevel)
+        interp.emitbyte(Op.UNSPEC)
+
+class SetItem(Action):
+    def __init__(self, w_name):
+        self.w_name = w_name
+
+    def run(self, interp):
+        interp.set_item(self.w_name)
+        interp.emitbyte(Op.UNSPEC)
+
 class __extend__(Def):
     def accept_interp(self, interp):
         w_name = self.name.w_form
         assert isinstance(w_name, W_Symbol)
-        interp.visit(self.form)
-        interp.def_item(w_name, self.toplevel)
-        interp.emitbyte(Op.UNSPEC)
+        interp.schedule([Visit(self.form), DefItem(w_name, self.toplevel)])
 
 class __extend__(Sete):
     def accept_interp(self, interp):
         w_name = self.name.w_form
         assert isinstance(w_name, W_Symbol)
-        interp.visit(self.form)
-        interp.set_item(w_name)
-        interp.emitbyte(Op.UNSPEC)
+        interp.schedule([Visit(self.form), SetItem(w_name)])
 
 class __extend__(Var):
     def accept_interp(self, interp):
@@ -251,19 +770,35 @@ class __extend__(Const):
         elif isinstance(w_val, W_Int):
             ival = w_val.ival
             if 0 <= ival < (1 << 15):
-                interp.emitbyte(Op.INT)
-                interp.emitbyte(ival & 0xff)
-                interp.emitbyte((ival >> 8) & 0xff)
+                interp.emit(Op.INT, ival)
                 return
         const_index = interp.intern_const(w_val)
-        interp.emitbyte(Op.LOADCONST)
-        interp.emitbyte(const_index)
+        interp.emit(Op.LOADCONST, const_index)
 
 class __extend__(Lambda):
     def accept_interp(self, interp):
         proto_index = len(interp.proto_w)
         interp.proto_w.append(None) # hold a position for this lambda
-        interp.emitbyte(Op.BUILDCONT)
-        interp.emitshort(proto_index)
-        interp.pending_lambdas.append((self, proto_index))
+        if self in interp.stack_conts:
+            interp.emit(Op.PUSHCONT, proto_index)
+        else:
+            interp.emit(Op.BUILDCONT, proto_index)
+        interp.lambda_index[self] = proto_index
+        # What the new lambda may call through its upvals, which are
+        # among its free names when the census has them.
+        free = interp.free.get(self, None)
+        if free is None:
+            known = interp.outer_known
+            if interp.known:
+                known = interp.outer_known.copy()
+                known.update(interp.known)
+        else:
+            known = {}
+            for w_name in free:
+                lam = interp.known.get(w_name, None)
+                if lam is None:
+                    lam = interp.outer_known.get(w_name, None)
+                if lam is not None:
+                    known[w_name] = lam
+        interp.pending_lambdas.append((self, proto_index, known))
 
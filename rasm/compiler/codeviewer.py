@@ -1,21 +1,27 @@
-from rasm.rt.code import codenames, argwidth
+from rasm.rt.code import codenames, argwidth, fetch
 
 def dis_once(pc, code):
-    opcode = ord(code[pc])
-    width = argwidth(opcode)
-    if width == 0:
+    """ EXTENDED_ARG prefixes are shown folded into the operand. """
+    opcode, oparg, nextpc = fetch(code, pc)
+    if argwidth(opcode) == 0:
         arg = ''
-    elif width == 1:
-        arg = str(ord(code[pc + 1]))
     else:
-        assert width == 2
-        arg = str(ord(code[pc + 1]) | (ord(code[pc + 2]) << 8))
-    return width, '%s:%s(%s)' % (pc, codenames[opcode], arg)
+        arg = str(oparg)
+    return nextpc - pc - 1, '%s:%s(%s)' % (pc, codenames[opcode], arg)
 
 def dis_at_position(pc, code):
     _, codedescr = dis_once(pc, code)
     return codedescr
 
+def dis_insn(pc, insns):
+    """ Like dis_at_position, for the decoded stream. """
+    opcode = insns[pc]
+    if argwidth(opcode) == 0:
+        arg = ''
+    else:
+        arg = str(insns[pc + 1])
+    return '%s:%s(%s)' % (pc, codenames[opcode], arg)
+
 def dis_proto(w_proto):
     code = w_proto.code
     pc = 0
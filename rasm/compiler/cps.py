@@ -1,205 +1,503 @@
-from rasm.lang.model import (W_Root, W_Int, W_Boolean, W_Unspecified,
-                             W_Pair, W_Nil, W_Symbol,
-                             symbol, list_to_pair, gensym,
-                             w_nil, w_true, w_false, w_unspec,
-                             W_ValueError, W_TypeError)
+""" cps.py
+
+    One-pass CPS conversion.
+
+    Every subexpression is visited once, in one of three positions:
+    tail (its value goes to a known continuation variable), value (it
+    must be reduced to an atom) or effect (its value is dropped). Serious
+    computations met in value or effect position are recorded as steps
+    of a chain, and the chain is folded into nested continuations from
+    the inside out once the final expression is known. Atoms are thus
+    never wrapped into administrative lambdas, and argument lists are
+    never copied.
+
+    Lambda bodies are queued, and the subexpressions of a body are
+    converted from a worklist of tasks, whose results go on a stack of
+    values; nothing recurses on the nesting of the program.
+
+    The result is then cleaned up by simplify.py, unless optimize is off.
+"""
+from rasm.lang.model import (W_Symbol, symbol, gensym, w_unspec)
 from rasm.compiler.ast import (Node, If, Seq, Apply, Def, Sete, Lambda,
                                Var, Const, PrimitiveOp)
 
 class Rewriter(object):
-    def __init__(self, nodelist, lastcont=None, toplevel=False):
+    def __init__(self, nodelist, lastcont=None, toplevel=False,
+                 optimize=True):
         self.nodelist = nodelist
         self.lastcont = lastcont or Var(symbol('halt'))
         self.cpsform = None
         self.toplevel = toplevel
+        self.pending_lambdas = []
+        self.optimize = optimize
+        self.todo = []
+        self.values = []
 
     def run(self):
-        if len(self.nodelist) == 0:
-            return Const(w_unspec).rewrite_cps(self.lastcont)
-        cont = self.lastcont
-        nodelist_copy = self.nodelist[1:]
-        nodelist_copy.reverse()
-        for node in nodelist_copy: # XXX: maybe we have atomic op here
-            if self.toplevel and isinstance(node, Def):
-                node.toplevel = True
-            ignore = newvar('$Ignore_')
-            cont = Lambda([ignore],
-                          [node.rewrite_cps(cont)])
-            cont.name = gensym('$SeqCont_').sval
-        firstnode = self.nodelist[0]
-        if self.toplevel and isinstance(firstnode, Def):
-            firstnode.toplevel = True
-        self.cpsform = self.nodelist[0].rewrite_cps(cont)
+        self.cpsform = self.convert_body(self.nodelist, self.lastcont,
+                                         self.toplevel)
+        while self.pending_lambdas:
+            newlambda, body, cont = self.pending_lambdas.pop()
+            newlambda.body = [self.convert_body(body, cont, toplevel=False)]
+        if self.optimize:
+            from rasm.compiler.simplify import simplify
+            self.cpsform = simplify(self.cpsform)
         return self.cpsform
 
+    def convert_body(self, nodelist, cont, toplevel):
+        self.todo.append(BodyTask(nodelist, cont, toplevel))
+        while self.todo:
+            self.todo.pop().run(self)
+        return self.values.pop()
+
+    def schedule(self, tasks):
+        """ Runs tasks, in order, before the ones scheduled earlier. """
+        for i in xrange(len(tasks) - 1, -1, -1):
+            self.todo.append(tasks[i])
+
+    def pop_values(self, n):
+        start = len(self.values) - n
+        assert start >= 0
+        values_w = self.values[start:]
+        del self.values[start:]
+        return values_w
+
+    def convert_lambda(self, node):
+        cont = newvar('$LamK_')
+        newlambda = Lambda(node.formals + [cont], [], node.name)
+        self.pending_lambdas.append((newlambda, node.body, cont))
+        return newlambda
+
 
 def newvar(prefix='$Var_'):
     return Var(gensym(prefix))
 
-class __extend__(Node):
-    def rewrite_cps(self, cont):
-        raise NotImplementedError
-    
-    def to_cpsatom(self):
+def build_chain(chain, final):
+    body = final
+    # The atoms of the EffectSteps met since body was last wrapped, last
+    # first: a run of them goes into one Seq rather than one per step,
+    # which would copy the Seq under it each time.
+    effects = []
+    for i in xrange(len(chain) - 1, -1, -1):
+        step = chain[i]
+        if isinstance(step, EffectStep):
+            effects.append(step.atom)
+            continue
+        body = step.wrap(prepend_effects(effects, body))
+        effects = []
+    return prepend_effects(effects, body)
+
+def prepend_effects(effects, body):
+    if not effects:
+        return body
+    nodelist = [None] * len(effects)
+    for i in xrange(len(effects)):
+        nodelist[i] = effects[len(effects) - 1 - i]
+    if isinstance(body, Seq):
+        nodelist.extend(body.nodelist)
+    else:
+        nodelist.append(body)
+    return Seq(nodelist)
+
+def flatten_body(nodelist):
+    """ Splices the begins of a body into it. An empty one stays, as it
+        still has a value.
+    """
+    newlist = []
+    todo = [nodelist]
+    indices = [0]
+    while todo:
+        nodelist = todo[-1]
+        i = indices[-1]
+        if i == len(nodelist):
+            todo.pop()
+            indices.pop()
+            continue
+        indices[-1] = i + 1
+        node = nodelist[i]
+        if isinstance(node, Seq) and len(node.nodelist) > 0:
+            todo.append(node.nodelist)
+            indices.append(0)
+        else:
+            newlist.append(node)
+    return newlist
+
+def mark_toplevel(nodelist):
+    newlist = flatten_body(nodelist)
+    for i in xrange(len(newlist)):
+        node = newlist[i]
+        if isinstance(node, Def):
+            newdef = Def(node.name, node.form)
+            newdef.toplevel = True
+            newlist[i] = newdef
+    return newlist
+
+def hoist_defines(nodelist, names_w, seen):
+    newlist = flatten_body(nodelist)
+    for i in xrange(len(newlist)):
+        node = newlist[i]
+        if isinstance(node, Def):
+            w_name = node.name.w_form
+            assert isinstance(w_name, W_Symbol)
+            if w_name not in seen:
+                seen[w_name] = None
+                names_w.append(w_name)
+            newlist[i] = Sete(node.name, node.form)
+    return newlist
+
+
+class Step(object):
+    """ A serious computation whose result the rest of the chain needs. """
+    def wrap(self, body):
         raise NotImplementedError
 
-    def is_cpsatom(self):
+class CallStep(Step):
+    """ (proc args... (lambda (rv) body)) """
+    def __init__(self, proc, args, rv, contname):
+        self.proc = proc
+        self.args = args
+        self.rv = rv
+        self.contname = contname
+
+    def wrap(self, body):
+        cont = Lambda([self.rv], [body], gensym(self.contname).sval,
+                      is_cont=True)
+        return Apply(self.proc, self.args + [cont])
+
+class EffectStep(Step):
+    """ Evaluate an atom for its side effect only. build_chain() puts the
+        atoms of consecutive ones before the body in a single Seq.
+    """
+    def __init__(self, atom):
+        self.atom = atom
+
+class JoinStep(Step):
+    """ An If out of tail position: both (already converted) branches
+        continue to a shared continuation bound to a local.
+    """
+    def __init__(self, test, snd, trd, rv, contvar):
+        self.test = test
+        self.snd = snd
+        self.trd = trd
+        self.rv = rv
+        self.contvar = contvar
+
+    def wrap(self, body):
+        cont = Lambda([self.rv], [body], gensym('$JoinCont_').sval,
+                      is_cont=True)
+        return Seq([Def(self.contvar, cont),
+                    If(self.test, self.snd, self.trd)])
+
+
+class Task(object):
+    """ A step of the conversion. Each node task leaves one node on
+        Rewriter.values, except EffectTask, which leaves none.
+    """
+    def run(self, rw):
         raise NotImplementedError
 
-class __extend__(If):
-    def rewrite_cps(self, cont):
-        fst, snd, trd = self.fst, self.snd, self.trd
-        if isinstance(cont, Var):
-            if fst.is_cpsatom():
-                return If(fst.to_cpsatom(), snd.rewrite_cps(cont),
-                                            trd.rewrite_cps(cont))
-            else:
-                fstval = newvar('$PredRv_')
-                fstcont = Lambda([fstval],
-                                 [If(fstval, snd.rewrite_cps(cont),
-                                             trd.rewrite_cps(cont))])
-                fstcont.name = gensym('$PredCont_').sval
-                return fst.rewrite_cps(fstcont)
-        else:
-            contval = newvar('$Cont_')
-            contdef = Def(contval, cont)
-            if fst.is_cpsatom():
-                return Seq([contdef, If(fst.to_cpsatom(),
-                                        snd.rewrite_cps(contval),
-                                        trd.rewrite_cps(contval))])
-            else:
-                fstval = newvar('$PredRv_')
-                fstcont = Lambda([fstval],
-                                 [If(fstval, snd.rewrite_cps(contval),
-                                             trd.rewrite_cps(contval))])
-                fstcont.name = gensym('$PredCont_').sval
-                return Seq([contdef, fst.rewrite_cps(fstcont)])
-
-    def to_cpsatom(self):
-        return If(self.fst.to_cpsatom(), self.snd.to_cpsatom(),
-                                         self.trd.to_cpsatom())
-
-    def is_cpsatom(self):
-        return (self.fst.is_cpsatom() and self.snd.to_cpsatom() and
-                self.trd.is_cpsatom())
+class ValueTask(Task):
+    def __init__(self, node, chain):
+        self.node = node
+        self.chain = chain
 
-class __extend__(Seq):
-    def rewrite_cps(self, cont):
-        return Rewriter(self.nodelist, lastcont=cont).run()
+    def run(self, rw):
+        self.node.cps_value(rw, self.chain)
 
-    def is_cpsatom(self):
-        return len(self.nodelist) == 1 and self.nodelist[0].is_cpsatom()
+class EffectTask(Task):
+    def __init__(self, node, chain):
+        self.node = node
+        self.chain = chain
 
-    def to_cpsatom(self):
-        return self.nodelist[0].to_cpsatom()
+    def run(self, rw):
+        self.node.cps_effect(rw, self.chain)
 
-class __extend__(Apply):
-    def rewrite_cps(self, cont):
-        proc, args = self.proc, self.args
-        if proc.is_cpsatom():
-            proc = proc.to_cpsatom()
+class TailTask(Task):
+    def __init__(self, node, chain, cont):
+        self.node = node
+        self.chain = chain
+        self.cont = cont
+
+    def run(self, rw):
+        self.node.cps_tail(rw, self.chain, self.cont)
+
+class BodyTask(Task):
+    def __init__(self, nodelist, cont, toplevel):
+        self.nodelist = nodelist
+        self.cont = cont
+        self.toplevel = toplevel
+
+    def run(self, rw):
+        chain = []
+        nodelist = self.nodelist
+        if self.toplevel:
+            nodelist = mark_toplevel(nodelist)
         else:
-            procrv = newvar('$ProcRv_')
-            proccont = Lambda([procrv],
-                              [Apply(procrv, args).rewrite_cps(cont)])
-            proccont.name = gensym('$ProcCont_').sval
-            return proc.rewrite_cps(proccont)
-
-        atom_args = []
-        for i in xrange(len(args)): # XXX pypy hack
-            arg = args[i]
-            if not arg.is_cpsatom():
-                argrv = newvar('$ArgRv_')
-                newapply = Apply(proc, args[:i] + [argrv] + args[i + 1:])
-                argcont = Lambda([argrv],
-                                 [newapply.rewrite_cps(cont)])
-                argcont.name = gensym('$ArgCont_').sval
-                return arg.rewrite_cps(argcont)
-            else:
-                atom_args.append(arg.to_cpsatom())
-        return Apply(proc, atom_args + [cont])
-
-    def is_cpsatom(self):
-        return False
+            # Internal defines become assignments to locals that are
+            # declared up front, so that every closure and continuation
+            # in the body sees the same variable (letrec semantics).
+            names_w = []
+            nodelist = hoist_defines(nodelist, names_w, {})
+            for w_name in names_w:
+                chain.append(EffectStep(Def(Var(w_name), Const(w_unspec))))
+        if len(nodelist) == 0:
+            rw.values.append(build_chain(chain,
+                                         Apply(self.cont, [Const(w_unspec)])))
+            return
+        tasks = [None] * len(nodelist)
+        for i in xrange(len(nodelist) - 1):
+            tasks[i] = EffectTask(nodelist[i], chain)
+        tasks[-1] = TailTask(nodelist[-1], chain, self.cont)
+        rw.schedule(tasks + [ChainTask(chain)])
+
+def tail_tasks(node, cont):
+    """ Converts node in tail position, on a chain of its own. """
+    chain = []
+    return [TailTask(node, chain, cont), ChainTask(chain)]
+
+class ChainTask(Task):
+    """ Wraps the final form on top of the values in the chain. """
+    def __init__(self, chain):
+        self.chain = chain
+
+    def run(self, rw):
+        rw.values.append(build_chain(self.chain, rw.values.pop()))
+
+class DropTask(Task):
+    def run(self, rw):
+        rw.values.pop()
+
+class ContTask(Task):
+    """ Passes the atom on top of the values to cont. """
+    def __init__(self, cont):
+        self.cont = cont
+
+    def run(self, rw):
+        rw.values.append(Apply(self.cont, [rw.values.pop()]))
+
+class EffectStepTask(Task):
+    """ Keeps the atom on top of the values for its side effect. """
+    def __init__(self, chain):
+        self.chain = chain
+
+    def run(self, rw):
+        self.chain.append(EffectStep(rw.values.pop()))
+
+def value_tasks(nodelist, chain):
+    tasks = [None] * len(nodelist)
+    for i in xrange(len(nodelist)):
+        tasks[i] = ValueTask(nodelist[i], chain)
+    return tasks
+
+
+class __extend__(Node):
+    def cps_value(self, rw, chain):
+        """ Leaves an atom for this node on rw.values, adding any
+            serious computations it needs to the chain.
+        """
+        raise NotImplementedError
+
+    def cps_effect(self, rw, chain):
+        rw.schedule([ValueTask(self, chain), DropTask()])
+
+    def cps_tail(self, rw, chain, cont):
+        """ Leaves the final form that passes this node's value to cont,
+            a Var, on rw.values.
+        """
+        rw.schedule([ValueTask(self, chain), ContTask(cont)])
+
+class __extend__(Var, Const):
+    def cps_value(self, rw, chain):
+        rw.values.append(self)
+
+class __extend__(Lambda):
+    def cps_value(self, rw, chain):
+        rw.values.append(rw.convert_lambda(self))
+
+    def cps_effect(self, rw, chain):
+        pass
+
+class PrimitiveTask(Task):
+    def __init__(self, node):
+        self.node = node
+
+    def run(self, rw):
+        node = self.node
+        rw.values.append(PrimitiveOp(node.proc,
+                                     rw.pop_values(len(node.args))))
 
 class __extend__(PrimitiveOp):
-    def rewrite_cps(self, cont):
-        return Apply(self.proc, self.args).rewrite_cps(cont)
+    def cps_value(self, rw, chain):
+        rw.schedule(value_tasks(self.args, chain) + [PrimitiveTask(self)])
 
-    def to_cpsatom(self):
-        return PrimitiveOp(self.proc, [n.to_cpsatom() for n in self.args])
+    def cps_effect(self, rw, chain):
+        # Keep it: it may still raise.
+        rw.schedule([ValueTask(self, chain), EffectStepTask(chain)])
 
-    def is_cpsatom(self):
-        for arg in self.args:
-            if not arg.is_cpsatom():
-                return False
-        return True
+class DefTask(Task):
+    def __init__(self, node):
+        self.node = node
+
+    def run(self, rw):
+        newdef = Def(self.node.name, rw.values.pop())
+        newdef.toplevel = self.node.toplevel
+        rw.values.append(newdef)
 
-# XXX: define and set! need rethinking.
 class __extend__(Def):
     """ (define var (form)) =>
-        (let ([var #unspecified])
-          (form (lambda ($Rv)
-            (set! var $Rv)
-            ...)))
-
-        (define v1 (form1))
-        (define v2 (form2)) =>
-        (let ([v1 #unspec]
-              [v2 #unspec])
-          (form1 (lambda ($Rv)
-            (set! v1 $Rv)
-            (form2 (lambda ($Rv)
-              (set! v2 $Rv)
-              ...)))))
-
-        So it's basically doing a letrec.
-        For toplevel defines, they could use the w_module instead...?
+        (form (lambda ($Rv) (define var $Rv) ...))
+
+        Defines inside a lambda body are turned into assignments by
+        hoist_defines() before they get here; toplevel ones go to the
+        module.
     """
-    toplevel = False
-    def rewrite_cps(self, cont):
-        formrv = newvar('$FormRv_')
-        newdef = Def(self.name, formrv)
-        newdef.toplevel = self.toplevel
-        formcont = Lambda([formrv], [Apply(cont, [newdef])])
-        formcont.name = gensym('$FormCont_').sval
-        return self.form.rewrite_cps(formcont)
-
-    def to_cpsatom(self):
-        newdef = Def(self.name, self.form.to_cpsatom())
-        newdef.toplevel = self.toplevel
-        return newdef
-
-    def is_cpsatom(self):
-        return self.form.is_cpsatom()
+    def cps_value(self, rw, chain):
+        rw.schedule([ValueTask(self.form, chain), DefTask(self)])
+
+    def cps_effect(self, rw, chain):
+        rw.schedule([ValueTask(self, chain), EffectStepTask(chain)])
+
+class SeteTask(Task):
+    def __init__(self, node):
+        self.node = node
+
+    def run(self, rw):
+        rw.values.append(Sete(self.node.name, rw.values.pop()))
 
 class __extend__(Sete):
-    def rewrite_cps(self, cont):
-        formrv = newvar('$FormRv_')
-        formcont = Lambda([formrv],
-                          [Apply(cont, [Sete(self.name, formrv)])])
-        formcont.name = gensym('$FormCont_').sval
-        return self.form.rewrite_cps(formcont)
+    def cps_value(self, rw, chain):
+        rw.schedule([ValueTask(self.form, chain), SeteTask(self)])
+
+    def cps_effect(self, rw, chain):
+        rw.schedule([ValueTask(self, chain), EffectStepTask(chain)])
+
+class CallTask(Task):
+    """ Takes the converted procedure and arguments of node off the
+        values. In tail position (cont is given) the call goes to cont,
+        else to a continuation that binds the value of the call if value
+        is set, or ignores it.
+    """
+    def __init__(self, node, chain, cont=None, value=True):
+        self.node = node
+        self.chain = chain
+        self.cont = cont
+        self.value = value
 
-    def to_cpsatom(self):
-        return Sete(self.name, self.form.to_cpsatom())
+    def run(self, rw):
+        args = rw.pop_values(len(self.node.args))
+        proc = rw.values.pop()
+        if self.cont is not None:
+            rw.values.append(Apply(proc, args + [self.cont]))
+        elif self.value:
+            rv = newvar('$ArgRv_')
+            self.chain.append(CallStep(proc, args, rv, '$ArgCont_'))
+            rw.values.append(rv)
+        else:
+            self.chain.append(CallStep(proc, args, newvar('$Ignore_'),
+                                       '$SeqCont_'))
 
-    def is_cpsatom(self):
-        return self.form.is_cpsatom()
+class __extend__(Apply):
+    def cps_operands(self, chain):
+        return [ValueTask(self.proc, chain)] + value_tasks(self.args, chain)
 
-class __extend__(Var, Const, Lambda):
-    def rewrite_cps(self, cont):
-        return Apply(cont, [self.to_cpsatom()])
+    def cps_value(self, rw, chain):
+        rw.schedule(self.cps_operands(chain) + [CallTask(self, chain)])
 
-    def to_cpsatom(self):
-        return self
+    def cps_effect(self, rw, chain):
+        rw.schedule(self.cps_operands(chain) +
+                    [CallTask(self, chain, value=False)])
 
-    def is_cpsatom(self):
-        return True
+    def cps_tail(self, rw, chain, cont):
+        rw.schedule(self.cps_operands(chain) + [CallTask(self, chain, cont)])
 
-class __extend__(Lambda):
-    def to_cpsatom(self):
-        cont = newvar('$LamK_')
-        newbody = Rewriter(self.body, lastcont=cont).run()
-        return Lambda(self.formals + [cont], [newbody], self.name)
+class JoinTask(Task):
+    """ With the test on top of the values, converts both branches of
+        node to continue to a join continuation that binds rv.
+    """
+    def __init__(self, node, chain, rv):
+        self.node = node
+        self.chain = chain
+        self.rv = rv
+
+    def run(self, rw):
+        test = rw.values.pop()
+        contvar = newvar('$Cont_')
+        rw.schedule(tail_tasks(self.node.snd, contvar) +
+                    tail_tasks(self.node.trd, contvar) +
+                    [JoinStepTask(self.chain, test, self.rv, contvar)])
+
+class JoinStepTask(Task):
+    def __init__(self, chain, test, rv, contvar):
+        self.chain = chain
+        self.test = test
+        self.rv = rv
+        self.contvar = contvar
+
+    def run(self, rw):
+        trd = rw.values.pop()
+        snd = rw.values.pop()
+        self.chain.append(JoinStep(self.test, snd, trd, self.rv,
+                                   self.contvar))
+
+class IfTask(Task):
+    """ With the test on top of the values, converts both branches of
+        node in tail position.
+    """
+    def __init__(self, node, cont):
+        self.node = node
+        self.cont = cont
+
+    def run(self, rw):
+        test = rw.values.pop()
+        rw.schedule(tail_tasks(self.node.snd, self.cont) +
+                    tail_tasks(self.node.trd, self.cont) +
+                    [MakeIfTask(test)])
 
+class MakeIfTask(Task):
+    def __init__(self, test):
+        self.test = test
+
+    def run(self, rw):
+        trd = rw.values.pop()
+        snd = rw.values.pop()
+        rw.values.append(If(self.test, snd, trd))
+
+class __extend__(If):
+    def cps_value(self, rw, chain):
+        rv = newvar('$PredRv_')
+        rw.values.append(rv)
+        rw.schedule([ValueTask(self.fst, chain), JoinTask(self, chain, rv)])
+
+    def cps_effect(self, rw, chain):
+        rv = newvar('$Ignore_')
+        rw.schedule([ValueTask(self.fst, chain), JoinTask(self, chain, rv)])
+
+    def cps_tail(self, rw, chain, cont):
+        rw.schedule([ValueTask(self.fst, chain), IfTask(self, cont)])
+
+class __extend__(Seq):
+    def cps_value(self, rw, chain):
+        if len(self.nodelist) == 0:
+            rw.values.append(Const(w_unspec))
+            return
+        tasks = [None] * len(self.nodelist)
+        for i in xrange(len(self.nodelist) - 1):
+            tasks[i] = EffectTask(self.nodelist[i], chain)
+        tasks[-1] = ValueTask(self.nodelist[-1], chain)
+        rw.schedule(tasks)
+
+    def cps_effect(self, rw, chain):
+        tasks = [None] * len(self.nodelist)
+        for i in xrange(len(self.nodelist)):
+            tasks[i] = EffectTask(self.nodelist[i], chain)
+        rw.schedule(tasks)
+
+    def cps_tail(self, rw, chain, cont):
+        if len(self.nodelist) == 0:
+            rw.values.append(Apply(cont, [Const(w_unspec)]))
+            return
+        tasks = [None] * len(self.nodelist)
+        for i in xrange(len(self.nodelist) - 1):
+            tasks[i] = EffectTask(self.nodelist[i], chain)
+        tasks[-1] = TailTask(self.nodelist[-1], chain, cont)
+        rw.schedule(tasks)
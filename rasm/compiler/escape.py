@@ -0,0 +1,170 @@
+""" escape.py
+
+    Finds the continuations that codegen can put on the control stack of
+    the frame (PUSHCONT) instead of making a closure of them (BUILDCONT).
+
+    Each continuation of cps.py is called once, and the one made last is
+    called first, as long as nothing but calls and other continuations
+    get hold of it. So the frame can keep the proto and the upvals on a
+    stack, and pass around a marker of the entry. call/cc moves the whole
+    stack to the heap, see Frame.reify_stack().
+
+    A continuation lambda (Lambda.is_cont) goes on the stack if it is
+
+    - the last argument of a call, where cps.py passes continuations, or
+    - defined to a local that is defined once, never set!, and only
+      called or passed as the last argument of a call.
+
+    The locals that hold continuations, and the last formal of each
+    lambda that is not one, are continuation variables. They belong to
+    the nearest enclosing lambda that is not a continuation. If such a
+    lambda uses one of another lambda, it could keep the continuation
+    past its call, and then none goes on the stack.
+"""
+from rasm.lang.model import W_Symbol
+from rasm.compiler.ast import (Node, If, Seq, Apply, Def, Sete, Lambda,
+                               Var, Const, PrimitiveOp)
+
+def stack_conts(node, census):
+    """ Lambda -> None, for the continuations that can go on the stack.
+        census is a Census of node, see simplify.py.
+    """
+    return EscapeAnalysis(census).run(node)
+
+class EscapeAnalysis(object):
+    def __init__(self, census):
+        self.census = census
+        self.owners = {}        # continuation variable -> its lambda
+        self.passed = []        # continuations passed to a call
+        self.defined = {}       # local -> continuation defined to it
+        self.escaped = {}       # continuation variables used otherwise
+        self.tainted = False
+        self.pending_lambdas = []
+
+    def run(self, node):
+        # The toplevel is owned by None.
+        self.walk(node, None)
+        while self.pending_lambdas:
+            lam, owner = self.pending_lambdas.pop()
+            if not lam.is_cont:
+                owner = lam
+                if lam.formals:
+                    self.owners[lam.formals[-1].w_form] = owner
+            self.walk(lam.body[0], owner)
+        if self.tainted:
+            return {}
+        conts = {}
+        for lam in self.passed:
+            conts[lam] = None
+        census = self.census
+        for w_name, lam in self.defined.items():
+            if (census.defs.get(w_name, 0) == 1 and
+                    w_name not in census.sets and
+                    w_name not in self.escaped):
+                conts[lam] = None
+        return conts
+
+    def walk(self, node, owner):
+        """ Walks a lambda body, from an explicit stack. An entry is a
+            node and whether it is the continuation argument of a call.
+        """
+        todo = [(node, False)]
+        while todo:
+            node, is_cont_arg = todo.pop()
+            if is_cont_arg:
+                self.cont_arg(node, owner, todo)
+            else:
+                node.escape(self, owner, todo)
+
+    def cont_arg(self, node, owner, todo):
+        if isinstance(node, Lambda) and node.is_cont:
+            self.passed.append(node)
+            self.pending_lambdas.append((node, owner))
+        elif isinstance(node, Var):
+            self.use(node.w_form, owner, True)
+        else:
+            todo.append((node, False))
+
+    def use(self, w_name, owner, passed):
+        """ A use of w_name: called or passed as a continuation if
+            passed, else as a value.
+        """
+        if w_name not in self.owners:
+            return
+        if self.owners[w_name] is not owner:
+            self.tainted = True
+        if not passed:
+            self.escaped[w_name] = None
+
+    def is_cont_var(self, node):
+        return isinstance(node, Var) and node.w_form in self.owners
+
+
+def push_all(todo, nodelist):
+    for i in xrange(len(nodelist) - 1, -1, -1):
+        todo.append((nodelist[i], False))
+
+class __extend__(Node):
+    def escape(self, ea, owner, todo):
+        """ Walks a node whose value may go anywhere. Its children go
+            on todo.
+        """
+        raise NotImplementedError
+
+class __extend__(If):
+    def escape(self, ea, owner, todo):
+        push_all(todo, [self.fst, self.snd, self.trd])
+
+class __extend__(Seq):
+    def escape(self, ea, owner, todo):
+        push_all(todo, self.nodelist)
+
+class __extend__(Apply):
+    def escape(self, ea, owner, todo):
+        # What is passed to a continuation is a value.
+        nb_values = len(self.args)
+        if not ea.is_cont_var(self.proc):
+            nb_values -= 1
+        if nb_values < len(self.args):
+            todo.append((self.args[-1], True))
+        for i in xrange(nb_values - 1, -1, -1):
+            todo.append((self.args[i], False))
+        proc = self.proc
+        if isinstance(proc, Var):
+            ea.use(proc.w_form, owner, True)
+        else:
+            todo.append((proc, False))
+
+class __extend__(PrimitiveOp):
+    def escape(self, ea, owner, todo):
+        push_all(todo, self.args)
+
+class __extend__(Def):
+    def escape(self, ea, owner, todo):
+        form = self.form
+        if (not self.toplevel and isinstance(form, Lambda) and
+                form.is_cont):
+            w_name = self.name.w_form
+            assert isinstance(w_name, W_Symbol)
+            ea.owners[w_name] = owner
+            ea.defined[w_name] = form
+            ea.pending_lambdas.append((form, owner))
+        else:
+            todo.append((form, False))
+
+class __extend__(Sete):
+    def escape(self, ea, owner, todo):
+        ea.use(self.name.w_form, owner, False)
+        todo.append((self.form, False))
+
+class __extend__(Lambda):
+    def escape(self, ea, owner, todo):
+        ea.pending_lambdas.append((self, owner))
+
+class __extend__(Var):
+    def escape(self, ea, owner, todo):
+        ea.use(self.w_form, owner, False)
+
+class __extend__(Const):
+    def escape(self, ea, owner, todo):
+        pass
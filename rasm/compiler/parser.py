@@ -1,82 +1,425 @@
-from pypy.rlib.parsing.makepackrat import (PackratParser, Status,
-                                           BacktrackException)
-from rasm.lang.model import (W_Root, W_Int, W_Pair, w_nil, w_true, w_false,
-                             symbol, w_unspec)
+""" parser.py
+
+    A hand-written streaming reader for s-expressions.
+
+    The reader pulls the source in fixed-size chunks and only keeps the
+    unconsumed part of the current chunk around, so it runs in linear time
+    and in memory bounded by the longest token. Nested data are built with
+    an explicit stack instead of recursion.
+"""
+from pypy.rlib.rarithmetic import ovfcheck
+from pypy.rlib.rbigint import rbigint
+from pypy.rlib.rfloat import string_to_float
+from pypy.rlib.rstring import StringBuilder
+from rasm.lang.model import (W_Pair, W_Float, W_String, W_Char, w_nil,
+                             w_true, w_false, symbol, list_to_pair, wrap_int,
+                             wrap_bigint)
+
+CHUNK_SIZE = 64 * 1024
+
+# Only this much of the erroneous line is kept for error messages.
+MAX_LINE_PREFIX = 160
 
 def parse_string(source):
-    exprs_w = SchemeParser(source).program()
-    assert isinstance(exprs_w[0], W_Root) # XXX pypy hack
-    return exprs_w
+    return Reader(StringSource(source)).read_all()
 
 def w_tag(s, w_x):
     return W_Pair(symbol(s), W_Pair(w_x, w_nil))
 
-class SchemeParser(PackratParser):
-    r'''
-    IGNORE:
-        SPACE | COMMENT;
-
-    SPACE:
-        `[ \t\n\r]`;
-
-    COMMENT:
-        `;[^\n]*`;
-
-    NUMBER:
-        `[+-]?[0-9]+`;
-
-    TRUE:
-        '#t';
-
-    FALSE:
-        '#f';
-
-    IDENT:
-        `[0-9a-zA-Z_!?@#$%&*+-/<>=]+`;
-
-    EOF:
-        !__any__;
-
-    program:
-        c = sexpr*
-        IGNORE*
-        EOF
-        return {c};
-
-    sexpr:
-        IGNORE*
-        '('
-        c = pair
-        IGNORE*
-        ')'
-        return {c}
-      | IGNORE*
-        c = TRUE
-        return {w_true}
-      | IGNORE*
-        c = FALSE
-        return {w_false}
-      | IGNORE*
-        c = NUMBER
-        return {W_Int(int(c or 'ERR'))}
-      | IGNORE*
-        `'`
-        c = sexpr
-        return {w_tag('quote', c)}
-      | IGNORE*
-        c = IDENT
-        return {symbol(c)};
-
-    pair:
-        car = sexpr
-        IGNORE*
-        '.'
-        cdr = sexpr
-        return {W_Pair(car, cdr)}
-      | car = sexpr
-        cdr = pair
-        return {W_Pair(car, cdr)}
-      | return {w_nil};
-    '''
-    noinit = True
+class ParseError(Exception):
+    def __init__(self, msg, lineno, columnno, line):
+        self.msg = msg
+        self.lineno = lineno
+        self.columnno = columnno
+        self.line = line
+
+    def nice_error_message(self, filename='<filename>', source=''):
+        # Same layout as PackratParser's error messages.
+        result = ['  File %s, line %s' % (filename, self.lineno + 1)]
+        result.append(self.line)
+        result.append(' ' * self.columnno + '^')
+        result.append('ParseError: %s' % self.msg)
+        return '\n'.join(result)
+
+
+class Source(object):
+    """ Where the reader pulls its characters from. """
+    def read(self, n):
+        raise NotImplementedError
+
+class StringSource(Source):
+    def __init__(self, s):
+        self.s = s
+        self.pos = 0
+
+    def read(self, n):
+        start = self.pos
+        stop = start + n
+        if stop > len(self.s):
+            stop = len(self.s)
+        assert start >= 0
+        assert stop >= start
+        self.pos = stop
+        return self.s[start:stop]
+
+class StreamSource(Source):
+    """ Wraps a pypy.rlib.streamio stream. """
+    def __init__(self, stream):
+        self.stream = stream
+
+    def read(self, n):
+        return self.stream.read(n)
+
+
+TOK_EOF = 0
+TOK_LPAREN = 1
+TOK_RPAREN = 2
+TOK_DOT = 3
+TOK_QUOTE = 4
+TOK_ATOM = 5
+TOK_STRING = 6
+TOK_CHAR = 7
+
+# The characters after a backslash in a string, and what they stand for.
+STRING_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', '\\': '\\', '"': '"'}
+
+# Named characters, as in #\space.
+CHAR_NAMES = {'space': ' ', 'newline': '\n', 'tab': '\t', 'return': '\r'}
+
+def is_space(c):
+    return c == ' ' or c == '\t' or c == '\n' or c == '\r'
+
+def is_digit(c):
+    return '0' <= c <= '9'
+
+def is_decimal(s, start):
+    """ Whether s[start:] reads as a float: digits with a '.' or an
+        exponent, as in 1.5, .5, 1. and 1e10.
+    """
+    i = start
+    digits = 0
+    while i < len(s) and is_digit(s[i]):
+        i += 1
+        digits += 1
+    dot = i < len(s) and s[i] == '.'
+    if dot:
+        i += 1
+        while i < len(s) and is_digit(s[i]):
+            i += 1
+            digits += 1
+    if digits == 0:
+        return False
+    if i == len(s):
+        return dot
+    if s[i] != 'e' and s[i] != 'E':
+        return False
+    i += 1
+    if i < len(s) and (s[i] == '+' or s[i] == '-'):
+        i += 1
+    if i == len(s):
+        return False
+    while i < len(s):
+        if not is_digit(s[i]):
+            return False
+        i += 1
+    return True
+
+def is_ident(c):
+    return (('a' <= c <= 'z') or ('A' <= c <= 'Z') or is_digit(c) or
+            c in '_!?@#$%&*+-./<>=')
+
+class Pending(object):
+    """ A compound datum that is still being read. """
+    LIST = 0
+    QUOTE = 1
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.items_w = []
+        self.dotted = False
+        self.w_tail = None
+
+class Reader(object):
+    def __init__(self, source, chunksize=CHUNK_SIZE):
+        self.source = source
+        self.chunksize = chunksize
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        # Line bookkeeping for error messages.
+        self.lineno = 0
+        self.linestart = 0
+        self.lineprefix = ''
+        self.linedropped = 0
+        # Position and text of the last token.
+        self.tokstart = 0
+        self.toklineno = 0
+        self.tokcolumnno = 0
+        self.tokval = ''
+
+    def read_all(self):
+        exprs_w = []
+        while True:
+            w_expr = self.read()
+            if w_expr is None:
+                break
+            exprs_w.append(w_expr)
+        return exprs_w
+
+    def read(self):
+        """ Read the next toplevel datum, or return None at the end of
+            the input.
+        """
+        stack = []
+        while True:
+            tok = self.next_token()
+            if tok == TOK_EOF:
+                if stack and stack[-1].kind == Pending.QUOTE:
+                    self.error('expected datum after quote')
+                elif stack:
+                    self.error("expected ')'")
+                return None
+            elif tok == TOK_LPAREN:
+                stack.append(Pending(Pending.LIST))
+                continue
+            elif tok == TOK_QUOTE:
+                stack.append(Pending(Pending.QUOTE))
+                continue
+            elif tok == TOK_DOT:
+                if (not stack or stack[-1].kind != Pending.LIST or
+                        not stack[-1].items_w or stack[-1].dotted):
+                    self.error("unexpected '.'")
+                stack[-1].dotted = True
+                continue
+            elif tok == TOK_RPAREN:
+                if not stack or stack[-1].kind != Pending.LIST:
+                    self.error("unexpected ')'")
+                pending = stack.pop()
+                w_tail = w_nil
+                if pending.dotted:
+                    if pending.w_tail is None:
+                        self.error("expected datum after '.'")
+                    w_tail = pending.w_tail
+                w_datum = list_to_pair(pending.items_w, w_tail)
+            elif tok == TOK_STRING:
+                w_datum = W_String(self.tokval)
+            elif tok == TOK_CHAR:
+                w_datum = W_Char(self.tokval[0])
+            else:
+                assert tok == TOK_ATOM
+                w_datum = self.atom(self.tokval)
+
+            # Hand the finished datum to whoever is waiting for it.
+            while True:
+                if not stack:
+                    return w_datum
+                pending = stack[-1]
+                if pending.kind == Pending.QUOTE:
+                    stack.pop()
+                    w_datum = w_tag('quote', w_datum)
+                    continue
+                if pending.dotted:
+                    if pending.w_tail is not None:
+                        self.error("expected ')'")
+                    pending.w_tail = w_datum
+                else:
+                    pending.items_w.append(w_datum)
+                break
+
+    def atom(self, s):
+        if s == '#t':
+            return w_true
+        elif s == '#f':
+            return w_false
+        start = 0
+        if s[0] == '+' or s[0] == '-':
+            start = 1
+        if start == len(s):
+            return symbol(s)
+        for i in xrange(start, len(s)):
+            if not is_digit(s[i]):
+                if is_decimal(s, start):
+                    return W_Float(string_to_float(s))
+                return symbol(s)
+        ival = 0
+        try:
+            for i in xrange(start, len(s)):
+                ival = ovfcheck(ival * 10 + (ord(s[i]) - ord('0')))
+        except OverflowError:
+            return wrap_bigint(rbigint.fromdecimalstr(s))
+        if s[0] == '-':
+            ival = -ival
+        return wrap_int(ival)
+
+    ############################################################
+    # Tokenizer
+
+    def next_token(self):
+        self.skip_ignored()
+        if not self.ensure(1):
+            self.mark_token()
+            return TOK_EOF
+        self.mark_token()
+        c = self.buf[self.pos]
+        if c == '(':
+            self.pos += 1
+            return TOK_LPAREN
+        elif c == ')':
+            self.pos += 1
+            return TOK_RPAREN
+        elif c == "'":
+            self.pos += 1
+            return TOK_QUOTE
+        elif c == '"':
+            self.pos += 1
+            return self.string_token()
+        elif c == '#' and self.ensure(2) and self.buf[self.pos + 1] == '\\':
+            self.pos += 2
+            return self.char_token()
+        elif not is_ident(c):
+            self.error("unexpected character '%s'" % c)
+        # An identifier or number: may straddle a chunk boundary.
+        while True:
+            while self.pos < len(self.buf) and is_ident(self.buf[self.pos]):
+                self.pos += 1
+            if self.pos < len(self.buf) or not self.refill(self.tokstart):
+                break
+        start = self.tokstart
+        stop = self.pos
+        assert start >= 0
+        assert stop >= start
+        self.tokval = self.buf[start:stop]
+        if self.tokval == '.':
+            return TOK_DOT
+        return TOK_ATOM
+
+    def string_token(self):
+        builder = StringBuilder()
+        while True:
+            if not self.ensure(1):
+                self.error('unterminated string')
+            c = self.buf[self.pos]
+            self.pos += 1
+            if c == '"':
+                break
+            elif c == '\\':
+                if not self.ensure(1):
+                    self.error('unterminated string')
+                escaped = STRING_ESCAPES.get(self.buf[self.pos], '')
+                if not escaped:
+                    self.error("unknown escape '\\%s'" % self.buf[self.pos])
+                self.pos += 1
+                builder.append(escaped)
+            else:
+                builder.append(c)
+                if c == '\n':
+                    self.newline()
+        self.tokval = builder.build()
+        return TOK_STRING
+
+    def char_token(self):
+        """ After #\\: one character, or the name of one. """
+        while self.pos >= len(self.buf):
+            if not self.refill(self.tokstart):
+                self.error('expected character')
+        self.pos += 1
+        while True:
+            while self.pos < len(self.buf) and is_ident(self.buf[self.pos]):
+                self.pos += 1
+            if self.pos < len(self.buf) or not self.refill(self.tokstart):
+                break
+        start = self.tokstart + 2
+        stop = self.pos
+        assert start >= 0
+        assert stop >= start
+        name = self.buf[start:stop]
+        if len(name) > 1:
+            name = CHAR_NAMES.get(name, '')
+            if not name:
+                self.error('unknown character name')
+        self.tokval = name
+        return TOK_CHAR
+
+    def skip_ignored(self):
+        in_comment = False
+        while True:
+            while self.pos < len(self.buf):
+                c = self.buf[self.pos]
+                if c == '\n':
+                    self.pos += 1
+                    self.newline()
+                    in_comment = False
+                elif in_comment or is_space(c):
+                    self.pos += 1
+                elif c == ';':
+                    self.pos += 1
+                    in_comment = True
+                else:
+                    return
+            if not self.refill(self.pos):
+                return
+
+    def newline(self):
+        self.lineno += 1
+        self.linestart = self.pos
+        self.lineprefix = ''
+        self.linedropped = 0
+
+    def ensure(self, n):
+        while self.pos + n > len(self.buf):
+            if not self.refill(self.pos):
+                return False
+        return True
+
+    def refill(self, keep):
+        """ Drop the buffer before `keep` and append the next chunk.
+            Returns False at the end of the input.
+        """
+        if self.eof:
+            return False
+        chunk = self.source.read(self.chunksize)
+        if not chunk:
+            self.eof = True
+            return False
+        assert keep >= 0
+        if keep > 0:
+            if self.linestart < keep:
+                linestart = self.linestart
+                assert linestart >= 0
+                dropped = self.buf[linestart:keep]
+                self.linedropped += len(dropped)
+                prefix = self.lineprefix + dropped
+                cut = len(prefix) - MAX_LINE_PREFIX
+                if cut > 0:
+                    prefix = prefix[cut:]
+                self.lineprefix = prefix
+                self.linestart = 0
+            else:
+                self.linestart -= keep
+            self.buf = self.buf[keep:] + chunk
+            self.pos -= keep
+            self.tokstart -= keep
+        else:
+            self.buf += chunk
+        return True
+
+    def mark_token(self):
+        self.tokstart = self.pos
+        self.toklineno = self.lineno
+        self.tokcolumnno = self.linedropped + self.pos - self.linestart
+
+    def current_line(self):
+        start = self.linestart
+        stop = start
+        while stop < len(self.buf) and self.buf[stop] != '\n':
+            stop += 1
+        assert start >= 0
+        assert stop >= 0
+        return self.lineprefix + self.buf[start:stop]
 
+    def error(self, msg):
+        line = self.current_line()
+        columnno = self.tokcolumnno - (self.linedropped - len(self.lineprefix))
+        if self.toklineno != self.lineno or columnno < 0:
+            columnno = 0
+        raise ParseError(msg, self.toklineno, columnno, line)
@@ -0,0 +1,321 @@
+""" peephole.py
+
+    Optimizes the bytecode of a proto between codegen and build_proto.
+    The code is taken apart into Insn objects, branches pointing at the
+    Insn they go to, rewritten, and laid out again with new offsets.
+
+    Folding, repeated until nothing changes:
+
+    - INT a; INT b; IADD/ISUB/IMUL/LT/EQUAL becomes the result, as do
+      IS and EQUAL on two of NIL, TRUE, FALSE and UNSPEC.
+    - A branch on a constant is either dropped or becomes a jump. There
+      is no jump opcode: a jump to the next live instruction is dropped,
+      others are written as FALSE; BRANCHIFNOT.
+    - A constant pushed and popped right away (the UNSPEC that a define
+      leaves in a sequence) is dropped.
+    - Code that cannot be reached is dropped.
+
+    Fusing: the instruction sequences that run most often become the
+    superinstructions of code.txt, so that the interpreter dispatches
+    once for them. The sequences were picked from the opcode pair and
+    triple counts of bench/bench_histogram.py:
+
+        LOAD a; LOAD b; IADD    -> LOAD2_IADD (a | b << 8)
+        LOAD n; CONT            -> LOADCONT n
+        GETUPVAL n; CONT        -> GETUPVALCONT n
+        GETGLOBAL k; CONT       -> GETGLOBALCONT k
+        INT i; IADD             -> IADDI i
+        INT i; ISUB             -> ISUBI i
+        LT; BRANCHIFNOT t       -> BRANCHIFNOTLT t
+        LOAD n; CALLKNOWN p     -> LOADCALLKNOWN (n | p << 16)
+        GETUPVAL n; CALLKNOWN p -> GETUPVALCALLKNOWN (n | p << 16)
+        LOAD n; SETARG i        -> LOADARG (n | i << 8)
+        GETUPVAL n; SETARG i    -> GETUPVALARG (n | i << 8)
+        BUILDCONT p; SETARG i   -> BUILDCONTARG (p | i << 16)
+        PUSHCONT p; SETARG i    -> PUSHCONTARG (p | i << 16)
+
+    An instruction that is a branch target is never folded or fused into
+    the one before it.
+"""
+from rasm.rt.code import (Op, argwidth, is_branch, ends_path, decode,
+                          emit, insn_size)
+
+# Pseudo opcodes, never in the output.
+END = -1
+JUMP = -2
+
+# (first, second) -> fused opcode. The fused instruction keeps the
+# operand of whichever of the two has one.
+pairs = {
+    (Op.LOAD, Op.CONT): Op.LOADCONT,
+    (Op.GETUPVAL, Op.CONT): Op.GETUPVALCONT,
+    (Op.GETGLOBAL, Op.CONT): Op.GETGLOBALCONT,
+    (Op.INT, Op.IADD): Op.IADDI,
+    (Op.INT, Op.ISUB): Op.ISUBI,
+    (Op.LT, Op.BRANCHIFNOT): Op.BRANCHIFNOTLT,
+}
+
+# Opcodes that push a value and do nothing else.
+pure_pushes = [Op.INT, Op.NIL, Op.TRUE, Op.FALSE, Op.UNSPEC,
+               Op.LOADCONST, Op.BUILDCONT, Op.DUP]
+
+# Opcodes that push a constant that is not false.
+true_pushes = [Op.INT, Op.NIL, Op.TRUE, Op.UNSPEC, Op.LOADCONST,
+               Op.BUILDCONT]
+
+# Opcodes that push a singleton, which eq? compares by opcode.
+singleton_pushes = [Op.NIL, Op.TRUE, Op.FALSE, Op.UNSPEC]
+
+class Insn(object):
+    def __init__(self, opcode, oparg):
+        self.opcode = opcode
+        self.oparg = oparg
+        self.target = None      # the Insn a branch or a jump goes to
+        self.is_target = False
+        self.live = False
+
+def peephole(code, fold=True, fuse=True):
+    insns = disassemble(code)
+    if fold:
+        while True:
+            size = len(insns)
+            insns = fold_insns(insns)
+            if len(insns) == size:
+                break
+        insns = drop_dead_code(insns)
+    if fuse:
+        insns = fuse_insns(insns)
+    return assemble(insns)
+
+def disassemble(code):
+    """ The last Insn is always the END of the code. """
+    flat = decode(code)
+    insns = [None] * (len(flat) / 2 + 1)
+    for i in xrange(len(flat) / 2):
+        insns[i] = Insn(flat[i * 2], flat[i * 2 + 1])
+    insns[-1] = Insn(END, 0)
+    for insn in insns:
+        if is_branch(insn.opcode):
+            insn.target = insns[insn.oparg / 2]
+    mark_targets(insns)
+    return insns
+
+def mark_targets(insns):
+    for insn in insns:
+        insn.is_target = False
+    for insn in insns:
+        if insn.target is not None:
+            insn.target.is_target = True
+
+def straight(insns, length):
+    """ Whether the last length instructions are entered from the first
+        only.
+    """
+    if len(insns) < length:
+        return False
+    for i in xrange(len(insns) - length + 1, len(insns)):
+        if insns[i].is_target:
+            return False
+    return True
+
+def fold_insns(insns):
+    out = []
+    for insn in insns:
+        out.append(insn)
+        while fold_last(out):
+            pass
+    mark_targets(out)
+    return out
+
+def fold_last(out):
+    """ Folds the instructions at the end of out, the first of which
+        takes the place of the sequence. Returns whether it did.
+    """
+    if straight(out, 3):
+        first = out[-3]
+        second = out[-2]
+        opcode = out[-1].opcode
+        if first.opcode == Op.INT and second.opcode == Op.INT:
+            x = first.oparg
+            y = second.oparg
+            if opcode == Op.IADD:
+                return fold_int(out, x + y)
+            elif opcode == Op.ISUB:
+                return fold_int(out, x - y)
+            elif opcode == Op.IMUL:
+                return fold_int(out, x * y)
+            elif opcode == Op.LT:
+                return fold_bool(out, x < y)
+            elif opcode == Op.EQUAL:
+                return fold_bool(out, x == y)
+        if (first.opcode in singleton_pushes and
+                second.opcode in singleton_pushes and
+                (opcode == Op.IS or opcode == Op.EQUAL)):
+            return fold_bool(out, first.opcode == second.opcode)
+    if straight(out, 2):
+        first = out[-2]
+        last = out[-1]
+        if (first.opcode in pure_pushes and last.opcode == Op.POP and
+                not first.is_target):
+            out.pop()
+            out.pop()
+            return True
+        if is_branch(last.opcode) and last.opcode != Op.BRANCHIFNOTLT:
+            taken = first.opcode == Op.FALSE
+            if not taken and first.opcode not in true_pushes:
+                return False
+            if last.opcode == Op.BRANCHIF:
+                taken = not taken
+            if taken:
+                first.opcode = JUMP
+                first.oparg = 0
+                first.target = last.target
+                del out[-1]
+            elif first.is_target:
+                return False
+            else:
+                out.pop()
+                out.pop()
+            return True
+    return False
+
+def fold_int(out, ival):
+    # Out of INT's range, the result would need a new constant.
+    if not 0 <= ival < (1 << 15):
+        return False
+    out[-3].oparg = ival
+    out.pop()
+    out.pop()
+    return True
+
+def fold_bool(out, value):
+    first = out[-3]
+    first.opcode = Op.TRUE if value else Op.FALSE
+    first.oparg = 0
+    out.pop()
+    out.pop()
+    return True
+
+def drop_dead_code(insns):
+    for insn in insns:
+        insn.live = False
+    insns[-1].live = True
+    positions = {}
+    for i in xrange(len(insns)):
+        positions[insns[i]] = i
+    worklist = [0]
+    while worklist:
+        i = worklist.pop()
+        while not insns[i].live:
+            insn = insns[i]
+            insn.live = True
+            if insn.target is not None:
+                worklist.append(positions[insn.target])
+            if insn.opcode == JUMP or ends_path(insn.opcode):
+                break
+            i += 1
+    out = [insn for insn in insns if insn.live]
+    mark_targets(out)
+    return out
+
+def fuse_insns(insns):
+    out = []
+    for insn in insns:
+        out.append(insn)
+        if (straight(out, 3) and out[-3].opcode == Op.LOAD and
+                out[-2].opcode == Op.LOAD and out[-1].opcode == Op.IADD and
+                out[-3].oparg <= 0xff and out[-2].oparg <= 0xff):
+            out[-3].opcode = Op.LOAD2_IADD
+            out[-3].oparg |= out[-2].oparg << 8
+            out.pop()
+            out.pop()
+        elif (straight(out, 2) and out[-1].opcode == Op.CALLKNOWN and
+                (out[-2].opcode == Op.LOAD or
+                 out[-2].opcode == Op.GETUPVAL) and
+                out[-2].oparg <= 0xffff):
+            if out[-2].opcode == Op.LOAD:
+                out[-2].opcode = Op.LOADCALLKNOWN
+            else:
+                out[-2].opcode = Op.GETUPVALCALLKNOWN
+            out[-2].oparg |= out[-1].oparg << 16
+            del out[-1]
+        elif (straight(out, 2) and out[-1].opcode == Op.SETARG and
+                (out[-2].opcode == Op.LOAD or
+                 out[-2].opcode == Op.GETUPVAL) and
+                out[-2].oparg <= 0xff and out[-1].oparg <= 0xff):
+            if out[-2].opcode == Op.LOAD:
+                out[-2].opcode = Op.LOADARG
+            else:
+                out[-2].opcode = Op.GETUPVALARG
+            out[-2].oparg |= out[-1].oparg << 8
+            del out[-1]
+        elif (straight(out, 2) and out[-1].opcode == Op.SETARG and
+                (out[-2].opcode == Op.BUILDCONT or
+                 out[-2].opcode == Op.PUSHCONT) and
+                out[-2].oparg <= 0xffff):
+            if out[-2].opcode == Op.BUILDCONT:
+                out[-2].opcode = Op.BUILDCONTARG
+            else:
+                out[-2].opcode = Op.PUSHCONTARG
+            out[-2].oparg |= out[-1].oparg << 16
+            del out[-1]
+        elif straight(out, 2):
+            first = out[-2]
+            last = out[-1]
+            fused = pairs.get((first.opcode, last.opcode), -1)
+            if fused != -1:
+                if argwidth(first.opcode) == 0:
+                    first.oparg = last.oparg
+                    first.target = last.target
+                first.opcode = fused
+                del out[-1]
+    mark_targets(out)
+    return out
+
+def assemble(insns):
+    # Offsets depend on the sizes of the instructions in between, which
+    # grow with the EXTENDED_ARG prefixes of wide offsets: lay the code
+    # out until the sizes stop changing. Forward branches only get
+    # longer, so this ends.
+    sizes = [0] * len(insns)
+    offsets = {}
+    changed = True
+    while changed:
+        offset = 0
+        for i in xrange(len(insns)):
+            offsets[insns[i]] = offset
+            offset += sizes[i]
+        changed = False
+        for i in xrange(len(insns) - 1):
+            opcode, oparg = layout(insns, i, offsets, sizes)
+            size = 0
+            if opcode == JUMP:
+                # A jump to the next instruction takes no room.
+                if insns[i].target is not insns[i + 1]:
+                    size = 1 + insn_size(Op.BRANCHIFNOT, oparg)
+            else:
+                size = insn_size(opcode, oparg)
+            if size > sizes[i]:
+                sizes[i] = size
+                changed = True
+
+    result = []
+    for i in xrange(len(insns)):
+        if sizes[i] == 0:
+            continue
+        opcode, oparg = layout(insns, i, offsets, sizes)
+        if opcode == JUMP:
+            result.append(chr(Op.FALSE))
+            opcode = Op.BRANCHIFNOT
+        emit(result, opcode, oparg)
+        assert len(result) == offsets[insns[i]] + sizes[i]
+    return ''.join(result)
+
+def layout(insns, i, offsets, sizes):
+    """ The opcode and the operand of insns[i], as laid out. """
+    insn = insns[i]
+    oparg = insn.oparg
+    if insn.target is not None:
+        oparg = offsets[insn.target] - (offsets[insn] + sizes[i])
+        assert oparg >= 0
+    return insn.opcode, oparg
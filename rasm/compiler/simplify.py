@@ -0,0 +1,487 @@
+""" simplify.py
+
+    Administrative-redex elimination on the output of cps.py.
+
+    Two kinds of lambdas are removed, together with the BUILDCONT that
+    creates them and the CONT that enters them:
+
+    - Direct applications ((lambda (x...) body) a...) are reduced in
+      place. The formals become locals of the enclosing lambda, or are
+      replaced by the arguments when these are constants or variables
+      that are never assigned.
+
+    - A continuation bound by a local define (the join continuations of
+      cps.py) that is only ever called, never passed around, is inlined
+      at its call sites: always when there is a single one, and when its
+      body is small and makes no closures otherwise.
+
+    The names introduced by the CPS transform are unique, so use counts
+    are kept by name for the whole program. Lambda bodies are handled
+    from worklists, as in cps.py, and the nodes of a body from an
+    explicit stack.
+"""
+from rasm.lang.model import W_Symbol
+from rasm.compiler.ast import (Node, If, Seq, Apply, Def, Sete, Lambda,
+                               Var, Const, PrimitiveOp, Mapper)
+from rasm.compiler.cps import newvar
+
+# Continuations called more than once are copied into each call site
+# only if their body has at most this many nodes.
+INLINE_SIZE = 8
+
+# Lambdas with more free names than this get no entry in Census.free.
+MAX_FREE = 32
+
+def simplify(node):
+    return Simplifier(node).run()
+
+class Census(object):
+    def __init__(self):
+        self.calls = {}       # name -> number of calls to it
+        self.refs = {}        # name -> number of other uses
+        self.defs = {}        # name -> number of local defines
+        self.bound = {}       # names bound as formals or local defines
+        self.assigned = {}    # names that are set! or defined at toplevel
+        self.deflambdas = {}  # name -> lambda it is defined to
+        self.sets = {}        # name -> number of set!s of it
+        self.setlambdas = {}  # name -> lambda it is set! to
+        self.formals = {}     # names bound as formals
+        self.free = {}        # lambda -> names it uses but does not bind
+        self.pending_lambdas = []
+        self.parent = -1      # index in run() of the lambda being walked
+        self.names = {}       # names used by the body being walked
+        self.locals_w = []    # names defined by the body being walked
+
+    def run(self, node):
+        self.walk(node)
+        walked = []
+        while self.pending_lambdas:
+            lam, parent = self.pending_lambdas.pop()
+            for formal in lam.formals:
+                self.bound[formal.w_form] = None
+                self.formals[formal.w_form] = None
+            self.parent = len(walked)
+            self.names = {}
+            self.locals_w = []
+            self.walk(lam.body[0])
+            walked.append((lam, parent, self.names, self.locals_w))
+        self.find_free(walked)
+
+    def find_free(self, walked):
+        """ Lambdas are walked before the lambdas they contain, so going
+            backwards gives each one the free names of its inner lambdas.
+            Past MAX_FREE names, a lambda and those around it are left
+            out, or the sets would take space quadratic in the nesting.
+        """
+        names_of = [names for _, _, names, _ in walked]
+        for i in xrange(len(walked) - 1, -1, -1):
+            lam, parent, _, locals_w = walked[i]
+            names = names_of[i]
+            if names is not None:
+                for formal in lam.formals:
+                    if formal.w_form in names:
+                        del names[formal.w_form]
+                for w_name in locals_w:
+                    if w_name in names:
+                        del names[w_name]
+                if len(names) > MAX_FREE:
+                    names = None
+                else:
+                    self.free[lam] = names
+            if parent < 0:
+                continue
+            parent_names = names_of[parent]
+            if names is None:
+                names_of[parent] = None
+            elif names and parent_names is not None:
+                parent_names.update(names)
+
+    def walk(self, node):
+        todo = [node]
+        while todo:
+            todo.pop().census(self, todo)
+
+    def count(self, table, w_name):
+        table[w_name] = table.get(w_name, 0) + 1
+        self.names[w_name] = None
+
+def push_all(todo, nodelist):
+    """ Pushes nodelist on todo so that it is popped in order. """
+    for i in xrange(len(nodelist) - 1, -1, -1):
+        todo.append(nodelist[i])
+
+def own_defs(node, names_w):
+    """ Collects the names of the local defines of node that are not
+        inside a nested lambda.
+    """
+    todo = [node]
+    while todo:
+        todo.pop().own_defs(names_w, todo)
+
+def inline_cost(node, candidates):
+    """ The number of nodes in node, or a number past INLINE_SIZE if it
+        is not to be copied.
+    """
+    cost = 0
+    todo = [node]
+    while todo and cost <= INLINE_SIZE:
+        cost += todo.pop().inline_cost(candidates, todo)
+    return cost
+
+class Simplifier(Mapper):
+    def __init__(self, node):
+        self.node = node
+        self.census = Census()
+        self.census.run(node)
+        self.inline = self.find_inlinable()
+        self.pending_lambdas = []
+
+    def find_inlinable(self):
+        census = self.census
+        candidates = {}
+        for w_name, lam in census.deflambdas.items():
+            if (census.defs[w_name] == 1 and
+                    w_name not in census.assigned and
+                    census.refs.get(w_name, 0) == 0):
+                candidates[w_name] = lam
+        inline = {}
+        for w_name, lam in candidates.items():
+            if (census.calls.get(w_name, 0) <= 1 or
+                    inline_cost(lam.body[0], candidates) <= INLINE_SIZE):
+                inline[w_name] = lam
+        return inline
+
+    def run(self):
+        node = self.map(self.node)
+        while self.pending_lambdas:
+            lam = self.pending_lambdas.pop()
+            # Inlining may add to the free names of a rewritten lambda.
+            if lam in self.census.free:
+                del self.census.free[lam]
+            lam.body = [self.map(lam.body[0])]
+        return node
+
+    def replace(self, node):
+        """ Reduces a call to an inlined continuation or a direct lambda
+            application, and drops the defines of inlined continuations.
+        """
+        if isinstance(node, Apply):
+            return self.reduce(node)
+        elif isinstance(node, Seq):
+            return self.replace_seq(node)
+        return node
+
+    def reduce(self, node):
+        assert isinstance(node, Apply)
+        proc = node.proc
+        if isinstance(proc, Var) and proc.w_form in self.inline:
+            return self.beta(self.inline[proc.w_form], node.args)
+        if isinstance(proc, Lambda) and len(proc.formals) == len(node.args):
+            return self.beta(proc, node.args)
+        return node
+
+    def replace_seq(self, node):
+        """ The call that ends a body is reduced here, and a body it
+            reduces to is spliced in: left to map() and Seq.simplify(),
+            a chain of them would be copied once per link.
+        """
+        nodelist = []
+        changed = False
+        todo = []
+        push_all(todo, node.nodelist)
+        while todo:
+            child = todo.pop()
+            if (isinstance(child, Def) and not child.toplevel and
+                    child.name.w_form in self.inline):
+                # The define goes away, its call sites get the body.
+                # This may be a copy of the lambda seen by the census.
+                lam = child.form
+                assert isinstance(lam, Lambda)
+                self.inline[child.name.w_form] = lam
+                changed = True
+                continue
+            if not todo:
+                while isinstance(child, Apply):
+                    newchild = self.reduce(child)
+                    if newchild is child:
+                        break
+                    child = newchild
+                    changed = True
+                if isinstance(child, Seq):
+                    push_all(todo, child.nodelist)
+                    continue
+            nodelist.append(child)
+        if changed:
+            return Seq(nodelist)
+        return node
+
+    def leave(self, node, children):
+        return node.simplify(self, children)
+
+    def is_stable(self, arg, w_formal):
+        """ Whether arg may be used in place of w_formal. """
+        assigned = self.census.assigned
+        if w_formal in assigned:
+            return False
+        if isinstance(arg, Const):
+            return True
+        if isinstance(arg, Var):
+            w_name = arg.w_form
+            return w_name in self.census.bound and w_name not in assigned
+        return False
+
+    def beta(self, lam, args):
+        body = self.try_beta(lam, args, True)
+        if body is None:
+            # Some argument would be captured: bind them all to locals.
+            body = self.try_beta(lam, args, False)
+        assert body is not None
+        return body
+
+    def try_beta(self, lam, args, propagate):
+        env = {}
+        protected = {}
+        prologue = []
+        for i in xrange(len(lam.formals)):
+            w_formal = lam.formals[i].w_form
+            arg = args[i]
+            if propagate and self.is_stable(arg, w_formal):
+                env[w_formal] = arg
+                if isinstance(arg, Var):
+                    protected[arg.w_form] = None
+            else:
+                var = newvar('$Inl_')
+                prologue.append(Def(var, arg))
+                env[w_formal] = var
+        # The body's own locals now live in the enclosing lambda.
+        names_w = []
+        own_defs(lam.body[0], names_w)
+        for w_name in names_w:
+            env[w_name] = newvar('$Inl_')
+        subst = Substitution(protected, self.census.free)
+        body = subst.run(lam.body[0], env)
+        if subst.captured:
+            return None
+        if not prologue:
+            return body
+        if isinstance(body, Seq):
+            return Seq(prologue + body.nodelist)
+        return Seq(prologue + [body])
+
+class Substitution(Mapper):
+    """ Copies a lambda body, replacing variables by atoms. """
+    def __init__(self, protected, free):
+        # Variables that replacements refer to: rebinding one of them in
+        # a nested lambda would capture it.
+        self.protected = protected
+        self.free = free
+        self.captured = False
+        self.pending_lambdas = []
+        self.env = {}
+
+    def run(self, node, env):
+        self.env = env
+        node = self.map(node)
+        while self.pending_lambdas:
+            newlambda, body, self.env = self.pending_lambdas.pop()
+            newlambda.body = [self.map(body)]
+        return node
+
+    def leave(self, node, children):
+        return node.subst(self, self.env, children)
+
+    def rename(self, var, env):
+        replacement = env.get(var.w_form, None)
+        if replacement is None:
+            return var
+        assert isinstance(replacement, Var)
+        return replacement
+
+
+class __extend__(Node):
+    def census(self, census, todo):
+        """ Counts this node, and pushes its children on todo. """
+        raise NotImplementedError
+
+    def simplify(self, sp, children):
+        return self.rebuild(children)
+
+    def subst(self, subst, env, children):
+        return self.rebuild(children)
+
+    def own_defs(self, names_w, todo):
+        pass
+
+    def inline_cost(self, candidates, todo):
+        """ The cost of this node; the children to count go on todo. """
+        return 1
+
+class __extend__(Var):
+    def census(self, census, todo):
+        census.count(census.refs, self.w_form)
+
+    def simplify(self, sp, children):
+        return self
+
+    def subst(self, subst, env, children):
+        return env.get(self.w_form, self)
+
+class __extend__(Const):
+    def census(self, census, todo):
+        pass
+
+    def simplify(self, sp, children):
+        return self
+
+    def subst(self, subst, env, children):
+        return self
+
+class __extend__(Lambda):
+    def census(self, census, todo):
+        census.pending_lambdas.append((self, census.parent))
+
+    def simplify(self, sp, children):
+        sp.pending_lambdas.append(self)
+        return self
+
+    def subst(self, subst, env, children):
+        free = subst.free.get(self, None)
+        if free is not None:
+            for w_name in env:
+                if w_name in free:
+                    break
+            else:
+                # Nothing to replace inside: share the lambda.
+                return self
+        names_w = [formal.w_form for formal in self.formals]
+        own_defs(self.body[0], names_w)
+        inner = {}
+        for w_name, node in env.items():
+            inner[w_name] = node
+        for w_name in names_w:
+            if w_name in subst.protected:
+                subst.captured = True
+            if w_name in inner:
+                del inner[w_name]
+        if not inner:
+            return self
+        newlambda = Lambda(self.formals, [], self.name, self.is_cont)
+        subst.pending_lambdas.append((newlambda, self.body[0], inner))
+        return newlambda
+
+    def inline_cost(self, candidates, todo):
+        return INLINE_SIZE + 1
+
+class __extend__(PrimitiveOp):
+    def census(self, census, todo):
+        # self.proc names the operation, it is not a variable.
+        push_all(todo, self.args)
+
+    def inline_cost(self, candidates, todo):
+        push_all(todo, self.args)
+        return 1
+
+class __extend__(Def):
+    def census(self, census, todo):
+        w_name = self.name.w_form
+        assert isinstance(w_name, W_Symbol)
+        if self.toplevel:
+            census.assigned[w_name] = None
+        else:
+            census.count(census.defs, w_name)
+            census.locals_w.append(w_name)
+            census.bound[w_name] = None
+            if isinstance(self.form, Lambda):
+                census.deflambdas[w_name] = self.form
+        todo.append(self.form)
+
+    def subst(self, subst, env, children):
+        name = self.name
+        if not self.toplevel:
+            name = subst.rename(name, env)
+        newdef = Def(name, children[0])
+        newdef.toplevel = self.toplevel
+        return newdef
+
+    def own_defs(self, names_w, todo):
+        if not self.toplevel:
+            names_w.append(self.name.w_form)
+
+    def inline_cost(self, candidates, todo):
+        if not self.toplevel:
+            return INLINE_SIZE + 1
+        todo.append(self.form)
+        return 1
+
+class __extend__(Sete):
+    def census(self, census, todo):
+        w_name = self.name.w_form
+        census.assigned[w_name] = None
+        census.count(census.sets, w_name)
+        if isinstance(self.form, Lambda):
+            census.setlambdas[w_name] = self.form
+        todo.append(self.form)
+
+    def subst(self, subst, env, children):
+        return Sete(subst.rename(self.name, env), children[0])
+
+    def inline_cost(self, candidates, todo):
+        todo.append(self.form)
+        return 1
+
+class __extend__(Apply):
+    def census(self, census, todo):
+        push_all(todo, self.args)
+        proc = self.proc
+        if isinstance(proc, Var):
+            w_name = proc.w_form
+            lam = census.deflambdas.get(w_name, None)
+            if lam is None or len(lam.formals) == len(self.args):
+                census.count(census.calls, w_name)
+            else:
+                # Leave arity errors to the runtime.
+                census.count(census.refs, w_name)
+        else:
+            todo.append(proc)
+
+    def inline_cost(self, candidates, todo):
+        proc = self.proc
+        if isinstance(proc, Var) and proc.w_form in candidates:
+            # Copying it would copy the other continuation as well.
+            return INLINE_SIZE + 1
+        todo.append(proc)
+        push_all(todo, self.args)
+        return 1
+
+class __extend__(If):
+    def census(self, census, todo):
+        push_all(todo, [self.fst, self.snd, self.trd])
+
+    def own_defs(self, names_w, todo):
+        push_all(todo, [self.snd, self.trd])
+
+    def inline_cost(self, candidates, todo):
+        push_all(todo, [self.fst, self.snd, self.trd])
+        return 1
+
+class __extend__(Seq):
+    def census(self, census, todo):
+        push_all(todo, self.nodelist)
+
+    def simplify(self, sp, children):
+        nodelist = []
+        for node in children:
+            if isinstance(node, Seq):
+                nodelist.extend(node.nodelist)
+            else:
+                nodelist.append(node)
+        if len(nodelist) == 1:
+            return nodelist[0]
+        return Seq(nodelist)
+
+    def own_defs(self, names_w, todo):
+        push_all(todo, self.nodelist)
+
+    def inline_cost(self, candidates, todo):
+        push_all(todo, self.nodelist)
+        return 0
@@ -0,0 +1,103 @@
+""" arith.py
+
+    Integer arithmetic that does not wrap around: a result that does not
+    fit in a W_Int becomes a W_BigInt, and a W_BigInt result that fits
+    becomes a W_Int again. The opcodes check for two W_Ints themselves
+    and call the *_int functions, which is one overflow check in a
+    trace; the *_w functions take anything.
+
+    A W_Float on either side makes the result a W_Float. There are no
+    rationals: div_w gives an integer when the division is exact and a
+    W_Float otherwise.
+"""
+from pypy.rlib.rarithmetic import ovfcheck
+from pypy.rlib.rbigint import rbigint
+from rasm.lang.model import (W_Int, W_BigInt, W_Float, W_TypeError,
+                             W_ValueError, wrap_int, wrap_bigint)
+
+def to_bigint(w_x, where):
+    if isinstance(w_x, W_Int):
+        return rbigint.fromint(w_x.ival)
+    elif isinstance(w_x, W_BigInt):
+        return w_x.bigval
+    raise W_TypeError('Int', w_x, where).wrap()
+
+def add_int(x, y):
+    try:
+        z = ovfcheck(x + y)
+    except OverflowError:
+        return W_BigInt(rbigint.fromint(x).add(rbigint.fromint(y)))
+    return wrap_int(z)
+
+def sub_int(x, y):
+    try:
+        z = ovfcheck(x - y)
+    except OverflowError:
+        return W_BigInt(rbigint.fromint(x).sub(rbigint.fromint(y)))
+    return wrap_int(z)
+
+def mul_int(x, y):
+    try:
+        z = ovfcheck(x * y)
+    except OverflowError:
+        return W_BigInt(rbigint.fromint(x).mul(rbigint.fromint(y)))
+    return wrap_int(z)
+
+def div_int(x, y):
+    if y == 0:
+        raise W_ValueError('divide by zero', W_Int(x), 'div()').wrap()
+    if x % y != 0:
+        return W_Float(float(x) / float(y))
+    try:
+        z = ovfcheck(x / y)
+    except OverflowError:
+        return W_BigInt(rbigint.fromint(x).floordiv(rbigint.fromint(y)))
+    return wrap_int(z)
+
+def is_float(w_x, w_y):
+    return isinstance(w_x, W_Float) or isinstance(w_y, W_Float)
+
+def add_w(w_x, w_y):
+    if isinstance(w_x, W_Int) and isinstance(w_y, W_Int):
+        return add_int(w_x.ival, w_y.ival)
+    if is_float(w_x, w_y):
+        return W_Float(w_x.to_float() + w_y.to_float())
+    return wrap_bigint(to_bigint(w_x, 'add()').add(to_bigint(w_y, 'add()')))
+
+def sub_w(w_x, w_y):
+    if isinstance(w_x, W_Int) and isinstance(w_y, W_Int):
+        return sub_int(w_x.ival, w_y.ival)
+    if is_float(w_x, w_y):
+        return W_Float(w_x.to_float() - w_y.to_float())
+    return wrap_bigint(to_bigint(w_x, 'sub()').sub(to_bigint(w_y, 'sub()')))
+
+def mul_w(w_x, w_y):
+    if isinstance(w_x, W_Int) and isinstance(w_y, W_Int):
+        return mul_int(w_x.ival, w_y.ival)
+    if is_float(w_x, w_y):
+        return W_Float(w_x.to_float() * w_y.to_float())
+    return wrap_bigint(to_bigint(w_x, 'mul()').mul(to_bigint(w_y, 'mul()')))
+
+def lt_w(w_x, w_y):
+    if isinstance(w_x, W_Int) and isinstance(w_y, W_Int):
+        return w_x.ival < w_y.ival
+    if is_float(w_x, w_y):
+        return w_x.to_float() < w_y.to_float()
+    return to_bigint(w_x, 'lt()').lt(to_bigint(w_y, 'lt()'))
+
+def div_w(w_x, w_y):
+    if isinstance(w_x, W_Int) and isinstance(w_y, W_Int):
+        return div_int(w_x.ival, w_y.ival)
+    if is_float(w_x, w_y):
+        y = w_y.to_float()
+        if y == 0.0:
+            raise W_ValueError('divide by zero', w_x, 'div()').wrap()
+        return W_Float(w_x.to_float() / y)
+    bigx = to_bigint(w_x, 'div()')
+    bigy = to_bigint(w_y, 'div()')
+    if not bigy.tobool():
+        raise W_ValueError('divide by zero', w_x, 'div()').wrap()
+    bigq, bigr = bigx.divmod(bigy)
+    if bigr.tobool():
+        return W_Float(w_x.to_float() / w_y.to_float())
+    return wrap_bigint(bigq)
@@ -0,0 +1,202 @@
+""" datum.py
+
+    Printing and equal? over pairs and vectors. Both walk the data with
+    explicit stacks instead of recursing, so neither a long list nor a
+    deeply nested one can overflow the stack. Printing appends to one
+    StringBuilder instead of joining the strings of the parts.
+
+    Neither looks for cycles in the first CYCLE_CHECK_AFTER pairs and
+    vectors, which keeps acyclic data cheap. Past that:
+
+    - write() keeps the pairs and vectors it is in the middle of, and
+      prints '...' for one that contains itself.
+    - equal() remembers which objects it has compared with which, and
+      takes two objects met again as equal. If they differ, the
+      difference is found on the first visit anyway.
+"""
+from pypy.rlib.rstring import StringBuilder
+from rasm.lang.model import W_Pair, w_nil
+from rasm.lang.vector import W_Vector
+
+CYCLE_CHECK_AFTER = 10000
+
+# What a stack entry of write() stands for.
+VALUE = 0       # an object to print
+TAIL = 1        # the rest of a list after an item
+VECTOR = 2      # the items of a vector from an index on
+
+class Printer(object):
+    def __init__(self, builder):
+        self.builder = builder
+        # The stack, one entry in each list.
+        self.todo_w = []
+        self.kinds = []
+        self.marks_w = []   # TAIL: its first tracked pair; VECTOR: itself
+                            # if tracked
+        self.ints = []      # TAIL: its number of tracked pairs;
+                            # VECTOR: the next index
+        self.count = 0
+        self.active = {}    # tracked pairs and vectors being printed
+
+    def push(self, kind, w_x, w_mark, i):
+        self.todo_w.append(w_x)
+        self.kinds.append(kind)
+        self.marks_w.append(w_mark)
+        self.ints.append(i)
+
+    def tracking(self):
+        return self.count > CYCLE_CHECK_AFTER
+
+    def write(self, w_x):
+        self.push(VALUE, w_x, None, 0)
+        while self.todo_w:
+            w_x = self.todo_w.pop()
+            kind = self.kinds.pop()
+            w_mark = self.marks_w.pop()
+            i = self.ints.pop()
+            if kind == VALUE:
+                self.write_value(w_x)
+            elif kind == TAIL:
+                self.write_tail(w_x, w_mark, i)
+            else:
+                assert isinstance(w_x, W_Vector)
+                self.write_items(w_x, w_mark, i)
+
+    def write_value(self, w_x):
+        if isinstance(w_x, W_Pair):
+            if self.active and w_x in self.active:
+                self.builder.append('...')
+                return
+            self.builder.append('(')
+            self.count += 1
+            w_first = None
+            tracked = 0
+            if self.tracking():
+                self.active[w_x] = None
+                w_first = w_x
+                tracked = 1
+            self.push(TAIL, w_x.w_cdr, w_first, tracked)
+            self.push(VALUE, w_x.w_car, None, 0)
+        elif isinstance(w_x, W_Vector):
+            if self.active and w_x in self.active:
+                self.builder.append('...')
+                return
+            self.builder.append('#(')
+            self.count += 1
+            w_mark = None
+            if self.tracking():
+                self.active[w_x] = None
+                w_mark = w_x
+            self.push(VECTOR, w_x, w_mark, 0)
+        else:
+            self.builder.append(w_x.to_string())
+
+    def write_tail(self, w_rest, w_first, tracked):
+        # Items that are not pairs or vectors are printed right away, so
+        # a flat list does not go through the stack at all.
+        while isinstance(w_rest, W_Pair):
+            if self.active and w_rest in self.active:
+                self.builder.append(' . ...)')
+                self.untrack(w_first, tracked)
+                return
+            self.builder.append(' ')
+            self.count += 1
+            if self.tracking():
+                self.active[w_rest] = None
+                if w_first is None:
+                    w_first = w_rest
+                tracked += 1
+            w_car = w_rest.w_car
+            if isinstance(w_car, W_Pair) or isinstance(w_car, W_Vector):
+                self.push(TAIL, w_rest.w_cdr, w_first, tracked)
+                self.push(VALUE, w_car, None, 0)
+                return
+            self.builder.append(w_car.to_string())
+            w_rest = w_rest.w_cdr
+        if w_rest is w_nil:
+            self.builder.append(')')
+            self.untrack(w_first, tracked)
+        else:
+            self.builder.append(' . ')
+            self.push(TAIL, w_nil, w_first, tracked)
+            self.push(VALUE, w_rest, None, 0)
+
+    def write_items(self, w_vector, w_mark, index):
+        if index < w_vector.length():
+            if index > 0:
+                self.builder.append(' ')
+            self.push(VECTOR, w_vector, w_mark, index + 1)
+            self.push(VALUE, w_vector.getitem(index), None, 0)
+        else:
+            self.builder.append(')')
+            if w_mark is not None:
+                del self.active[w_mark]
+
+    def untrack(self, w_first, tracked):
+        """ The tracked pairs of a list are the last ones of it. """
+        w_pair = w_first
+        for i in xrange(tracked):
+            assert isinstance(w_pair, W_Pair)
+            del self.active[w_pair]
+            w_pair = w_pair.w_cdr
+
+def write(builder, w_x):
+    Printer(builder).write(w_x)
+
+def to_string(w_x):
+    builder = StringBuilder()
+    write(builder, w_x)
+    return builder.build()
+
+def equal(w_x, w_y):
+    todo_x = [w_x]
+    todo_y = [w_y]
+    count = 0
+    compared = None     # object -> the objects it was compared with
+    while todo_x:
+        w_x = todo_x.pop()
+        w_y = todo_y.pop()
+        if w_x is w_y:
+            continue
+        if isinstance(w_x, W_Pair):
+            if not isinstance(w_y, W_Pair):
+                return False
+            count += 1
+            if count > CYCLE_CHECK_AFTER:
+                if compared is None:
+                    compared = {}
+                if seen(compared, w_x, w_y):
+                    continue
+            todo_x.append(w_x.w_cdr)
+            todo_y.append(w_y.w_cdr)
+            todo_x.append(w_x.w_car)
+            todo_y.append(w_y.w_car)
+        elif isinstance(w_x, W_Vector):
+            if not isinstance(w_y, W_Vector):
+                return False
+            if w_x.length() != w_y.length():
+                return False
+            count += 1
+            if count > CYCLE_CHECK_AFTER:
+                if compared is None:
+                    compared = {}
+                if seen(compared, w_x, w_y):
+                    continue
+            for i in xrange(w_x.length() - 1, -1, -1):
+                todo_x.append(w_x.getitem(i))
+                todo_y.append(w_y.getitem(i))
+        elif not w_x.equal_w(w_y).to_bool():
+            return False
+    return True
+
+def seen(compared, w_x, w_y):
+    """ Whether w_x was compared with w_y before. Records it if not. """
+    others_w = compared.get(w_x, None)
+    if others_w is None:
+        compared[w_x] = [w_y]
+        return False
+    for w_other in others_w:
+        if w_other is w_y:
+            return True
+    others_w.append(w_y)
+    return False
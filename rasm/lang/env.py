@@ -30,6 +30,17 @@ class ModuleDict(W_Root):
     def to_string(self):
         return '#<ModuleDict (%d)>' % len(self.bindings_w)
 
+    def copy(self):
+        """ A module with the same bindings. Cells are copied as well so
+            that assignments in one module don't show up in the other.
+        """
+        w_module = ModuleDict()
+        for w_key, w_value in self.bindings_w.iteritems():
+            if isinstance(w_value, ModuleCell):
+                w_value = ModuleCell(w_value.w_value)
+            w_module.bindings_w[w_key] = w_value
+        return w_module
+
     def mutated(self):
         self.version = VersionTag()
 
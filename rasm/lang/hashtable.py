@@ -0,0 +1,185 @@
+""" hashtable.py
+
+    W_HashTable, for eq? or equal? keys, laid out as PyPy and CPython
+    lay out dicts: the entries are appended to dense lists of hashes,
+    keys and values, in insertion order, and an open-addressing table of
+    indices into them is probed on lookup. A slot of the index table is
+    an int, so an entry costs its three list items plus between one and
+    a half and four index slots.
+
+    Deleting leaves None in the entry and DUMMY in its slot. The index
+    table is rebuilt, and the entries compacted, when the dense lists
+    fill two thirds of it.
+
+    equal_hash() hashes data as equal_w compares them, but iteratively
+    and only so far: it looks at no more than HASH_BUDGET objects, in
+    the same order for equal data.
+"""
+from pypy.rlib.rarithmetic import intmask, r_uint
+from rasm.lang.model import W_Root, W_Int, W_Pair, w_true
+from rasm.lang.vector import W_Vector, list_to_vector
+
+FREE = -1
+DUMMY = -2
+
+MIN_SIZE = 8
+PERTURB_SHIFT = 5
+
+HASH_BUDGET = 64
+
+def mix(h, x):
+    return intmask((r_uint(h) ^ r_uint(x)) * r_uint(1000003))
+
+def equal_hash(w_x):
+    h = 0x345678
+    todo = [w_x]
+    budget = HASH_BUDGET
+    while todo and budget > 0:
+        w_x = todo.pop()
+        budget -= 1
+        if isinstance(w_x, W_Pair):
+            h = mix(h, 1)
+            todo.append(w_x.w_cdr)
+            todo.append(w_x.w_car)
+        elif isinstance(w_x, W_Vector):
+            size = w_x.length()
+            h = mix(h, size)
+            for i in xrange(min(size, budget) - 1, -1, -1):
+                todo.append(w_x.getitem(i))
+        else:
+            h = mix(h, w_x.hash_w())
+    return h
+
+def eq_hash(w_x):
+    if isinstance(w_x, W_Int):
+        return w_x.ival
+    return w_x.hash_w()
+
+def eq_same(w_x, w_y):
+    """ eq?, but W_Ints compare by value in boxed builds too, as they
+        do in a tagged one: else no int key could be found again.
+    """
+    if w_x is w_y:
+        return True
+    if isinstance(w_x, W_Int) and isinstance(w_y, W_Int):
+        return w_x.ival == w_y.ival
+    return False
+
+class W_HashTable(W_Root):
+    def __init__(self, equal):
+        self.equal = equal
+        self.indices = [FREE] * MIN_SIZE
+        self.hashes = []
+        self.keys_w = []        # None for deleted entries
+        self.values_w = []
+        self.count = 0
+
+    def to_string(self):
+        if self.equal:
+            return '#<equal-hashtable %d>' % self.count
+        return '#<eq-hashtable %d>' % self.count
+
+    def hash(self, w_key):
+        if self.equal:
+            return equal_hash(w_key)
+        return eq_hash(w_key)
+
+    def same(self, w_x, w_y):
+        if self.equal:
+            return w_x.equal_w(w_y) is w_true
+        return eq_same(w_x, w_y)
+
+    def find_slot(self, w_key, h):
+        """ The slot of indices that holds the entry of w_key, or else
+            the FREE one that ends its probe sequence.
+        """
+        mask = len(self.indices) - 1
+        perturb = r_uint(h)
+        i = h & mask
+        while True:
+            index = self.indices[i]
+            if index == FREE:
+                return i
+            if (index >= 0 and self.hashes[index] == h and
+                    self.same(self.keys_w[index], w_key)):
+                return i
+            perturb >>= PERTURB_SHIFT
+            i = intmask((r_uint(i) * 5 + 1 + perturb) & r_uint(mask))
+
+    def get(self, w_key, w_default):
+        index = self.indices[self.find_slot(w_key, self.hash(w_key))]
+        if index < 0:
+            return w_default
+        return self.values_w[index]
+
+    def contains(self, w_key):
+        return self.indices[self.find_slot(w_key, self.hash(w_key))] >= 0
+
+    def set(self, w_key, w_value):
+        h = self.hash(w_key)
+        slot = self.find_slot(w_key, h)
+        index = self.indices[slot]
+        if index >= 0:
+            self.values_w[index] = w_value
+            return
+        self.indices[slot] = len(self.keys_w)
+        self.hashes.append(h)
+        self.keys_w.append(w_key)
+        self.values_w.append(w_value)
+        self.count += 1
+        if len(self.keys_w) * 3 >= len(self.indices) * 2:
+            self.rebuild()
+
+    def delete(self, w_key):
+        slot = self.find_slot(w_key, self.hash(w_key))
+        index = self.indices[slot]
+        if index < 0:
+            return
+        self.indices[slot] = DUMMY
+        self.keys_w[index] = None
+        self.values_w[index] = None
+        self.count -= 1
+
+    def rebuild(self):
+        """ Compacts the entries into an index table that they fill at
+            most half, so that a third more can come before the next
+            rebuild.
+        """
+        size = MIN_SIZE
+        while size <= self.count * 2:
+            size *= 2
+        hashes = []
+        keys_w = []
+        values_w = []
+        for i in xrange(len(self.keys_w)):
+            w_key = self.keys_w[i]
+            if w_key is not None:
+                hashes.append(self.hashes[i])
+                keys_w.append(w_key)
+                values_w.append(self.values_w[i])
+        self.hashes = hashes
+        self.keys_w = keys_w
+        self.values_w = values_w
+        self.indices = [FREE] * size
+        mask = size - 1
+        for index in xrange(len(keys_w)):
+            h = hashes[index]
+            perturb = r_uint(h)
+            i = h & mask
+            while self.indices[i] != FREE:
+                perturb >>= PERTURB_SHIFT
+                i = intmask((r_uint(i) * 5 + 1 + perturb) & r_uint(mask))
+            self.indices[i] = index
+
+    def keys(self):
+        """ A vector of the keys, in insertion order. """
+        return list_to_vector([w_key for w_key in self.keys_w
+                               if w_key is not None])
+
+    def values(self):
+        """ A vector of the values, in the order of keys(). """
+        values_w = []
+        for i in xrange(len(self.keys_w)):
+            if self.keys_w[i] is not None:
+                values_w.append(self.values_w[i])
+        return list_to_vector(values_w)
@@ -1,8 +1,15 @@
-from pypy.rlib.objectmodel import UnboxedValue
+import os
+from pypy.rlib.objectmodel import (UnboxedValue, compute_identity_hash,
+                                   compute_hash)
+from pypy.rlib.rbigint import rbigint
+from pypy.rlib.rfloat import formatd, DTSF_ADD_DOT_0
 from pypy.tool.pairtype import extendabletype
 from rasm.error import OperationError
 
-USING_SMALLINT = False
+# Ints as tagged pointers: translate with RASM_SMALLINT=1 in the
+# environment, which also turns on the taggedpointers option (see
+# targetinterp.py). A W_SmallInt has one bit less than a machine int.
+USING_SMALLINT = os.environ.get('RASM_SMALLINT', '0') == '1'
 
 class W_Root(object):
     __slots__ = []
@@ -14,14 +21,27 @@ class W_Root(object):
     def to_int(self):
         raise W_TypeError('Int', self, 'to_int()').wrap()
 
+    def to_float(self):
+        raise W_TypeError('Number', self, 'to_float()').wrap()
+
     def to_bool(self):
         return True
 
     def to_list(self):
+        """ The items of a list and its tail. Raises on a circular list,
+            which w_slow, going at half the speed, catches up with.
+        """
         items_w = []
+        w_slow = self
         while isinstance(self, W_Pair):
             items_w.append(self.w_car)
             self = self.w_cdr
+            if len(items_w) & 1 == 0:
+                assert isinstance(w_slow, W_Pair)
+                w_slow = w_slow.w_cdr
+                if w_slow is self:
+                    raise W_ValueError('circular list', w_slow,
+                                       'to_list()').wrap()
         return items_w, self
 
     def is_null(self):
@@ -37,6 +57,11 @@ class W_Root(object):
     def equal_w(self, w_x):
         return self.is_w(w_x)
 
+    # A hash consistent with equal_w, for the atoms. Compound data are
+    # hashed by hashtable.equal_hash().
+    def hash_w(self):
+        return compute_identity_hash(self)
+
     def car_w(self):
         raise W_TypeError('Pair', self, 'car_w()').wrap()
 
@@ -60,18 +85,13 @@ class W_Pair(W_Root):
         self.w_cdr = w_cdr
 
     def to_string(self):
-        items_w, w_rest = self.to_list()
-        head = '(' + ' '.join([w_x.to_string() for w_x in items_w])
-        if w_rest.is_null():
-            return head + ')'
-        else:
-            return head + ' . ' + w_rest.to_string() + ')'
+        from rasm.lang.datum import to_string
+        return to_string(self)
 
-    # Recursively compare equality
     def equal_w(self, w_x):
-        if isinstance(w_x, W_Pair):
-            return (self.w_car.equal_w(w_x.w_car) and
-                    self.w_cdr.equal_w(w_x.w_cdr))
+        from rasm.lang.datum import equal
+        if equal(self, w_x):
+            return w_true
         return w_false
 
     def car_w(self):
@@ -97,12 +117,18 @@ class W_SmallInt(W_Root, UnboxedValue):
     def to_int(self):
         return self.ival
 
+    def to_float(self):
+        return float(self.ival)
+
     def equal_w(self, w_x):
         if isinstance(w_x, W_Int):
             if self.ival == w_x.ival:
                 return w_true
         return w_false
 
+    def hash_w(self):
+        return self.ival
+
 class W_Integer(W_Root):
     _immutable_fields_ = ['ival']
     __slots__ = ['ival']
@@ -116,17 +142,91 @@ class W_Integer(W_Root):
     def to_int(self):
         return self.ival
 
+    def to_float(self):
+        return float(self.ival)
+
     def equal_w(self, w_x):
         if isinstance(w_x, W_Int):
             if self.ival == w_x.ival:
                 return w_true
         return w_false
 
+    def hash_w(self):
+        return self.ival
+
 if USING_SMALLINT:
     W_Int = W_SmallInt
 else:
     W_Int = W_Integer
 
+class W_BigInt(W_Root):
+    """ An integer that does not fit in a W_Int. Only those are made
+        one, see wrap_bigint(), so a W_BigInt never equals a W_Int.
+    """
+    _immutable_fields_ = ['bigval']
+    __slots__ = ['bigval']
+
+    def __init__(self, bigval):
+        self.bigval = bigval
+
+    def to_string(self):
+        return self.bigval.str()
+
+    def to_int(self):
+        raise W_ValueError('integer out of range', self, 'to_int()').wrap()
+
+    def to_float(self):
+        try:
+            return self.bigval.tofloat()
+        except OverflowError:
+            raise W_ValueError('integer out of range', self,
+                               'to_float()').wrap()
+
+    def equal_w(self, w_x):
+        if isinstance(w_x, W_BigInt):
+            if self.bigval.eq(w_x.bigval):
+                return w_true
+        return w_false
+
+    def hash_w(self):
+        return self.bigval.hash()
+
+class W_Float(W_Root):
+    _immutable_fields_ = ['floatval']
+    __slots__ = ['floatval']
+
+    def __init__(self, floatval):
+        self.floatval = floatval
+
+    def to_string(self):
+        return formatd(self.floatval, 'r', 0, DTSF_ADD_DOT_0)
+
+    def to_float(self):
+        return self.floatval
+
+    def equal_w(self, w_x):
+        if isinstance(w_x, W_Float):
+            if self.floatval == w_x.floatval:
+                return w_true
+        return w_false
+
+    def hash_w(self):
+        return compute_hash(self.floatval)
+
+def wrap_int(ival):
+    """ A W_Int, or a W_BigInt if ival does not fit in a tagged one. """
+    try:
+        return W_Int(ival)
+    except OverflowError:
+        return W_BigInt(rbigint.fromint(ival))
+
+def wrap_bigint(bigval):
+    try:
+        ival = bigval.toint()
+    except OverflowError:
+        return W_BigInt(bigval)
+    return wrap_int(ival)
+
 class W_Symbol(W_Root):
     interned_w = {}
 
@@ -143,6 +243,45 @@ def symbol(sval):
         W_Symbol.interned_w[sval] = w_sym
     return w_sym
 
+class W_String(W_Root):
+    """ An immutable string. Prints as display does, without quotes. """
+    _immutable_fields_ = ['sval']
+    __slots__ = ['sval']
+
+    def __init__(self, sval):
+        self.sval = sval
+
+    def to_string(self):
+        return self.sval
+
+    def equal_w(self, w_x):
+        if isinstance(w_x, W_String):
+            if self.sval == w_x.sval:
+                return w_true
+        return w_false
+
+    def hash_w(self):
+        return compute_hash(self.sval)
+
+class W_Char(W_Root):
+    _immutable_fields_ = ['chval']
+    __slots__ = ['chval']
+
+    def __init__(self, chval):
+        self.chval = chval
+
+    def to_string(self):
+        return self.chval
+
+    def equal_w(self, w_x):
+        if isinstance(w_x, W_Char):
+            if self.chval == w_x.chval:
+                return w_true
+        return w_false
+
+    def hash_w(self):
+        return ord(self.chval)
+
 class GensymCounter(object):
     i = 0
 gensym_counter = GensymCounter()
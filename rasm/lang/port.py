@@ -0,0 +1,164 @@
+""" port.py
+
+    Ports.
+
+    A W_OutputPort collects what is written to it and hands it to its
+    file descriptor with as few os.write() calls as it can: once
+    BUFFER_SIZE bytes are pending, on flush-output, when the port is
+    closed, and for all open ports when the program stops (see
+    flush_all()).
+
+    Values are displayed as a whole: a list goes through datum.py into
+    one string, which is added to the pending chunks as it is.
+
+    A W_InputPort reads data with the streaming reader of parser.py,
+    one datum per read and without going over earlier input again. The
+    reader pulls INPUT_CHUNK_SIZE bytes at a time from the file, or from
+    a memory map of it for files of at least MMAP_THRESHOLD bytes.
+"""
+import os
+from pypy.rlib import rmmap
+from pypy.rlib.jit import dont_look_inside
+from rasm.lang.model import W_Root, W_String, W_ValueError, w_eof
+from rasm.compiler.parser import Reader, Source, ParseError, CHUNK_SIZE
+
+BUFFER_SIZE = 64 * 1024
+INPUT_CHUNK_SIZE = 1024 * 1024
+MMAP_THRESHOLD = 16 * 1024 * 1024
+
+class W_OutputPort(W_Root):
+    def __init__(self, fd, name):
+        self.fd = fd
+        self.name = name
+        self.chunks = []    # written but not flushed yet
+        self.size = 0       # their total length
+        self.closed = False
+
+    def to_string(self):
+        return '#<output-port %s>' % self.name
+
+    def write(self, s):
+        if self.closed:
+            raise W_ValueError('closed port', self, 'write()').wrap()
+        self.chunks.append(s)
+        self.size += len(s)
+        if self.size >= BUFFER_SIZE:
+            self.flush()
+
+    def display(self, w_x):
+        self.write(w_x.to_string())
+
+    def flush(self):
+        if self.size == 0:
+            return
+        data = ''.join(self.chunks)
+        self.chunks = []
+        self.size = 0
+        write_all(self.fd, data, self)
+
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        self.closed = True
+        open_ports.remove(self)
+        os.close(self.fd)
+
+def write_all(fd, data, w_port):
+    while data:
+        try:
+            written = os.write(fd, data)
+        except OSError as e:
+            raise W_ValueError(os.strerror(e.errno), w_port,
+                               'flush()').wrap()
+        assert written >= 0
+        data = data[written:]
+
+stdout_port = W_OutputPort(1, 'stdout')
+
+# The ports that flush_all() flushes.
+open_ports = [stdout_port]
+
+def open_output_file(path):
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0666)
+    except OSError as e:
+        raise W_ValueError(os.strerror(e.errno), W_String(path),
+                           'open_output_file()').wrap()
+    w_port = W_OutputPort(fd, path)
+    open_ports.append(w_port)
+    return w_port
+
+def flush_all():
+    for w_port in open_ports:
+        w_port.flush()
+
+
+class FdSource(Source):
+    """ Raises OSError. """
+    def __init__(self, fd):
+        self.fd = fd
+
+    def read(self, n):
+        return os.read(self.fd, n)
+
+class MapSource(Source):
+    def __init__(self, map):
+        self.map = map
+
+    def read(self, n):
+        return self.map.read(n)
+
+class W_InputPort(W_Root):
+    def __init__(self, fd, name, source, map=None, chunksize=CHUNK_SIZE):
+        self.fd = fd
+        self.name = name
+        self.map = map      # the rmmap.MMap that source reads, if any
+        self.reader = Reader(source, chunksize)
+        self.closed = False
+
+    def to_string(self):
+        return '#<input-port %s>' % self.name
+
+    @dont_look_inside
+    def read(self):
+        """ The next datum, or the eof object. """
+        if self.closed:
+            raise W_ValueError('closed port', self, 'read()').wrap()
+        try:
+            w_x = self.reader.read()
+        except ParseError as e:
+            raise W_ValueError('line %d: %s' % (e.lineno + 1, e.msg), self,
+                               'read()').wrap()
+        except OSError as e:
+            raise W_ValueError(os.strerror(e.errno), self, 'read()').wrap()
+        if w_x is None:
+            return w_eof
+        return w_x
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.map is not None:
+            self.map.close()
+        os.close(self.fd)
+
+stdin_port = W_InputPort(0, 'stdin', FdSource(0))
+
+def open_input_file(path):
+    try:
+        fd = os.open(path, os.O_RDONLY, 0)
+    except OSError as e:
+        raise W_ValueError(os.strerror(e.errno), W_String(path),
+                           'open_input_file()').wrap()
+    size = os.fstat(fd).st_size
+    if size > 0 and size >= MMAP_THRESHOLD:
+        try:
+            map = rmmap.mmap(fd, size, rmmap.MAP_SHARED, rmmap.PROT_READ)
+        except (rmmap.RMMapError, OSError):
+            pass    # read it then
+        else:
+            return W_InputPort(fd, path, MapSource(map), map,
+                               INPUT_CHUNK_SIZE)
+    return W_InputPort(fd, path, FdSource(fd), None, INPUT_CHUNK_SIZE)
@@ -0,0 +1,307 @@
+""" vector.py
+
+    W_Vector, with its items kept the way PyPy keeps list items: a
+    strategy object knows the layout of the storage, which is erased so
+    that W_Vector has a single storage field.
+
+    - IntStrategy: a list of machine ints, no W_Int per item.
+    - FloatStrategy: a list of floats, no W_Float per item.
+    - ObjectStrategy: a list of W_Roots.
+
+    make_vector picks the strategy of the fill. Storing an item that the
+    strategy cannot hold switches the vector to ObjectStrategy for good.
+
+    The bulk operations at the end run over the unerased storage of int
+    and float vectors without making a W_Int or a W_Float per item, and
+    item by item through the generic arithmetic of arith.py otherwise.
+"""
+from pypy.rlib import rerased
+from pypy.rlib.rarithmetic import ovfcheck
+from rasm.lang.model import (W_Root, W_Int, W_Float, W_IndexError,
+                             W_ValueError, w_true, w_false, wrap_int)
+from rasm.lang.arith import add_w, sub_w, mul_w
+
+class W_Vector(W_Root):
+    __slots__ = ['strategy', 'storage']
+
+    def __init__(self, strategy, storage):
+        self.strategy = strategy
+        self.storage = storage
+
+    def to_string(self):
+        from rasm.lang.datum import to_string
+        return to_string(self)
+
+    def equal_w(self, w_x):
+        from rasm.lang.datum import equal
+        if equal(self, w_x):
+            return w_true
+        return w_false
+
+    def length(self):
+        return self.strategy.length(self)
+
+    def check_index(self, index, where):
+        if not 0 <= index < self.length():
+            raise W_IndexError(self, index, where).wrap()
+
+    def getitem(self, index):
+        return self.strategy.getitem(self, index)
+
+    def setitem(self, index, w_x):
+        self.strategy.setitem(self, index, w_x)
+
+    def switch_to_objects(self):
+        items_w = [self.getitem(i) for i in xrange(self.length())]
+        self.strategy = object_strategy
+        self.storage = object_strategy.erase(items_w)
+
+
+class VectorStrategy(object):
+    """ The items of a W_Vector, in its storage. """
+    _attrs_ = []
+
+    def length(self, w_vector):
+        raise NotImplementedError
+
+    def getitem(self, w_vector, index):
+        raise NotImplementedError
+
+    def setitem(self, w_vector, index, w_x):
+        raise NotImplementedError
+
+    def make(self, size, w_fill):
+        raise NotImplementedError
+
+class TypedStrategyMixin(object):
+    """ A storage of a list of whatever unwrap() gives, laid out as
+        erase() and unerase() say. Copied into each strategy so that
+        every unerase() has its own result type.
+    """
+    _mixin_ = True
+
+    def length(self, w_vector):
+        return len(self.unerase(w_vector.storage))
+
+    def getitem(self, w_vector, index):
+        return self.wrap(self.unerase(w_vector.storage)[index])
+
+    def setitem(self, w_vector, index, w_x):
+        if self.accepts(w_x):
+            self.unerase(w_vector.storage)[index] = self.unwrap(w_x)
+        else:
+            w_vector.switch_to_objects()
+            w_vector.setitem(index, w_x)
+
+    def make(self, size, w_fill):
+        return W_Vector(self, self.erase([self.unwrap(w_fill)] * size))
+
+class IntStrategy(TypedStrategyMixin, VectorStrategy):
+    erase, unerase = rerased.new_erasing_pair('int')
+    erase = staticmethod(erase)
+    unerase = staticmethod(unerase)
+
+    def wrap(self, ival):
+        # The bulk operations store ints that a tagged W_Int may not hold.
+        return wrap_int(ival)
+
+    def unwrap(self, w_x):
+        assert isinstance(w_x, W_Int)
+        return w_x.ival
+
+    def accepts(self, w_x):
+        return isinstance(w_x, W_Int)
+
+class FloatStrategy(TypedStrategyMixin, VectorStrategy):
+    erase, unerase = rerased.new_erasing_pair('float')
+    erase = staticmethod(erase)
+    unerase = staticmethod(unerase)
+
+    def wrap(self, floatval):
+        return W_Float(floatval)
+
+    def unwrap(self, w_x):
+        assert isinstance(w_x, W_Float)
+        return w_x.floatval
+
+    def accepts(self, w_x):
+        return isinstance(w_x, W_Float)
+
+class ObjectStrategy(TypedStrategyMixin, VectorStrategy):
+    erase, unerase = rerased.new_erasing_pair('object')
+    erase = staticmethod(erase)
+    unerase = staticmethod(unerase)
+
+    def wrap(self, w_x):
+        return w_x
+
+    def unwrap(self, w_x):
+        return w_x
+
+    def accepts(self, w_x):
+        return True
+
+int_strategy = IntStrategy()
+float_strategy = FloatStrategy()
+object_strategy = ObjectStrategy()
+
+def strategy_for(w_x):
+    if isinstance(w_x, W_Int):
+        return int_strategy
+    elif isinstance(w_x, W_Float):
+        return float_strategy
+    return object_strategy
+
+def make_vector(size, w_fill):
+    if size < 0:
+        raise W_ValueError('negative size', W_Int(size),
+                           'make_vector()').wrap()
+    return strategy_for(w_fill).make(size, w_fill)
+
+def list_to_vector(items_w):
+    if not items_w:
+        return make_vector(0, W_Int(0))
+    w_vector = make_vector(len(items_w), items_w[0])
+    for i in xrange(1, len(items_w)):
+        w_vector.setitem(i, items_w[i])
+    return w_vector
+
+################################################################################
+# Bulk operations
+
+# The operators of vector_map().
+OP_ADD = 0
+OP_SUB = 1
+OP_MUL = 2
+
+def apply_op(op, w_x, w_y):
+    if op == OP_ADD:
+        return add_w(w_x, w_y)
+    elif op == OP_SUB:
+        return sub_w(w_x, w_y)
+    return mul_w(w_x, w_y)
+
+def int_op(op, x, y):
+    """ Raises OverflowError. """
+    if op == OP_ADD:
+        return ovfcheck(x + y)
+    elif op == OP_SUB:
+        return ovfcheck(x - y)
+    return ovfcheck(x * y)
+
+def float_op(op, x, y):
+    if op == OP_ADD:
+        return x + y
+    elif op == OP_SUB:
+        return x - y
+    return x * y
+
+def check_same_length(w_x, w_y, where):
+    if w_x.length() != w_y.length():
+        raise W_ValueError('length %d differs' % w_x.length(), w_y,
+                           where).wrap()
+
+def vector_sum(w_vector):
+    strategy = w_vector.strategy
+    if strategy is int_strategy:
+        ints = int_strategy.unerase(w_vector.storage)
+        total = 0
+        for i in xrange(len(ints)):
+            try:
+                total = ovfcheck(total + ints[i])
+            except OverflowError:
+                return sum_items(w_vector, i, wrap_int(total))
+        return wrap_int(total)
+    elif strategy is float_strategy:
+        floats = float_strategy.unerase(w_vector.storage)
+        ftotal = 0.0
+        for i in xrange(len(floats)):
+            ftotal += floats[i]
+        return W_Float(ftotal)
+    return sum_items(w_vector, 0, W_Int(0))
+
+def sum_items(w_vector, start, w_total):
+    for i in xrange(start, w_vector.length()):
+        w_total = add_w(w_total, w_vector.getitem(i))
+    return w_total
+
+def vector_dot(w_x, w_y):
+    check_same_length(w_x, w_y, 'vector_dot()')
+    if w_x.strategy is int_strategy and w_y.strategy is int_strategy:
+        xs = int_strategy.unerase(w_x.storage)
+        ys = int_strategy.unerase(w_y.storage)
+        total = 0
+        for i in xrange(len(xs)):
+            try:
+                total = ovfcheck(total + ovfcheck(xs[i] * ys[i]))
+            except OverflowError:
+                return dot_items(w_x, w_y, i, wrap_int(total))
+        return wrap_int(total)
+    elif w_x.strategy is float_strategy and w_y.strategy is float_strategy:
+        fxs = float_strategy.unerase(w_x.storage)
+        fys = float_strategy.unerase(w_y.storage)
+        ftotal = 0.0
+        for i in xrange(len(fxs)):
+            ftotal += fxs[i] * fys[i]
+        return W_Float(ftotal)
+    return dot_items(w_x, w_y, 0, W_Int(0))
+
+def dot_items(w_x, w_y, start, w_total):
+    for i in xrange(start, w_x.length()):
+        w_total = add_w(w_total, mul_w(w_x.getitem(i), w_y.getitem(i)))
+    return w_total
+
+def vector_map(op, w_dst, w_src):
+    """ w_dst[i] = w_dst[i] op w_src[i] for each i. """
+    check_same_length(w_dst, w_src, 'vector_map()')
+    if w_dst.strategy is int_strategy and w_src.strategy is int_strategy:
+        dst = int_strategy.unerase(w_dst.storage)
+        src = int_strategy.unerase(w_src.storage)
+        for i in xrange(len(dst)):
+            try:
+                dst[i] = int_op(op, dst[i], src[i])
+            except OverflowError:
+                map_items(op, w_dst, w_src, i)
+                return
+    elif (w_dst.strategy is float_strategy and
+            w_src.strategy is float_strategy):
+        fdst = float_strategy.unerase(w_dst.storage)
+        fsrc = float_strategy.unerase(w_src.storage)
+        for i in xrange(len(fdst)):
+            fdst[i] = float_op(op, fdst[i], fsrc[i])
+    else:
+        map_items(op, w_dst, w_src, 0)
+
+def map_items(op, w_dst, w_src, start):
+    for i in xrange(start, w_dst.length()):
+        w_dst.setitem(i, apply_op(op, w_dst.getitem(i), w_src.getitem(i)))
+
+def vector_fill(w_vector, w_fill):
+    """ Every item is replaced, so the vector takes the strategy of
+        w_fill.
+    """
+    w_filled = make_vector(w_vector.length(), w_fill)
+    w_vector.strategy = w_filled.strategy
+    w_vector.storage = w_filled.storage
+
+def vector_copy(w_dst, at, w_src):
+    """ Copies all of w_src into w_dst from index at on. """
+    size = w_src.length()
+    if not 0 <= at <= w_dst.length() - size:
+        raise W_IndexError(w_dst, at, 'vector_copy()').wrap()
+    if w_dst.strategy is int_strategy and w_src.strategy is int_strategy:
+        dst = int_strategy.unerase(w_dst.storage)
+        src = int_strategy.unerase(w_src.storage)
+        for i in xrange(size):
+            dst[at + i] = src[i]
+    elif (w_dst.strategy is float_strategy and
+            w_src.strategy is float_strategy):
+        fdst = float_strategy.unerase(w_dst.storage)
+        fsrc = float_strategy.unerase(w_src.storage)
+        for i in xrange(size):
+            fdst[at + i] = fsrc[i]
+    elif w_dst is w_src:
+        pass
+    else:
+        for i in xrange(size):
+            w_dst.setitem(at + i, w_src.getitem(i))
@@ -1,4 +1,5 @@
 from pypy.rlib.debug import check_nonneg
+from pypy.rlib.rmd5 import RMD5
 from rasm.util import load_descr_file
 from rasm.lang.model import W_Root
 
@@ -15,6 +16,11 @@ def load_code_descr():
 
 codenames, codemap, last_i16, last_u8 = load_code_descr()
 
+# Identifies the opcode table, so that serialized bytecode compiled against
+# a different code.txt is never loaded.
+codehash = RMD5('%s/%d/%d' % (' '.join(codenames),
+                              last_i16, last_u8)).digest()
+
 class Op(object):
     vars().update(codemap)
 
@@ -27,10 +33,266 @@ def argwidth(opcode):
     else:
         return 2
 
+def is_branch(opcode):
+    return (opcode == Op.BRANCHIF or opcode == Op.BRANCHIFNOT or
+            opcode == Op.BRANCHIFNOTLT)
+
+def ends_path(opcode):
+    """ Whether control never falls through opcode. """
+    return (opcode == Op.CONT or opcode == Op.CALLKNOWN or
+            opcode == Op.HALT or opcode == Op.LOADCONT or
+            opcode == Op.GETUPVALCONT or opcode == Op.GETGLOBALCONT or
+            opcode == Op.LOADCALLKNOWN or opcode == Op.GETUPVALCALLKNOWN)
+
+# Net number of values each opcode pushes. CONT and HALT end the code
+# path they are on, so theirs only matters for underflow checking. The
+# superinstructions never go deeper than their net effect.
+stack_effects = {
+    'INT': 1, 'BRANCHIF': -1, 'BRANCHIFNOT': -1, 'BUILDCONT': 1,
+    'PUSHCONT': 1,
+    'CALLKNOWN': -1,
+    'EXTENDED_ARG': 0, 'BRANCHIFNOTLT': -2,
+    'LOADCALLKNOWN': 0, 'GETUPVALCALLKNOWN': 0,
+    'IADDI': 0, 'ISUBI': 0, 'LOAD2_IADD': 1,
+    'LOADARG': 0, 'GETUPVALARG': 0, 'BUILDCONTARG': 0, 'PUSHCONTARG': 0,
+    'LOAD': 1, 'STORE': -1, 'SETARG': -1, 'BOX': 0,
+    'GETUPVAL': 1, 'SETUPVAL': -1,
+    'GETGLOBAL': 1, 'SETGLOBAL': -1, 'LOADCONST': 1,
+    'LOADCONT': 0, 'GETUPVALCONT': 0, 'GETGLOBALCONT': 0,
+    'CONT': -1, 'HALT': -1,
+    'POP': -1, 'DUP': 1, 'ROT': 0,
+    'NIL': 1, 'TRUE': 1, 'FALSE': 1, 'UNSPEC': 1,
+    'CONS': -1, 'CAR': 0, 'CDR': 0, 'SETCAR': -2, 'SETCDR': -2,
+    'MAKEVECTOR': -1, 'VECTORREF': -1, 'VECTORSET': -2, 'VECTORLENGTH': 0,
+    'VECTORSUM': 0, 'VECTORDOT': -1, 'VECTORMAP': -2, 'VECTORFILL': -1,
+    'VECTORCOPY': -2,
+    'MAKEEQHASHTABLE': 1, 'MAKEEQUALHASHTABLE': 1, 'HASHTABLEREF': -2,
+    'HASHTABLESET': -2, 'HASHTABLEDELETE': -1, 'HASHTABLECONTAINS': -1,
+    'HASHTABLECOUNT': 0, 'HASHTABLEKEYS': 0, 'HASHTABLEVALUES': 0,
+    'IADD': -1, 'ISUB': -1, 'IMUL': -1, 'IDIV': -1,
+    'FADD': -1, 'FSUB': -1, 'FMUL': -1, 'FDIV': -1, 'FLT': -1,
+    'FSQRT': 0, 'TOFLOAT': 0,
+    'IS': -1, 'EQUAL': -1, 'LT': -1, 'NULLP': 0, 'PAIRP': 0, 'INTEGERP': 0,
+    'VECTORP': 0,
+    'NOT': 0, 'OR': -1, 'AND': -1,
+    'PRINT': -1, 'NEWLINE': 0,
+    'CURRENTOUTPUTPORT': 1, 'OPENOUTPUTFILE': 0, 'CLOSEOUTPUTPORT': 0,
+    'FLUSHOUTPUT': 0, 'DISPLAY': -1, 'WRITESTRING': -1, 'WRITECHAR': -1,
+    'WRITENEWLINE': 0,
+    'CURRENTINPUTPORT': 1, 'OPENINPUTFILE': 0, 'CLOSEINPUTPORT': 0,
+    'EOFP': 0,
+    'REIFYCC': 0, 'UNWIND': 0, 'READ': 0, 'COMPILE': -1,
+}
+stack_effect = [stack_effects[name] for name in codenames]
+
+class BytecodeError(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+def fetch(code, pc):
+    """ Reads the instruction at pc. Returns its opcode, its operand
+        (0 if it has none) and the pc of the next one. EXTENDED_ARG
+        prefixes are read as the high bits of the operand, which is how
+        operands wider than their encoding are written.
+    """
+    start = pc
+    ext = 0
+    while True:
+        if pc >= len(code):
+            raise BytecodeError('EXTENDED_ARG at the end of code at %d' %
+                                start)
+        opcode = ord(code[pc])
+        if opcode >= len(codenames):
+            raise BytecodeError('bad opcode %d at %d' % (opcode, pc))
+        width = argwidth(opcode)
+        if pc + width >= len(code):
+            raise BytecodeError('truncated operand at %d' % pc)
+        if width == 2:
+            oparg = ord(code[pc + 1]) | (ord(code[pc + 2]) << 8)
+        elif width == 1:
+            oparg = ord(code[pc + 1])
+        else:
+            oparg = 0
+        pc += 1 + width
+        if opcode != Op.EXTENDED_ARG:
+            break
+        ext = (ext << 16) | oparg
+    if ext:
+        if width == 0:
+            raise BytecodeError('EXTENDED_ARG without an operand at %d' %
+                                start)
+        oparg |= ext << (8 * width)
+    return opcode, oparg, pc
+
+def emit(code, opcode, oparg=0):
+    """ Appends the instruction to code, a list of chars, with the
+        EXTENDED_ARG prefixes its operand needs.
+    """
+    width = argwidth(opcode)
+    assert oparg >= 0
+    ext = oparg >> (8 * width)
+    if ext:
+        emit(code, Op.EXTENDED_ARG, ext)
+    code.append(chr(opcode))
+    if width == 1:
+        code.append(chr(oparg & 0xff))
+    elif width == 2:
+        code.append(chr(oparg & 0xff))
+        code.append(chr((oparg >> 8) & 0xff))
+
+def insn_size(opcode, oparg):
+    """ The bytes emit() takes for the instruction. """
+    width = argwidth(opcode)
+    size = 1 + width
+    ext = oparg >> (8 * width)
+    while ext:
+        size += 3
+        ext >>= 16
+    return size
+
+def max_stackdepth(code, nb_locals, nb_upvals):
+    """ Returns the deepest the stack gets while running code, counting
+        the locals below the temporaries. Local and upval operands are
+        checked against the layout on the way.
+    """
+    depth_at = [-1] * (len(code) + 1)
+    depth_at[0] = 0
+    worklist = [0]
+    maxdepth = 0
+    while worklist:
+        pc = worklist.pop()
+        depth = depth_at[pc]
+        while pc < len(code):
+            opcode, oparg, nextpc = fetch(code, pc)
+            if ((opcode == Op.LOAD or opcode == Op.STORE or
+                    opcode == Op.SETARG or opcode == Op.BOX or
+                    opcode == Op.LOADCONT) and
+                    oparg >= nb_locals):
+                raise BytecodeError('local %d out of range at %d' %
+                                    (oparg, pc))
+            if opcode == Op.LOAD2_IADD and ((oparg & 0xff) >= nb_locals or
+                                            (oparg >> 8) >= nb_locals):
+                raise BytecodeError('local out of range at %d' % pc)
+            if (opcode == Op.LOADCALLKNOWN and
+                    (oparg & 0xffff) >= nb_locals):
+                raise BytecodeError('local out of range at %d' % pc)
+            if opcode == Op.LOADARG and ((oparg & 0xff) >= nb_locals or
+                                         (oparg >> 8) >= nb_locals):
+                raise BytecodeError('local out of range at %d' % pc)
+            if opcode == Op.GETUPVALARG and ((oparg & 0xff) >= nb_upvals or
+                                             (oparg >> 8) >= nb_locals):
+                raise BytecodeError('upval or local out of range at %d' %
+                                    pc)
+            if ((opcode == Op.BUILDCONTARG or opcode == Op.PUSHCONTARG) and
+                    (oparg >> 16) >= nb_locals):
+                raise BytecodeError('local out of range at %d' % pc)
+            if (opcode == Op.GETUPVALCALLKNOWN and
+                    (oparg & 0xffff) >= nb_upvals):
+                raise BytecodeError('upval out of range at %d' % pc)
+            if ((opcode == Op.GETUPVAL or opcode == Op.SETUPVAL or
+                    opcode == Op.GETUPVALCONT) and oparg >= nb_upvals):
+                raise BytecodeError('upval %d out of range at %d' %
+                                    (oparg, pc))
+            depth += stack_effect[opcode]
+            # Code may pop into the locals: halt returns its argument so.
+            if depth < -nb_locals:
+                raise BytecodeError('stack underflow at %d' % pc)
+            if depth > maxdepth:
+                maxdepth = depth
+            if ends_path(opcode):
+                break
+            if is_branch(opcode):
+                target = nextpc + oparg
+                if target > len(code):
+                    raise BytecodeError('branch out of code at %d' % pc)
+                if depth_at[target] == -1:
+                    depth_at[target] = depth
+                    worklist.append(target)
+                elif depth_at[target] != depth:
+                    raise BytecodeError('inconsistent stack depth at %d' %
+                                        target)
+            if depth_at[nextpc] != -1:
+                if depth_at[nextpc] != depth:
+                    raise BytecodeError('inconsistent stack depth at %d' %
+                                        nextpc)
+                break
+            depth_at[nextpc] = depth
+            pc = nextpc
+    return nb_locals + maxdepth
+
+def decode(code):
+    """ Returns code as a flat list of ints, two per instruction: the
+        opcode and its operand (0 if it has none). EXTENDED_ARG is folded
+        into the operand of the instruction it prefixes. Branch offsets
+        are resolved to the position of their target in the list.
+    """
+    positions = [0] * (len(code) + 1)
+    nb_insns = 0
+    pc = 0
+    while pc < len(code):
+        positions[pc] = nb_insns * 2
+        _, _, pc = fetch(code, pc)
+        nb_insns += 1
+    positions[len(code)] = nb_insns * 2
+    insns = [0] * (nb_insns * 2)
+    i = 0
+    pc = 0
+    while pc < len(code):
+        opcode, oparg, pc = fetch(code, pc)
+        if is_branch(opcode):
+            oparg = positions[pc + oparg]
+        insns[i] = opcode
+        insns[i + 1] = oparg
+        i += 2
+    return insns
+
+class CallCache(object):
+    """ The inline cache of a GETGLOBALCONT: the binding the global was
+        found to have the last time, the module version it was looked up
+        in and the continuation it unwraps to, whose type and arity were
+        checked then. See Frame.GETGLOBALCONT.
+    """
+    def __init__(self):
+        self.version = None
+        self.w_binding = None
+        self.w_cont = None
+
+class CallCacheStats(object):
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def reset(self):
+        self.hits = 0
+        self.misses = 0
+
+    def to_string(self):
+        total = self.hits + self.misses
+        if total == 0:
+            return 'call caches: no global calls'
+        return 'call caches: %d hits, %d misses (%d%% hits)' % (
+                self.hits, self.misses, self.hits * 100 / total)
+
+callcache_stats = CallCacheStats()
+
+def make_callcaches(insns):
+    """ One CallCache per GETGLOBALCONT, at half its position in insns,
+        None elsewhere.
+    """
+    callcaches = [None] * (len(insns) / 2)
+    for i in xrange(len(callcaches)):
+        if insns[i * 2] == Op.GETGLOBALCONT:
+            callcaches[i] = CallCache()
+    return callcaches
+
 class W_Proto(W_Root):
     _immutable_ = True
-    _immutable_fields_ = ['const_w[*]']
+    _immutable_fields_ = ['upval_descr[*]', 'const_w[*]', 'insns[*]',
+                          'callcaches[*]']
     name = '#f'
+    # Position in the proto table, or -1 for protos that are not in it
+    # (the main proto and the builtins). See Frame.CONT.
+    index = -1
 
     def __init__(self, code, nb_args, nb_locals, upval_descr,
                  const_w, w_module=None):
@@ -39,9 +301,18 @@ class W_Proto(W_Root):
         self.nb_args = nb_args
         check_nonneg(nb_locals)
         self.nb_locals = nb_locals
+        if nb_args > nb_locals:
+            raise BytecodeError('%d arguments but only %d locals' %
+                                (nb_args, nb_locals))
+        # For each upval, the stack slot BUILDCONT takes it from.
         self.upval_descr = upval_descr
         self.const_w = const_w
         self.w_module = w_module
+        # Locals and temporaries: what the Frame must make room for.
+        self.stacksize = max_stackdepth(code, nb_locals, self.nb_upvals())
+        # What the interpreter actually runs.
+        self.insns = decode(code)
+        self.callcaches = make_callcaches(self.insns)
 
     def nb_upvals(self):
         if self.upval_descr:
@@ -64,3 +335,17 @@ class W_Cont(W_Root):
         return '#<continuation %s>' % self.w_proto.name
 
 
+class W_StackCont(W_Root):
+    """ Stands for the continuation at depth in the control stack of the
+        frame that pushed it, see Frame.PUSHCONT. Once the stack is moved
+        to the heap, w_cont is what the entry became.
+    """
+    def __init__(self, depth):
+        self.depth = depth
+        self.w_cont = None
+
+    def to_string(self):
+        if self.w_cont is not None:
+            return self.w_cont.to_string()
+        return '#<continuation on stack %d>' % self.depth
+
@@ -1,23 +1,30 @@
 from pypy.rlib.unroll import unrolling_iterable
 from pypy.rlib.jit import hint, unroll_safe
+from pypy.rlib.objectmodel import we_are_translated
 from rasm.error import OperationError
-from rasm.rt.code import codemap, argwidth
+from rasm.rt.code import codemap, codenames
 from rasm.rt.opimpl import Frame, HaltContinuation, DEBUG
 from rasm.rt.jit import driver, get_location
+from rasm.lang.port import flush_all
 
 unrolled_handlers = unrolling_iterable([(i, getattr(Frame, name))
                                         for (name, i) in codemap.iteritems()])
 
+# Untranslated, indexing a table beats trying every opcode in turn.
+handler_table = [getattr(Frame, name) for name in codenames]
+
 class __extend__(Frame):
     @unroll_safe
-    def dispatch(self, code):
-        opcode = self.nextbyte(code)
-        if argwidth(opcode) == 2:
-            oparg = self.nextshort(code)
-        elif argwidth(opcode) == 1:
-            oparg = self.nextbyte(code)
-        else:
-            oparg = 0
+    def dispatch(self, insns):
+        """ Run the instruction at self.pc of the decoded stream. """
+        pc = self.pc
+        assert pc >= 0
+        opcode = insns[pc]
+        oparg = insns[pc + 1]
+        self.pc = pc + 2
+        if not we_are_translated():
+            handler_table[opcode](self, oparg)
+            return
         for someop, somemethod in unrolled_handlers:
             if someop == opcode:
                 somemethod(self, oparg)
@@ -39,13 +46,15 @@ class __extend__(Frame):
                 if DEBUG:
                     print get_location(self.pc, self.w_proto)
 
-                self.dispatch(self.w_proto.code)
+                self.dispatch(self.w_proto.insns)
 
                 if DEBUG:
                     self.print_stack()
         except HaltContinuation as ret:
+            flush_all()
             return ret.w_retval
         except OperationError as err:
+            flush_all()
             print err.unwrap().to_string()
             self.print_stack()
 
@@ -0,0 +1,53 @@
+""" image.py
+
+    The prelude image: the toplevel environment with stdlib.scm already
+    compiled and run on top of the primitives from prelude.py.
+
+    The image is built when this module is imported, that is, at
+    translation time for the translated interpreter, so starting up needs
+    no parsing, CPS conversion or code generation. Closures in the image
+    refer to their children by proto index, so programs are compiled with
+    the image's proto table as the head of their own (see compile_all).
+"""
+from pypy.rlib.rmd5 import RMD5
+from rasm.util import localpath
+from rasm.compiler.parser import parse_string
+from rasm.compiler.astbuilder import Builder
+from rasm.compiler.cps import Rewriter
+from rasm.compiler.codegen import compile_all
+from rasm.rt.prelude import get_primitive_env
+from rasm.rt.execution import Frame
+
+class PreludeImage(object):
+    _immutable_fields_ = ['w_module', 'proto_w[*]', 'hash']
+
+    def __init__(self, w_module, proto_w, hash):
+        self.w_module = w_module
+        self.proto_w = proto_w
+        self.hash = hash
+
+    def new_env(self):
+        return self.w_module.copy()
+
+def run_stdlib(source, w_module):
+    """ Compile and run the stdlib in w_module. Returns the proto table. """
+    nodelist = Builder(parse_string(source)).getast()
+    cpsform = Rewriter(nodelist, toplevel=True).run()
+    w_maincont, proto_w = compile_all(cpsform, w_module)
+    if Frame(w_maincont, proto_w).run() is None:
+        raise RuntimeError('failed to build the prelude image')
+    return proto_w
+
+def build_image(source):
+    w_module = get_primitive_env()
+    proto_w = run_stdlib(source, w_module)
+    return PreludeImage(w_module, proto_w, RMD5(source).digest())
+
+def load_stdlib_source():
+    with open(localpath(__file__, 'stdlib.scm')) as f:
+        return f.read()
+
+prelude_image = build_image(load_stdlib_source())
+
+def get_report_env():
+    return prelude_image.new_env()
@@ -1,8 +1,8 @@
 from pypy.rlib.jit import JitDriver
-from rasm.compiler.codeviewer import dis_at_position
+from rasm.compiler.codeviewer import dis_insn
 
 def get_location(pc, w_proto):
-    return dis_at_position(pc, w_proto.code)
+    return dis_insn(pc, w_proto.insns)
 
 driver = JitDriver(greens=['pc', 'w_proto'],
                    reds=['frame'],
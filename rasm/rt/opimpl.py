@@ -1,11 +1,24 @@
-from pypy.rlib.jit import hint, unroll_safe, elidable, dont_look_inside
+import math
+from pypy.rlib.jit import (hint, unroll_safe, elidable, dont_look_inside,
+                           we_are_jitted)
 from rasm.rt.frame import Frame, W_ExecutionError
-from rasm.rt.code import codemap, W_Cont
-from rasm.rt.prelude import reify_callcc
+from rasm.rt.code import (codemap, W_Proto, W_Cont, W_StackCont,
+                          callcache_stats)
+from rasm.rt.prelude import reify_callcc, builtin_stacksize, vector_map_ops
+from rasm.rt.jit import driver
 from rasm.lang.env import ModuleCell, unwrap_cell
-from rasm.lang.model import (W_Root, W_Int, W_Pair,
-                             w_nil, w_true, w_false, w_unspec,
+from rasm.lang.arith import (add_int, sub_int, add_w, sub_w, mul_w,
+                             div_w, lt_w)
+from rasm.lang.model import (W_Root, W_Int, W_BigInt, W_Float, W_Pair,
+                             W_String, W_Char,
+                             w_nil, w_true, w_false, w_unspec, w_eof,
                              W_Error, W_TypeError, W_ValueError, W_NameError)
+from rasm.lang.vector import (W_Vector, make_vector, vector_sum,
+                              vector_dot, vector_map, vector_fill,
+                              vector_copy)
+from rasm.lang.hashtable import W_HashTable
+from rasm.lang.port import (W_OutputPort, W_InputPort, stdout_port,
+                            stdin_port, open_output_file, open_input_file)
 
 DEBUG = False
 
@@ -14,121 +27,237 @@ class HaltContinuation(Exception):
         self.w_retval = w_retval
 
 class W_ArgError(W_Error):
-    def __init__(self, expected, got, w_cont):
+    def __init__(self, expected, got, w_proto):
         self.expected = expected
         self.got = got
-        self.w_cont = w_cont
+        self.w_proto = w_proto
 
     def to_string(self):
         return '<ArgError: expecting %d arguments, but got %d at %s>' % (
-                self.expected, self.got, self.w_cont.w_proto.name)
+                self.expected, self.got, self.w_proto.name)
 
 class __extend__(Frame):
     """ Extended Frame object that can interpret bytecode.
-        A typical stack consist of three parts:
-        [frame_locals] [upvals] [temporaries]
+        A typical stack consist of two parts:
+        [frame_locals] [temporaries]
         0 .. nb_locals - 1
-                       nb_locals .. nb_locals + len(upval) - 1
-                                nb_locals + len(upval) .. len(stack_w)
+                       nb_locals .. len(stack_w)
+        The upvals are not copied onto the stack: upval_w is the one of
+        the continuation being run, which is immutable, and GETUPVAL
+        reads it directly.
+        Slots from stacktop up are always empty.
+        The continuations that PUSHCONT makes are on the control stack,
+        contstack_w: the upvals of each, then its proto. stackconts[d]
+        is the W_StackCont that stands for the one at depth d.
     """
     _virtualizable2_ = [
         'stacktop',
         'pc',
         'w_proto',
+        'upval_w',
+        'nb_placed',
         'proto_w',
         'stack_w[*]',
     ]
     _immutable_fields_ = ['proto_w[*]']
 
-    # XXX: stacksize would largely affect the efficiency.
-    def __init__(self, w_cont, proto_w, stacksize=32):
+    def __init__(self, w_cont, proto_w, stacksize=0):
+        """ The stack is made just deep enough for w_cont, the protos in
+            proto_w and the builtins. stacksize is a lower bound.
+        """
         self = hint(self, promote=True,
                     access_directly=True,
                     fresh_virtualizable=True)
+        stacksize = max(stacksize, w_cont.w_proto.stacksize)
+        stacksize = max(stacksize, builtin_stacksize)
+        for w_proto in proto_w:
+            if w_proto.stacksize > stacksize:
+                stacksize = w_proto.stacksize
         self.stacktop = 0
         self.stack_w = [None] * stacksize
+        self.upval_w = None
+        self.nb_placed = 0
         self.proto_w = proto_w
-        self.apply_continuation(w_cont)
-
-    @unroll_safe
-    def apply_continuation(self, w_cont):
-        self.w_proto = w_cont.w_proto
-        old_stacktop = self.stacktop
-        self.stacktop = self.w_proto.nb_locals
+        self.contstack_w = []
+        self.contdepth = 0
+        self.stackconts = []
+        self.apply_continuation(w_cont.w_proto, w_cont.upval_w)
+
+    def apply_continuation(self, w_proto, upval_w):
+        """ The arguments must be in place and the slots above them
+            empty, see transfer().
+        """
+        self.w_proto = w_proto
+        self.upval_w = upval_w
+        self.stacktop = w_proto.nb_locals
         self.pc = 0
-        if w_cont.upval_w:
-            for w_upval in w_cont.upval_w:
-                self.push(w_upval)
-        # In case some old upvals/locals are left on the stack...
-        if self.stacktop < old_stacktop:
-            for i in xrange(self.stacktop, old_stacktop + 1):
-                self.stackclear(i)
-
-    def nextbyte(self, code):
-        pc = self.pc
-        assert pc >= 0
-        c = code[pc]
-        self.pc = pc + 1
-        return ord(c)
-
-    def nextshort(self, code):
-        b0 = self.nextbyte(code)
-        b1 = self.nextbyte(code)
-        return (b1 << 8) | b0
 
     def INT(self, ival):
         self.push(W_Int(ival))
 
-    @unroll_safe
     def BUILDCONT(self, index):
+        self.push(self.buildcont(index))
+
+    @unroll_safe
+    def buildcont(self, index):
         assert index >= 0
         w_proto = self.proto_w[index]
         upval_w = [None] * len(w_proto.upval_descr)
-        for i, descr in enumerate(w_proto.upval_descr):
-            w_val = self.stackref(ord(descr))
-            if isinstance(w_val, ModuleCell):
-                upval_w[i] = w_val
-            else:
-                upval_w[i] = ModuleCell(w_val)
-                self.stackset(ord(descr), upval_w[i]) # XXX mutable upval.
-        w_cont = W_Cont(w_proto, upval_w)
-        self.push(w_cont)
-
-    def BRANCHIF(self, offset):
+        for i, index in enumerate(w_proto.upval_descr):
+            upval_w[i] = self.capture(index)
+        return W_Cont(w_proto, upval_w)
+
+    def capture(self, index):
+        # Either a value, or the ModuleCell of an assigned variable.
+        # The descr numbers the upvals of this frame after its locals.
+        nb_locals = self.w_proto.nb_locals
+        if index < nb_locals:
+            return self.stackref(index)
+        return self.upval_w[index - nb_locals]
+
+    def PUSHCONT(self, index):
+        self.push(self.pushcont(index))
+
+    @unroll_safe
+    def pushcont(self, index):
+        """ Like buildcont(), but the continuation goes on the control
+            stack. Codegen made sure that it is called before the ones
+            below, see compiler/escape.py.
+        """
+        assert index >= 0
+        w_proto = self.proto_w[index]
+        for index in w_proto.upval_descr:
+            self.contstack_w.append(self.capture(index))
+        self.contstack_w.append(w_proto)
+        depth = self.contdepth
+        self.contdepth = depth + 1
+        if depth == len(self.stackconts):
+            self.stackconts.append(W_StackCont(depth))
+        return self.stackconts[depth]
+
+    def check_top(self, w_cont):
+        """ Raises unless w_cont is the top of the control stack. """
+        depth = w_cont.depth
+        if not (depth == self.contdepth - 1 and
+                self.stackconts[depth] is w_cont):
+            raise W_ExecutionError(
+                    '%s is not on top of the control stack' %
+                        w_cont.to_string(),
+                    'cont()').wrap()
+
+    @unroll_safe
+    def popcont(self, w_cont):
+        """ Takes the top of the control stack off, which must be
+            w_cont. Returns its proto and its upvals.
+        """
+        self.check_top(w_cont)
+        top = len(self.contstack_w) - 1
+        w_proto = self.contstack_w[top]
+        assert isinstance(w_proto, W_Proto)
+        upval_w, start = self.entry_upvals(w_proto, top)
+        del self.contstack_w[start:]
+        self.contdepth -= 1
+        return w_proto, upval_w
+
+    @unroll_safe
+    def entry_upvals(self, w_proto, top):
+        """ The upvals of the entry whose proto is at top in the control
+            stack, and where the entry starts.
+        """
+        nb_upvals = len(w_proto.upval_descr)
+        start = top - nb_upvals
+        assert start >= 0
+        upval_w = [None] * nb_upvals
+        for i in xrange(nb_upvals):
+            upval_w[i] = self.contstack_w[start + i]
+        return upval_w, start
+
+    @unroll_safe
+    def reify_stack(self):
+        """ Moves the control stack to the heap: each entry becomes a
+            W_Cont, which its W_StackCont stands for from now on. A
+            W_StackCont of an entry below may be among its upvals, which
+            is fine as it is forwarded as well.
+            The W_StackConts made from now on are new ones, so that an
+            old one is never mistaken for a new entry.
+        """
+        top = len(self.contstack_w) - 1
+        for depth in xrange(self.contdepth - 1, -1, -1):
+            w_proto = self.contstack_w[top]
+            assert isinstance(w_proto, W_Proto)
+            upval_w, start = self.entry_upvals(w_proto, top)
+            self.stackconts[depth].w_cont = W_Cont(w_proto, upval_w)
+            top = start - 1
+        self.UNWIND(0)
+
+    def UNWIND(self, _):
+        # A reified continuation is called: the continuations that are
+        # still on the control stack were made since the stack was moved
+        # to the heap, by the computation that the call leaves.
+        self.contstack_w = []
+        self.contdepth = 0
+        self.stackconts = []
+
+    def EXTENDED_ARG(self, _):
+        # code.decode() folds it into the next instruction's operand.
+        raise W_ExecutionError('EXTENDED_ARG in decoded code',
+                               'extended_arg()').wrap()
+
+    def BRANCHIF(self, target):
         if self.pop().to_bool():
-            self.pc += offset
+            self.pc = target
 
-    def BRANCHIFNOT(self, offset):
+    def BRANCHIFNOT(self, target):
         if not self.pop().to_bool():
-            self.pc += offset
+            self.pc = target
 
     def LOADCONST(self, index):
         assert index >= 0
         w_val = self.w_proto.const_w[index]
         self.push(w_val)
 
-    def GETGLOBAL(self, index):
+    def getglobal(self, index):
         w_key = self.w_proto.const_w[index]
         w_val = self.w_proto.w_module.getitem(w_key)
         if w_val is None:
             raise W_NameError(w_key).wrap()
-        self.push(w_val)
+        return w_val
+
+    def GETGLOBAL(self, index):
+        self.push(self.getglobal(index))
 
     def SETGLOBAL(self, index):
         w_key = self.w_proto.const_w[index]
         w_val = self.pop()
         self.w_proto.w_module.setitem(w_key, w_val)
 
-    def LOAD(self, index):
+    def getlocal(self, index):
         assert index >= 0
-        w_val = self.stackref(index)
+        w_val = unwrap_cell(self.stackref(index))
         if w_val is None:
             # This is essential... And will not result in
             # a big performance hit.
             raise W_ExecutionError(
                     'unbound local variable in %s' % self.w_proto.to_string(),
                     'load(%d)' % index).wrap()
-        self.push(unwrap_cell(w_val))
+        return w_val
+
+    def LOAD(self, index):
+        self.push(self.getlocal(index))
+
+    def SETARG(self, index):
+        self.setarg(index, self.pop())
+
+    def setarg(self, index, w_arg):
+        """ Puts an argument of the call that follows in place. Unlike
+            STORE, this replaces a ModuleCell: the locals are dead by
+            the time the callee runs. The arguments below the highest
+            one put so are either in place as well, or on the stack
+            from the first.
+        """
+        self.stackset(index, w_arg)
+        if index >= self.nb_placed:
+            self.nb_placed = index + 1
 
     def STORE(self, index):
         assert index >= 0
@@ -138,46 +267,200 @@ class __extend__(Frame):
         else:
             self.stackset(index, self.pop())
 
-    def GETUPVAL(self, index):
+    def BOX(self, index):
+        # The slot may still be empty: a local that is defined later.
         assert index >= 0
-        w_upval = self.stackref(index + self.w_proto.nb_locals)
-        assert isinstance(w_upval, ModuleCell)
-        self.push(w_upval.w_value)
+        self.stack_w[index] = ModuleCell(self.stackref(index))
+
+    def getupval(self, index):
+        assert index >= 0
+        w_val = unwrap_cell(self.upval_w[index])
+        if w_val is None:
+            raise W_ExecutionError(
+                    'unbound upval in %s' % self.w_proto.to_string(),
+                    'getupval(%d)' % index).wrap()
+        return w_val
+
+    def GETUPVAL(self, index):
+        self.push(self.getupval(index))
 
     def SETUPVAL(self, index):
         assert index >= 0
-        w_upval = self.stackref(index + self.w_proto.nb_locals)
+        w_upval = self.upval_w[index]
         assert isinstance(w_upval, ModuleCell)
         w_upval.w_value = self.pop()
 
-    @unroll_safe
     def CONT(self, _):
-        w_cont = self.pop()
+        self.enter(self.pop())
+
+    def enter(self, w_cont):
+        """ Calls w_cont with the temporaries as arguments. """
         if DEBUG:
             print 'enter cont %s' % w_cont.to_string()
-        if not isinstance(w_cont, W_Cont):
-            raise W_TypeError('Continuation', w_cont, 'cont()').wrap()
+        w_proto = self.cont_proto(w_cont)
 
-        nb_args = (self.stacktop - self.w_proto.nb_locals -
-                   self.w_proto.nb_upvals())
+        nb_args = max(self.stacktop - self.w_proto.nb_locals,
+                      self.nb_placed)
         # Argument count checking. (We currently don't consider complex
         # calling conventions like varargs...)
-        if nb_args != w_cont.w_proto.nb_args:
-            raise W_ArgError(w_cont.w_proto.nb_args, nb_args, w_cont).wrap()
+        if nb_args != w_proto.nb_args:
+            raise W_ArgError(w_proto.nb_args, nb_args, w_proto).wrap()
+        # Only protos that were around when the frame was made are sure
+        # to fit, e.g. a closure from another program may not.
+        if w_proto.stacksize > len(self.stack_w):
+            raise W_ExecutionError(
+                    'stack overflow: %s needs %d slots, the frame has %d' % (
+                        w_proto.to_string(), w_proto.stacksize,
+                        len(self.stack_w)),
+                    'cont()').wrap()
+
+        self.transfer(w_cont, nb_args)
+
+    def cont_proto(self, w_cont):
+        """ The proto of w_cont, which must be a continuation. """
+        if isinstance(w_cont, W_StackCont):
+            if w_cont.w_cont is None:
+                self.check_top(w_cont)
+                w_proto = self.contstack_w[-1]
+                assert isinstance(w_proto, W_Proto)
+                return w_proto
+            w_cont = w_cont.w_cont
+        if not isinstance(w_cont, W_Cont):
+            raise W_TypeError('Continuation', w_cont, 'cont()').wrap()
+        return w_cont.w_proto
 
-        # Move arguments to local variables.
-        offset = self.w_proto.nb_locals + self.w_proto.nb_upvals()
-        for i in xrange(nb_args):
+    def CALLKNOWN(self, index):
+        """ Codegen made sure that the closure is of proto_w[index] and
+            that the arguments are right, and the frame was made with
+            room for every proto in proto_w.
+        """
+        self.transfer(self.pop(), self.proto_w[index].nb_args)
+
+    @unroll_safe
+    def transfer(self, w_cont, nb_args):
+        """ w_cont is a W_Cont or a W_StackCont, which enter() has
+            checked unless codegen did.
+        """
+        if isinstance(w_cont, W_StackCont) and w_cont.w_cont is None:
+            w_proto, upval_w = self.popcont(w_cont)
+        else:
+            if isinstance(w_cont, W_StackCont):
+                w_cont = w_cont.w_cont
+            assert isinstance(w_cont, W_Cont)
+            w_proto = w_cont.w_proto
+            upval_w = w_cont.upval_w
+
+        # The temporaries are the first arguments, the others up to
+        # nb_placed were put in place by SETARG and co.
+        self.nb_placed = 0
+        offset = self.w_proto.nb_locals
+        for i in xrange(self.stacktop - offset):
             self.stackset(i, self.stackref(i + offset))
 
-        i = nb_args
-        while i < w_cont.w_proto.nb_locals:
+        # Only the slots below stacktop may still hold something: the
+        # old locals and temporaries past the arguments. Leaving them
+        # would keep them alive, and an unset local of the callee must
+        # read as unbound.
+        for i in xrange(nb_args, self.stacktop):
             self.stackclear(i)
-            i += 1
 
-        # Switch to this continuation (adjust/clear stack, push upvals,
-        # set w_proto, etc...)
-        self.apply_continuation(w_cont)
+        # Switch to this continuation (set w_proto, upval_w, etc...)
+        w_from = self.w_proto
+        self.apply_continuation(w_proto, upval_w)
+
+        # A lambda is numbered before the continuations nested in it, so
+        # a transfer to a proto that does not come later in the proto
+        # table is a backward jump: a self tail call, or a continuation
+        # going back to the entry of its enclosing lambda. That is where
+        # loops close.
+        if 0 <= w_proto.index <= w_from.index:
+            driver.can_enter_jit(pc=self.pc, w_proto=self.w_proto,
+                                 frame=self)
+
+    # Superinstructions: what the peephole pass fuses an instruction
+    # sequence into, same effect without the pushes and pops in between.
+
+    def LOADCONT(self, index):
+        self.enter(self.getlocal(index))
+
+    def GETUPVALCONT(self, index):
+        self.enter(self.getupval(index))
+
+    def GETGLOBALCONT(self, index):
+        if we_are_jitted():
+            # The trace has the lookup folded away already.
+            self.enter(self.getglobal(index))
+            return
+        w_cache = self.w_proto.callcaches[self.pc / 2 - 1]
+        w_module = self.w_proto.w_module
+        w_cont = w_cache.w_cont
+        # A new binding changes the module version, an assignment to an
+        # existing one changes what its cell unwraps to.
+        if (w_cache.version is w_module.version and
+                unwrap_cell(w_cache.w_binding) is w_cont):
+            assert isinstance(w_cont, W_Cont)
+            if w_cont.w_proto.stacksize <= len(self.stack_w):
+                callcache_stats.hits += 1
+                self.transfer(w_cont, w_cont.w_proto.nb_args)
+                return
+        callcache_stats.misses += 1
+        w_key = self.w_proto.const_w[index]
+        w_binding = w_module.rawgetitem(w_key)
+        w_val = unwrap_cell(w_binding)
+        if w_val is None:
+            raise W_NameError(w_key).wrap()
+        # enter() raises unless the type and the arity are right.
+        version = w_module.version
+        self.enter(w_val)
+        assert isinstance(w_val, W_Cont)
+        w_cache.version = version
+        w_cache.w_binding = w_binding
+        w_cache.w_cont = w_val
+
+    def LOADCALLKNOWN(self, operands):
+        w_cont = self.getlocal(operands & 0xffff)
+        self.transfer(w_cont, self.proto_w[operands >> 16].nb_args)
+
+    def GETUPVALCALLKNOWN(self, operands):
+        w_cont = self.getupval(operands & 0xffff)
+        self.transfer(w_cont, self.proto_w[operands >> 16].nb_args)
+
+    def LOADARG(self, indices):
+        self.setarg(indices >> 8, self.getlocal(indices & 0xff))
+
+    def GETUPVALARG(self, indices):
+        self.setarg(indices >> 8, self.getupval(indices & 0xff))
+
+    def BUILDCONTARG(self, operands):
+        self.setarg(operands >> 16, self.buildcont(operands & 0xffff))
+
+    def PUSHCONTARG(self, operands):
+        self.setarg(operands >> 16, self.pushcont(operands & 0xffff))
+
+    def LOAD2_IADD(self, indices):
+        w_x = self.getlocal(indices & 0xff)
+        w_y = self.getlocal(indices >> 8)
+        self.push(add_w(w_x, w_y))
+
+    def IADDI(self, ival):
+        w_x = self.peek()
+        if isinstance(w_x, W_Int):
+            self.settop(add_int(w_x.ival, ival))
+        else:
+            self.settop(add_w(w_x, W_Int(ival)))
+
+    def ISUBI(self, ival):
+        w_x = self.peek()
+        if isinstance(w_x, W_Int):
+            self.settop(sub_int(w_x.ival, ival))
+        else:
+            self.settop(sub_w(w_x, W_Int(ival)))
+
+    def BRANCHIFNOTLT(self, target):
+        w_y = self.pop()
+        w_x = self.pop()
+        if not lt_w(w_x, w_y):
+            self.pc = target
 
     def HALT(self, _):
         raise HaltContinuation(self.pop())
@@ -209,25 +492,66 @@ class __extend__(Frame):
     def IADD(self, _):
         w_y = self.pop()
         w_x = self.peek()
-        self.settop(W_Int(w_x.to_int() + w_y.to_int()))
+        self.settop(add_w(w_x, w_y))
 
     def ISUB(self, _):
         w_y = self.pop()
         w_x = self.peek()
-        self.settop(W_Int(w_x.to_int() - w_y.to_int()))
+        self.settop(sub_w(w_x, w_y))
 
     def IMUL(self, _):
         w_y = self.pop()
         w_x = self.peek()
-        self.settop(W_Int(w_x.to_int() * w_y.to_int()))
+        self.settop(mul_w(w_x, w_y))
 
     def IDIV(self, _):
         w_y = self.pop()
         w_x = self.peek()
-        y = w_y.to_int()
-        if y == 0:
-            raise W_ValueError('divide by zero', w_x, 'idiv()').wrap()
-        self.settop(W_Int(w_x.to_int() * y))
+        self.settop(div_w(w_x, w_y))
+
+    def pop_float(self, where):
+        w_x = self.pop()
+        if not isinstance(w_x, W_Float):
+            raise W_TypeError('Float', w_x, where).wrap()
+        return w_x.floatval
+
+    def FADD(self, _):
+        y = self.pop_float('fadd()')
+        x = self.pop_float('fadd()')
+        self.push(W_Float(x + y))
+
+    def FSUB(self, _):
+        y = self.pop_float('fsub()')
+        x = self.pop_float('fsub()')
+        self.push(W_Float(x - y))
+
+    def FMUL(self, _):
+        y = self.pop_float('fmul()')
+        x = self.pop_float('fmul()')
+        self.push(W_Float(x * y))
+
+    def FDIV(self, _):
+        y = self.pop_float('fdiv()')
+        x = self.pop_float('fdiv()')
+        if y == 0.0:
+            raise W_ValueError('divide by zero', W_Float(x), 'fdiv()').wrap()
+        self.push(W_Float(x / y))
+
+    def FLT(self, _):
+        y = self.pop_float('flt()')
+        x = self.pop_float('flt()')
+        self.push(w_true if x < y else w_false)
+
+    def FSQRT(self, _):
+        x = self.pop_float('fsqrt()')
+        if x < 0.0:
+            raise W_ValueError('negative', W_Float(x), 'fsqrt()').wrap()
+        self.push(W_Float(math.sqrt(x)))
+
+    def TOFLOAT(self, _):
+        w_x = self.peek()
+        if not isinstance(w_x, W_Float):
+            self.settop(W_Float(w_x.to_float()))
 
     def IS(self, _):
         w_x = self.pop()
@@ -240,9 +564,9 @@ class __extend__(Frame):
         self.settop(w_x.equal_w(w_y))
 
     def LT(self, _):
-        y = self.pop().to_int()
-        x = self.peek().to_int()
-        self.settop(w_true if x < y else w_false)
+        w_y = self.pop()
+        w_x = self.peek()
+        self.settop(w_true if lt_w(w_x, w_y) else w_false)
 
     def NULLP(self, _):
         self.settop(self.peek().is_w(w_nil))
@@ -251,7 +575,17 @@ class __extend__(Frame):
         self.settop(w_true if isinstance(self.peek(), W_Pair) else w_false)
 
     def INTEGERP(self, _):
-        self.settop(w_true if isinstance(self.peek(), W_Int) else w_false)
+        w_x = self.peek()
+        if isinstance(w_x, W_Int) or isinstance(w_x, W_BigInt):
+            self.settop(w_true)
+        else:
+            self.settop(w_false)
+
+    def VECTORP(self, _):
+        if isinstance(self.peek(), W_Vector):
+            self.settop(w_true)
+        else:
+            self.settop(w_false)
 
     def NOT(self, _):
         x = self.peek().to_bool()
@@ -268,11 +602,80 @@ class __extend__(Frame):
         self.settop(w_true if x and y else w_false)
 
     def PRINT(self, _):
-        w_x = self.pop()
-        print w_x.to_string(),
+        stdout_port.display(self.pop())
 
     def NEWLINE(self, _):
-        print
+        stdout_port.write('\n')
+
+    def pop_port(self, where):
+        w_port = self.pop()
+        if not isinstance(w_port, W_OutputPort):
+            raise W_TypeError('OutputPort', w_port, where).wrap()
+        return w_port
+
+    def CURRENTOUTPUTPORT(self, _):
+        self.push(stdout_port)
+
+    def OPENOUTPUTFILE(self, _):
+        w_path = self.peek()
+        if not isinstance(w_path, W_String):
+            raise W_TypeError('String', w_path, 'open_output_file()').wrap()
+        self.settop(open_output_file(w_path.sval))
+
+    def CLOSEOUTPUTPORT(self, _):
+        self.pop_port('close_output_port()').close()
+        self.push(w_unspec)
+
+    def FLUSHOUTPUT(self, _):
+        self.pop_port('flush_output()').flush()
+        self.push(w_unspec)
+
+    def DISPLAY(self, _):
+        w_port = self.pop_port('display()')
+        w_port.display(self.pop())
+        self.push(w_unspec)
+
+    def WRITESTRING(self, _):
+        w_port = self.pop_port('write_string()')
+        w_string = self.pop()
+        if not isinstance(w_string, W_String):
+            raise W_TypeError('String', w_string, 'write_string()').wrap()
+        w_port.write(w_string.sval)
+        self.push(w_unspec)
+
+    def WRITECHAR(self, _):
+        w_port = self.pop_port('write_char()')
+        w_char = self.pop()
+        if not isinstance(w_char, W_Char):
+            raise W_TypeError('Char', w_char, 'write_char()').wrap()
+        w_port.write(w_char.chval)
+        self.push(w_unspec)
+
+    def WRITENEWLINE(self, _):
+        self.pop_port('newline()').write('\n')
+        self.push(w_unspec)
+
+    def pop_input_port(self, where):
+        w_port = self.pop()
+        if not isinstance(w_port, W_InputPort):
+            raise W_TypeError('InputPort', w_port, where).wrap()
+        return w_port
+
+    def CURRENTINPUTPORT(self, _):
+        self.push(stdin_port)
+
+    def OPENINPUTFILE(self, _):
+        w_path = self.peek()
+        if not isinstance(w_path, W_String):
+            raise W_TypeError('String', w_path, 'open_input_file()').wrap()
+        self.settop(open_input_file(w_path.sval))
+
+    def CLOSEINPUTPORT(self, _):
+        self.pop_input_port('close_input_port()').close()
+        self.push(w_unspec)
+
+    def EOFP(self, _):
+        self.settop(w_true if self.peek() is w_eof else w_false)
 
     def CAR(self, _):
         w_pair = self.peek()
@@ -297,13 +700,128 @@ class __extend__(Frame):
         w_pair = self.pop()
         w_pair.set_cdr(w_cdr)
 
+    def pop_vector(self, where):
+        w_vector = self.pop()
+        if not isinstance(w_vector, W_Vector):
+            raise W_TypeError('Vector', w_vector, where).wrap()
+        return w_vector
+
+    def MAKEVECTOR(self, _):
+        w_fill = self.pop()
+        size = self.pop().to_int()
+        self.push(make_vector(size, w_fill))
+
+    def VECTORREF(self, _):
+        index = self.pop().to_int()
+        w_vector = self.pop_vector('vector_ref()')
+        w_vector.check_index(index, 'vector_ref()')
+        self.push(w_vector.getitem(index))
+
+    def VECTORSET(self, _):
+        w_x = self.pop()
+        index = self.pop().to_int()
+        w_vector = self.pop_vector('vector_set()')
+        w_vector.check_index(index, 'vector_set()')
+        w_vector.setitem(index, w_x)
+        self.push(w_unspec)
+
+    def VECTORLENGTH(self, _):
+        w_vector = self.pop_vector('vector_length()')
+        self.push(W_Int(w_vector.length()))
+
+    def VECTORSUM(self, _):
+        w_vector = self.pop_vector('vector_sum()')
+        self.push(vector_sum(w_vector))
+
+    def VECTORDOT(self, _):
+        w_y = self.pop_vector('vector_dot()')
+        w_x = self.pop_vector('vector_dot()')
+        self.push(vector_dot(w_x, w_y))
+
+    def VECTORMAP(self, _):
+        w_src = self.pop_vector('vector_map()')
+        w_dst = self.pop_vector('vector_map()')
+        w_op = self.pop()
+        op = -1
+        if isinstance(w_op, W_Cont):
+            op = vector_map_ops.get(w_op.w_proto, -1)
+        if op == -1:
+            raise W_TypeError('+, - or *', w_op, 'vector_map()').wrap()
+        vector_map(op, w_dst, w_src)
+        self.push(w_unspec)
+
+    def VECTORFILL(self, _):
+        w_fill = self.pop()
+        w_vector = self.pop_vector('vector_fill()')
+        vector_fill(w_vector, w_fill)
+        self.push(w_unspec)
+
+    def VECTORCOPY(self, _):
+        w_src = self.pop_vector('vector_copy()')
+        at = self.pop().to_int()
+        w_dst = self.pop_vector('vector_copy()')
+        vector_copy(w_dst, at, w_src)
+        self.push(w_unspec)
+
+    def pop_hashtable(self, where):
+        w_table = self.pop()
+        if not isinstance(w_table, W_HashTable):
+            raise W_TypeError('HashTable', w_table, where).wrap()
+        return w_table
+
+    def MAKEEQHASHTABLE(self, _):
+        self.push(W_HashTable(False))
+
+    def MAKEEQUALHASHTABLE(self, _):
+        self.push(W_HashTable(True))
+
+    def HASHTABLEREF(self, _):
+        w_default = self.pop()
+        w_key = self.pop()
+        w_table = self.pop_hashtable('hashtable_ref()')
+        self.push(w_table.get(w_key, w_default))
+
+    def HASHTABLESET(self, _):
+        w_value = self.pop()
+        w_key = self.pop()
+        w_table = self.pop_hashtable('hashtable_set()')
+        w_table.set(w_key, w_value)
+        self.push(w_unspec)
+
+    def HASHTABLEDELETE(self, _):
+        w_key = self.pop()
+        w_table = self.pop_hashtable('hashtable_delete()')
+        w_table.delete(w_key)
+        self.push(w_unspec)
+
+    def HASHTABLECONTAINS(self, _):
+        w_key = self.pop()
+        w_table = self.pop_hashtable('hashtable_contains()')
+        self.push(w_true if w_table.contains(w_key) else w_false)
+
+    def HASHTABLECOUNT(self, _):
+        w_table = self.pop_hashtable('hashtable_count()')
+        self.push(W_Int(w_table.count))
+
+    def HASHTABLEKEYS(self, _):
+        w_table = self.pop_hashtable('hashtable_keys()')
+        self.push(w_table.keys())
+
+    def HASHTABLEVALUES(self, _):
+        w_table = self.pop_hashtable('hashtable_values()')
+        self.push(w_table.values())
+
     def REIFYCC(self, _):
+        # The continuation may be on the control stack, or a closure
+        # with some on it among its upvals.
+        self.reify_stack()
         w_cont = self.peek()
+        if isinstance(w_cont, W_StackCont) and w_cont.w_cont is not None:
+            w_cont = w_cont.w_cont
         self.settop(reify_callcc(w_cont))
 
     def READ(self, _):
-        from rasm.rt.prelude import read_stdin
-        self.push(read_stdin()[0]) # with values?
+        self.push(self.pop_input_port('read()').read())
 
 def patching_ophandlers():
     def noimpl(self, _):
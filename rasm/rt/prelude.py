@@ -1,9 +1,9 @@
-from pypy.rlib.jit import dont_look_inside
 from rasm.rt.code import W_Proto, W_Cont, Op
-from rasm.lang.env import ModuleDict, ModuleCell
-from rasm.lang.model import symbol, w_eof, w_nil
+from rasm.lang.env import ModuleDict
+from rasm.lang.model import symbol, w_nil
+from rasm.lang.vector import OP_ADD, OP_SUB, OP_MUL
 
-def get_report_env():
+def get_primitive_env():
     w_module = ModuleDict()
     for w_name, w_cont in prelude_impl.iteritems():
         w_module.setitem(w_name, w_cont)
@@ -14,11 +14,11 @@ prelude_impl = {}
 def regimpl(w_cont):
     prelude_impl[symbol(w_cont.w_proto.name)] = w_cont
 
-def buildproto(name, nb_args, raw_code, nb_locals=-1):
+def buildproto(name, nb_args, raw_code, nb_locals=-1, upval_descr=None):
     if nb_locals == -1:
         nb_locals = nb_args
     code = ''.join(map(chr, raw_code))
-    w_proto = W_Proto(code, nb_args, nb_locals, upval_descr=None,
+    w_proto = W_Proto(code, nb_args, nb_locals, upval_descr=upval_descr,
                       const_w=None, w_module=None)
     w_proto.name = name
     return w_proto
@@ -63,6 +63,22 @@ def populate_library():
                                Op.LOAD, 2,
                                Op.CONT]))
 
+    for name, opcode in [('fl+', Op.FADD), ('fl-', Op.FSUB),
+                         ('fl*', Op.FMUL), ('fl/', Op.FDIV),
+                         ('fl<', Op.FLT)]:
+        regimpl(buildcont(name, 3, [Op.LOAD, 0,
+                                    Op.LOAD, 1,
+                                    opcode,
+                                    Op.LOAD, 2,
+                                    Op.CONT]))
+
+    for name, opcode in [('flsqrt', Op.FSQRT),
+                         ('exact->inexact', Op.TOFLOAT)]:
+        regimpl(buildcont(name, 2, [Op.LOAD, 0,
+                                    opcode,
+                                    Op.LOAD, 1,
+                                    Op.CONT]))
+
     regimpl(buildcont('null?', 2, [Op.LOAD, 0,
                                    Op.NULLP,
                                    Op.LOAD, 1,
@@ -94,17 +110,138 @@ def populate_library():
                                  Op.LOAD, 1,
                                  Op.CONT]))
 
+    regimpl(buildcont('make-vector', 3, [Op.LOAD, 0,
+                                         Op.LOAD, 1,
+                                         Op.MAKEVECTOR,
+                                         Op.LOAD, 2,
+                                         Op.CONT]))
+
+    regimpl(buildcont('vector-ref', 3, [Op.LOAD, 0,
+                                        Op.LOAD, 1,
+                                        Op.VECTORREF,
+                                        Op.LOAD, 2,
+                                        Op.CONT]))
+
+    regimpl(buildcont('vector-set!', 4, [Op.LOAD, 0,
+                                         Op.LOAD, 1,
+                                         Op.LOAD, 2,
+                                         Op.VECTORSET,
+                                         Op.LOAD, 3,
+                                         Op.CONT]))
+
+    regimpl(buildcont('vector-length', 2, [Op.LOAD, 0,
+                                           Op.VECTORLENGTH,
+                                           Op.LOAD, 1,
+                                           Op.CONT]))
+
+    regimpl(buildcont('vector?', 2, [Op.LOAD, 0,
+                                     Op.VECTORP,
+                                     Op.LOAD, 1,
+                                     Op.CONT]))
+
+    regimpl(buildcont('vector-sum', 2, [Op.LOAD, 0,
+                                        Op.VECTORSUM,
+                                        Op.LOAD, 1,
+                                        Op.CONT]))
+
+    regimpl(buildcont('vector-dot', 3, [Op.LOAD, 0,
+                                        Op.LOAD, 1,
+                                        Op.VECTORDOT,
+                                        Op.LOAD, 2,
+                                        Op.CONT]))
+
+    regimpl(buildcont('vector-map!', 4, [Op.LOAD, 0,
+                                         Op.LOAD, 1,
+                                         Op.LOAD, 2,
+                                         Op.VECTORMAP,
+                                         Op.LOAD, 3,
+                                         Op.CONT]))
+
+    regimpl(buildcont('vector-fill!', 3, [Op.LOAD, 0,
+                                          Op.LOAD, 1,
+                                          Op.VECTORFILL,
+                                          Op.LOAD, 2,
+                                          Op.CONT]))
+
+    regimpl(buildcont('vector-copy!', 4, [Op.LOAD, 0,
+                                          Op.LOAD, 1,
+                                          Op.LOAD, 2,
+                                          Op.VECTORCOPY,
+                                          Op.LOAD, 3,
+                                          Op.CONT]))
+
+    for name, opcode in [('make-eq-hashtable', Op.MAKEEQHASHTABLE),
+                         ('make-equal-hashtable', Op.MAKEEQUALHASHTABLE)]:
+        regimpl(buildcont(name, 1, [opcode,
+                                    Op.LOAD, 0,
+                                    Op.CONT]))
+
+    for name, opcode in [('hashtable-ref', Op.HASHTABLEREF),
+                         ('hashtable-set!', Op.HASHTABLESET)]:
+        regimpl(buildcont(name, 4, [Op.LOAD, 0,
+                                    Op.LOAD, 1,
+                                    Op.LOAD, 2,
+                                    opcode,
+                                    Op.LOAD, 3,
+                                    Op.CONT]))
+
+    for name, opcode in [('hashtable-delete!', Op.HASHTABLEDELETE),
+                         ('hashtable-contains?', Op.HASHTABLECONTAINS)]:
+        regimpl(buildcont(name, 3, [Op.LOAD, 0,
+                                    Op.LOAD, 1,
+                                    opcode,
+                                    Op.LOAD, 2,
+                                    Op.CONT]))
+
+    for name, opcode in [('hashtable-count', Op.HASHTABLECOUNT),
+                         ('hashtable-keys', Op.HASHTABLEKEYS),
+                         ('hashtable-values', Op.HASHTABLEVALUES)]:
+        regimpl(buildcont(name, 2, [Op.LOAD, 0,
+                                    opcode,
+                                    Op.LOAD, 1,
+                                    Op.CONT]))
+
+    # Called rather than inlined, these write to the current output
+    # port: a port argument is only taken where they are inlined.
     regimpl(buildcont('display', 2, [Op.LOAD, 0,
-                                     Op.PRINT,
-                                     Op.UNSPEC,
+                                     Op.CURRENTOUTPUTPORT,
+                                     Op.DISPLAY,
                                      Op.LOAD, 1,
                                      Op.CONT]))
 
-    regimpl(buildcont('newline', 1, [Op.NEWLINE,
-                                     Op.UNSPEC,
+    regimpl(buildcont('write-string', 2, [Op.LOAD, 0,
+                                          Op.CURRENTOUTPUTPORT,
+                                          Op.WRITESTRING,
+                                          Op.LOAD, 1,
+                                          Op.CONT]))
+
+    regimpl(buildcont('write-char', 2, [Op.LOAD, 0,
+                                        Op.CURRENTOUTPUTPORT,
+                                        Op.WRITECHAR,
+                                        Op.LOAD, 1,
+                                        Op.CONT]))
+
+    regimpl(buildcont('newline', 1, [Op.CURRENTOUTPUTPORT,
+                                     Op.WRITENEWLINE,
                                      Op.LOAD, 0,
                                      Op.CONT]))
 
+    regimpl(buildcont('flush-output', 1, [Op.CURRENTOUTPUTPORT,
+                                          Op.FLUSHOUTPUT,
+                                          Op.LOAD, 0,
+                                          Op.CONT]))
+
+    regimpl(buildcont('current-output-port', 1, [Op.CURRENTOUTPUTPORT,
+                                                 Op.LOAD, 0,
+                                                 Op.CONT]))
+
+    for name, opcode in [('open-output-file', Op.OPENOUTPUTFILE),
+                         ('close-output-port', Op.CLOSEOUTPUTPORT)]:
+        regimpl(buildcont(name, 2, [Op.LOAD, 0,
+                                    opcode,
+                                    Op.LOAD, 1,
+                                    Op.CONT]))
+
     '''
     (call/cc
       (lambda (k)
@@ -129,10 +266,23 @@ def populate_library():
                                      Op.LOAD, 0, # [cc, cont, func]
                                      Op.CONT]))
 
-    regimpl(buildcont('read', 1, [Op.READ,
+    regimpl(buildcont('read', 1, [Op.CURRENTINPUTPORT,
+                                  Op.READ,
                                   Op.LOAD, 0,
                                   Op.CONT]))
 
+    regimpl(buildcont('current-input-port', 1, [Op.CURRENTINPUTPORT,
+                                                Op.LOAD, 0,
+                                                Op.CONT]))
+
+    for name, opcode in [('open-input-file', Op.OPENINPUTFILE),
+                         ('close-input-port', Op.CLOSEINPUTPORT),
+                         ('eof-object?', Op.EOFP)]:
+        regimpl(buildcont(name, 2, [Op.LOAD, 0,
+                                    opcode,
+                                    Op.LOAD, 1,
+                                    Op.CONT]))
+
     # XXX not finished yet.
     regimpl(buildcont('eval', 3, [Op.LOAD, 0, # [expr]
                                   Op.LOAD, 1, # [expr, w_module]
@@ -142,26 +292,22 @@ def populate_library():
 
     regimpl(buildcont('halt', 1, [Op.HALT]))
 
-callcc_proto = buildproto('reified-continuation', 2, [Op.LOAD, 0,
+# The builtins that vector-map! applies without calling them.
+vector_map_ops = {}
+for name, op in [('+', OP_ADD), ('-', OP_SUB), ('*', OP_MUL)]:
+    vector_map_ops[prelude_impl[symbol(name)].w_proto] = op
+
+callcc_proto = buildproto('reified-continuation', 2, [Op.UNWIND,
+                                                      Op.LOAD, 0,
                                                       Op.GETUPVAL, 0,
-                                                      Op.CONT])
-callcc_proto.upval_descr = ['\0'] # dummy
+                                                      Op.CONT],
+                          upval_descr=[0]) # dummy
 
-def reify_callcc(w_cont):
-    return W_Cont(callcc_proto, [ModuleCell(w_cont)])
-
-@dont_look_inside
-def read_stdin():
-    from rasm.ffi.libreadline import getline
-    from rasm.compiler.parser import parse_string, BacktrackException
-    try:
-        line = getline('> ')
-    except EOFError:
-        return [w_eof]
-    try:
-        exprs_w = parse_string(line)
-    except BacktrackException as e:
-        print e.error.nice_error_message('<stdin>', line)
-        return [w_eof]
-    return exprs_w
+# The deepest stack any builtin needs. Frames make room for it since
+# builtins are not in the proto table.
+builtin_stacksize = max([w_cont.w_proto.stacksize
+                         for w_cont in prelude_impl.itervalues()] +
+                        [callcc_proto.stacksize])
 
+def reify_callcc(w_cont):
+    return W_Cont(callcc_proto, [w_cont])
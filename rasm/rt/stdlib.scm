@@ -0,0 +1,93 @@
+;; stdlib.scm
+;;
+;; The Scheme-level part of the toplevel environment. It is compiled and run
+;; once, when the prelude image is built (see image.py).
+
+(define (not x) (if x #f #t))
+
+(define (> a b) (< b a))
+(define (<= a b) (if (< b a) #f #t))
+(define (>= a b) (if (< a b) #f #t))
+(define (= a b) (if (< a b) #f (if (< b a) #f #t)))
+
+(define (length lst)
+  (if (null? lst) 0
+      (+ 1 (length (cdr lst)))))
+
+(define (append a b)
+  (if (null? a) b
+      (cons (car a) (append (cdr a) b))))
+
+(define (append-reverse rev tail)
+  (if (null? rev) tail
+      (append-reverse (cdr rev) (cons (car rev) tail))))
+
+(define (reverse lst)
+  (append-reverse lst '()))
+
+(define (list-tail lst k)
+  (if (< k 1) lst
+      (list-tail (cdr lst) (- k 1))))
+
+(define (list-ref lst k)
+  (car (list-tail lst k)))
+
+(define (map f lst)
+  (if (null? lst) '()
+      (cons (f (car lst)) (map f (cdr lst)))))
+
+(define (for-each f lst)
+  (if (null? lst) #f
+      (begin
+        (f (car lst))
+        (for-each f (cdr lst)))))
+
+(define (memq x lst)
+  (if (null? lst) #f
+      (if (eq? x (car lst)) lst
+          (memq x (cdr lst)))))
+
+(define (member x lst)
+  (if (null? lst) #f
+      (if (equal? x (car lst)) lst
+          (member x (cdr lst)))))
+
+(define (assq x alist)
+  (if (null? alist) #f
+      (if (eq? x (car (car alist))) (car alist)
+          (assq x (cdr alist)))))
+
+(define (assoc x alist)
+  (if (null? alist) #f
+      (if (equal? x (car (car alist))) (car alist)
+          (assoc x (cdr alist)))))
+
+(define (vector-tail->list v i acc)
+  (if (< i 0) acc
+      (vector-tail->list v (- i 1) (cons (vector-ref v i) acc))))
+
+(define (vector->list v)
+  (vector-tail->list v (- (vector-length v) 1) '()))
+
+(define (vector-fill-list! v i lst)
+  (if (null? lst) v
+      (begin
+        (vector-set! v i (car lst))
+        (vector-fill-list! v (+ i 1) (cdr lst)))))
+
+;; Filled with the first item, so that a list of ints or of floats gets
+;; a vector of that strategy.
+(define (list->vector lst)
+  (vector-fill-list! (make-vector (length lst) (if (null? lst) 0 (car lst)))
+                     0 lst))
+
+(define (hashtable-walk-from table keys i proc)
+  (if (< i (vector-length keys))
+      (begin
+        (proc (vector-ref keys i) (hashtable-ref table (vector-ref keys i) #f))
+        (hashtable-walk-from table keys (+ i 1) proc))
+      #f))
+
+;; Calls (proc key value) for each entry, in insertion order.
+(define (hashtable-walk table proc)
+  (hashtable-walk-from table (hashtable-keys table) 0 proc))
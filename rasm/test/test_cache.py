@@ -0,0 +1,128 @@
+import os
+import tempfile
+from unittest import TestCase
+from rasm.compiler.parser import parse_string
+from rasm.compiler.astbuilder import Builder
+from rasm.compiler.cps import Rewriter
+from rasm.compiler.codegen import compile_all
+from rasm.compiler import cache
+from rasm.compiler.cache import (dump_program, load_program, source_hash,
+                                 file_hash, CacheError)
+from rasm.rt.image import prelude_image, get_report_env
+from rasm.rt.execution import Frame
+
+SOURCE = '''
+(define (sum n s)
+  (if (< n 1) s
+      (sum (- n 1) (+ s n))))
+(define big 1234567890123)
+(define huge 123456789012345678901234567890)
+(define ratio 0.1)
+(define data '(a (b . -2) #t #f ()))
+(define text '("hi there" #\!))
+(sum 10 0)
+'''
+
+def compile_source(source, w_module):
+    nodelist = Builder(parse_string(source)).getast()
+    cpsform = Rewriter(nodelist, toplevel=True).run()
+    return compile_all(cpsform, w_module, prelude_image.proto_w)
+
+class TestCache(TestCase):
+    def setUp(self):
+        self.srchash = source_hash(SOURCE)
+        w_maincont, proto_w = compile_source(SOURCE, get_report_env())
+        self.w_maincont = w_maincont
+        self.proto_w = proto_w
+        self.data = dump_program(w_maincont, proto_w, self.srchash,
+                                 prelude_image)
+
+    def test_roundtrip(self):
+        w_module = get_report_env()
+        w_maincont, proto_w = load_program(self.data, self.srchash, w_module,
+                                           prelude_image)
+        self.assertEquals(len(proto_w), len(self.proto_w))
+        nb_base = len(prelude_image.proto_w)
+        for i in xrange(nb_base):
+            self.assertIs(proto_w[i], prelude_image.proto_w[i])
+        for w_old, w_new in zip([self.w_maincont.w_proto] +
+                                self.proto_w[nb_base:],
+                                [w_maincont.w_proto] + proto_w[nb_base:]):
+            self.assertEquals(w_new.name, w_old.name)
+            self.assertEquals(w_new.code, w_old.code)
+            self.assertEquals(w_new.nb_args, w_old.nb_args)
+            self.assertEquals(w_new.nb_locals, w_old.nb_locals)
+            self.assertEquals(w_new.upval_descr, w_old.upval_descr)
+            self.assertEquals(w_new.index, w_old.index)
+            self.assertEquals([w_x.to_string() for w_x in w_new.const_w],
+                              [w_x.to_string() for w_x in w_old.const_w])
+            self.assertIs(w_new.w_module, w_module)
+        self.assertIs(w_maincont.w_proto.w_module, w_module)
+
+    def test_run_loaded(self):
+        w_module = get_report_env()
+        w_maincont, proto_w = load_program(self.data, self.srchash, w_module,
+                                           prelude_image)
+        Frame(w_maincont, proto_w).run()
+        from rasm.lang.model import symbol
+        self.assertEquals(w_module.getitem(symbol('big')).to_int(),
+                          1234567890123)
+        self.assertEquals(w_module.getitem(symbol('huge')).to_string(),
+                          '123456789012345678901234567890')
+        self.assertEquals(w_module.getitem(symbol('ratio')).to_string(),
+                          '0.1')
+        self.assertEquals(w_module.getitem(symbol('data')).to_string(),
+                          '(a (b . -2) #t #f ())')
+        self.assertEquals(w_module.getitem(symbol('text')).to_string(),
+                          '(hi there !)')
+
+    def test_nested_list(self):
+        # Deeper than the recursion limit.
+        depth = 5000
+        source = "(define data '%s)" % ('(' * depth + ')' * depth)
+        w_module = get_report_env()
+        w_maincont, proto_w = compile_source(source, w_module)
+        data = dump_program(w_maincont, proto_w, source_hash(source),
+                            prelude_image)
+        w_maincont, proto_w = load_program(data, source_hash(source),
+                                           w_module, prelude_image)
+        Frame(w_maincont, proto_w).run()
+        from rasm.lang.model import symbol, w_nil
+        w_data = w_module.getitem(symbol('data'))
+        for i in xrange(depth - 1):
+            self.assertIs(w_data.w_cdr, w_nil)
+            w_data = w_data.w_car
+        self.assertIs(w_data, w_nil)
+
+    def test_stale(self):
+        w_module = get_report_env()
+        self.assertRaises(CacheError, load_program, self.data,
+                          source_hash(SOURCE + ' '), w_module, prelude_image)
+        self.assertRaises(CacheError, load_program, self.data[:-1],
+                          self.srchash, w_module, prelude_image)
+        self.assertRaises(CacheError, load_program, 'junk',
+                          self.srchash, w_module, prelude_image)
+        # Compiled against an image, so it can't be loaded without one.
+        self.assertRaises(CacheError, load_program, self.data,
+                          self.srchash, w_module)
+
+    def test_compiler_changed(self):
+        w_module = get_report_env()
+        compilerhash = cache.compilerhash
+        cache.compilerhash = '\xff' * 16
+        try:
+            self.assertRaises(CacheError, load_program, self.data,
+                              self.srchash, w_module, prelude_image)
+        finally:
+            cache.compilerhash = compilerhash
+
+    def test_file_hash(self):
+        fd, path = tempfile.mkstemp()
+        try:
+            # Longer than a chunk, so it is hashed in several updates.
+            source = SOURCE * 1000
+            os.write(fd, source)
+            os.close(fd)
+            self.assertEquals(file_hash(path), source_hash(source))
+        finally:
+            os.remove(path)
@@ -0,0 +1,238 @@
+from unittest import TestCase
+from rasm.rt.code import Op, fetch
+from rasm.compiler.parser import parse_string
+from rasm.compiler.astbuilder import Builder
+from rasm.compiler.cps import Rewriter
+from rasm.compiler.codegen import compile_all
+from rasm.rt.image import prelude_image, get_report_env
+from rasm.rt.execution import Frame
+from rasm.error import OperationError
+
+def compile_source(source, place_args=True):
+    nodelist = Builder(parse_string(source)).getast()
+    cpsform = Rewriter(nodelist, toplevel=True).run()
+    return compile_all(cpsform, get_report_env(), prelude_image.proto_w,
+                       place_args=place_args)
+
+def run_source(source, place_args=True):
+    w_maincont, proto_w = compile_source(source, place_args)
+    return Frame(w_maincont, proto_w).run()
+
+def count_op(source, op):
+    w_maincont, proto_w = compile_source(source)
+    count = 0
+    for w_proto in [w_maincont.w_proto] + proto_w:
+        code = w_proto.code
+        pc = 0
+        while pc < len(code):
+            opcode, _, pc = fetch(code, pc)
+            if opcode == op:
+                count += 1
+    return count
+
+class TestBoxing(TestCase):
+    def test_immutable_capture_is_not_boxed(self):
+        source = '(define (make-adder n) (lambda (x) (+ x n)))'
+        self.assertEquals(count_op(source, Op.BOX), 0)
+        self.assertEquals(run_source(source + '((make-adder 3) 4)').to_int(),
+                          7)
+
+    def test_assigned_capture_is_boxed(self):
+        source = ('(define (make-counter)'
+                  '  (define a 0)'
+                  '  (lambda () (set! a (+ a 1)) a))')
+        self.assertEquals(count_op(source, Op.BOX), 1)
+
+    def test_assigned_uncaptured_is_not_boxed(self):
+        source = '(define (f a) (set! a (+ a 1)) (+ a 1))'
+        self.assertEquals(count_op(source, Op.BOX), 0)
+        self.assertEquals(run_source(source + '(f 1)').to_int(), 3)
+
+    def test_closures_share_cell(self):
+        w_ret = run_source('(define (make-pair a)'
+                           '  (cons (lambda () (set! a (+ a 1)) a)'
+                           '        (lambda () a)))'
+                           '(define p (make-pair 10))'
+                           '((car p))'
+                           '((car p))'
+                           '((cdr p))')
+        self.assertEquals(w_ret.to_int(), 12)
+
+    def test_assigned_in_continuation(self):
+        # x is set! after a call, from the call's continuation.
+        w_ret = run_source('(define (id x) x)'
+                           '(define (f x)'
+                           '  (define k (lambda () x))'
+                           '  (set! x (id 5))'
+                           '  (k))'
+                           '(f 1)')
+        self.assertEquals(w_ret.to_int(), 5)
+
+class TestProtoIndex(TestCase):
+    def test_index_is_table_position(self):
+        w_maincont, proto_w = compile_source(
+            '(define (loop i) (display i) (loop (+ i 1)))')
+        self.assertEquals(w_maincont.w_proto.index, -1)
+        for i in xrange(len(proto_w)):
+            self.assertEquals(proto_w[i].index, i)
+
+    def test_continuation_comes_after_its_lambda(self):
+        # So that the continuation's transfer back to loop is backward.
+        w_maincont, proto_w = compile_source(
+            '(define (loop i) (not i) (loop (+ i 1)))')
+        w_loop = proto_w[-2]
+        w_cont = proto_w[-1]
+        self.assertEquals(w_loop.name, 'loop')
+        self.assertEquals(w_cont.nb_args, 1)
+        self.assertTrue(w_cont.index > w_loop.index)
+
+class TestStackSize(TestCase):
+    def test_many_arguments(self):
+        formals = ' '.join(['a%d' % i for i in xrange(60)])
+        args = ' '.join([str(i) for i in xrange(60)])
+        w_ret = run_source('(define (f %s) (+ a0 a59)) (f %s)' % (formals,
+                                                                   args))
+        self.assertEquals(w_ret.to_int(), 59)
+
+class TestWideOperands(TestCase):
+    def test_many_constants(self):
+        source = ''.join(["(define g%d 'c%d)" % (i, i) for i in xrange(500)])
+        w_maincont, proto_w = compile_source(source + '(cons g0 g499)')
+        self.assertEquals(len(w_maincont.w_proto.const_w), 1001)
+        self.assertEquals(Frame(w_maincont, proto_w).run().to_string(),
+                          '(c0 . c499)')
+
+    def test_many_locals(self):
+        defines = ' '.join(['(define v%d %d)' % (i, i) for i in xrange(300)])
+        w_ret = run_source('(define (f) %s (cons v0 v299)) (f)' % defines)
+        self.assertEquals(w_ret.to_string(), '(0 . 299)')
+
+    def test_many_upvals(self):
+        defines = ' '.join(['(define v%d %d)' % (i, i) for i in xrange(300)])
+        body = 'v299'
+        for i in xrange(298, -1, -1):
+            body = '(+ v%d %s)' % (i, body)
+        w_ret = run_source('(define (f) %s (lambda () %s)) ((f))' % (defines,
+                                                                   body))
+        self.assertEquals(w_ret.to_int(), sum(range(300)))
+
+    def test_long_branch(self):
+        # Over 64k of code to branch over.
+        sets = ' '.join(["(set! g 'c%d)" % i for i in xrange(8000)])
+        source = ('(define g 0)'
+                  '(define (f x) (if x (begin %s g) 0))'
+                  '(cons (f #t) (f #f))' % sets)
+        self.assertEquals(run_source(source).to_string(), '(c7999 . 0)')
+
+    def test_nested_long_branches(self):
+        # The outer branch goes over an inner one that needs a prefix,
+        # and the one in the else branch comes after both.
+        sets = ' '.join(["(set! g 'c%d)" % i for i in xrange(8000)])
+        source = ('(define g 0)'
+                  '(define (f x y z)'
+                  '  (if x (if y (begin %s g) 1) (if z (begin %s g) 2)))'
+                  '(cons (f #t #t #f) (cons (f #t #f #f)'
+                  '  (cons (f #f #f #t) (cons (f #f #f #f) (quote ())))))'
+                  % (sets, sets))
+        self.assertEquals(run_source(source).to_string(),
+                          '(c7999 1 c7999 2)')
+
+def count_known_calls(source):
+    return (count_op(source, Op.CALLKNOWN) +
+            count_op(source, Op.LOADCALLKNOWN) +
+            count_op(source, Op.GETUPVALCALLKNOWN))
+
+class TestKnownCalls(TestCase):
+    def test_local_define(self):
+        source = ('(define (f n)'
+                  '  (define (loop i acc)'
+                  '    (if (< i 1) acc (loop (- i 1) (+ acc i))))'
+                  '  (loop n 0))')
+        # The call in f and the one in loop.
+        self.assertEquals(count_known_calls(source), 2)
+        self.assertEquals(run_source(source + '(f 10)').to_int(), 55)
+
+    def test_mutual_recursion(self):
+        source = ('(define (f n)'
+                  '  (define (even n) (if (< n 1) #t (odd (- n 1))))'
+                  '  (define (odd n) (if (< n 1) #f (even (- n 1))))'
+                  '  (even n))')
+        self.assertEquals(count_known_calls(source), 3)
+        self.assertEquals(run_source(source + '(f 7)').to_string(), '#f')
+
+    def test_let_bound_lambda(self):
+        source = '(define (f x) ((lambda (g) (g (g x))) (lambda (y) (* y 2))))'
+        self.assertEquals(count_known_calls(source), 2)
+        self.assertEquals(run_source(source + '(f 3)').to_int(), 12)
+
+    def test_unknown_callees(self):
+        # Toplevel functions, formals and reassigned locals.
+        self.assertEquals(count_known_calls(
+            '(define (f) 1) (define (g) (f))'), 0)
+        self.assertEquals(count_known_calls(
+            '(define (f g) (g 1))'), 0)
+        source = ('(define (f)'
+                  '  (define (g) 1)'
+                  '  (set! g (lambda () 2))'
+                  '  (g))')
+        self.assertEquals(count_known_calls(source), 0)
+        self.assertEquals(run_source(source + '(f)').to_int(), 2)
+
+    def test_arity_error(self):
+        source = ('(define (f)'
+                  '  (define (g a b) a)'
+                  '  (g 1))')
+        self.assertRaises(OperationError, compile_source, source)
+
+def count_placed_args(source):
+    """ In the protos of source only, not in the prelude's. """
+    w_maincont, proto_w = compile_source(source)
+    new_proto_w = proto_w[len(prelude_image.proto_w):]
+    count = 0
+    for w_proto in [w_maincont.w_proto] + new_proto_w:
+        opcodes = w_proto.insns[::2]
+        for op in [Op.SETARG, Op.LOADARG, Op.GETUPVALARG, Op.BUILDCONTARG,
+                   Op.PUSHCONTARG]:
+            count += opcodes.count(op)
+    return count
+
+class TestPlaceArgs(TestCase):
+    def test_steady_args_stay(self):
+        # a and b stay in their slots, k is put back in its own and
+        # (- i 1) is pushed. In main, the arguments are pushed: the
+        # continuation is a global.
+        source = ('(define (loop i a b)'
+                  '  (if (< i 1) (+ a b) (loop (- i 1) a b)))'
+                  '(loop 10 1 2)')
+        self.assertEquals(count_placed_args(source), 1)
+        self.assertEquals(run_source(source).to_int(), 3)
+
+    def test_swap(self):
+        # Every placed argument's slot is read by another: all pushed.
+        source = ('(define (f a b n)'
+                  '  (if (< n 1) (cons a b) (f b a (- n 1))))'
+                  '(f 1 2 3)')
+        self.assertEquals(run_source(source).to_string(), '(2 . 1)')
+        source = ('(define (f n a b)'
+                  '  (if (< n 1) (cons a b) (f (- n 1) b a)))'
+                  '(f 3 1 2)')
+        self.assertEquals(run_source(source).to_string(), '(2 . 1)')
+
+    def test_boxed_local_in_its_slot(self):
+        # a holds a ModuleCell, its value must be passed on.
+        source = ('(define (g a b) (cons a b))'
+                  '(define (f a b)'
+                  '  (define (h) a)'
+                  '  (set! a (+ a 4))'
+                  '  (g a b))'
+                  '(f 1 2)')
+        self.assertEquals(run_source(source).to_string(), '(5 . 2)')
+
+    def test_same_result(self):
+        source = ('(define (fibo n)'
+                  '  (if (< n 2) n (+ (fibo (- n 1)) (fibo (- n 2)))))'
+                  '(define (compose f g) (lambda (x) (f (g x))))'
+                  '(cons (fibo 10) ((compose car cdr) (cons 1 (cons 2 3))))')
+        self.assertEquals(run_source(source, False).to_string(),
+                          '(55 . 2)')
+        self.assertEquals(run_source(source).to_string(), '(55 . 2)')
@@ -0,0 +1,55 @@
+from unittest import TestCase
+from rasm.compiler.parser import parse_string
+from rasm.compiler.astbuilder import Builder
+from rasm.compiler.cps import Rewriter
+from rasm.compiler.codegen import compile_all
+from rasm.rt.image import prelude_image, get_report_env
+from rasm.rt.execution import Frame
+
+def cps_source(source):
+    nodelist = Builder(parse_string(source)).getast()
+    return Rewriter(nodelist, toplevel=True).run()
+
+def run_source(source):
+    w_maincont, proto_w = compile_all(cps_source(source), get_report_env(),
+                                      prelude_image.proto_w)
+    return Frame(w_maincont, proto_w).run()
+
+class TestCps(TestCase):
+    def test_no_admin_lambdas(self):
+        # Atomic defines and primitive ops need no continuation of their own.
+        s = cps_source('(define a 1) (define b (+ a 2)) (display b)')
+        s = s.to_string()
+        self.assertNotIn('Cont_', s)
+        self.assertNotIn('Lambda', s)
+
+    def test_one_cont_per_serious_call(self):
+        s = cps_source('(g (f 1) (f 2) 3)').to_string()
+        self.assertEquals(s.count('$ArgCont_'), 2)
+
+    def test_if_as_argument(self):
+        w_ret = run_source('(define (f x) (+ 1 (if (< x 0) (- 0 x) x)))'
+                           '(+ (f -3) (f 4))')
+        self.assertEquals(w_ret.to_int(), 9)
+
+    def test_internal_defines(self):
+        w_ret = run_source('(define (f n)'
+                           '  (define (ev? n) (if (= n 0) #t (od? (- n 1))))'
+                           '  (define (od? n) (if (= n 0) #f (ev? (- n 1))))'
+                           '  (display 0)'
+                           '  (ev? n))'
+                           '(if (f 10) (f 7) 1)')
+        self.assertEquals(w_ret.to_string(), '#f')
+
+    def test_loop_in_body(self):
+        w_ret = run_source('(define (sum n)'
+                           '  (define (loop i acc)'
+                           '    (if (> i n) acc (loop (+ i 1) (+ acc i))))'
+                           '  (loop 0 0))'
+                           '(sum 100)')
+        self.assertEquals(w_ret.to_int(), 5050)
+
+    def test_many_toplevel_forms(self):
+        source = ('(define x 0)\n' +
+                  "(set! x (+ x (car (cons 1 '()))))\n" * 2000)
+        self.assertEquals(run_source(source + 'x').to_int(), 2000)
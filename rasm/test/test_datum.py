@@ -0,0 +1,83 @@
+from unittest import TestCase
+from rasm.lang.model import (W_Int, W_Float, W_Pair, symbol, list_to_pair,
+                             w_nil, w_true, w_false)
+from rasm.lang.vector import make_vector
+from rasm.lang.datum import to_string, equal
+from rasm.error import OperationError
+
+def ints(lst):
+    return list_to_pair([W_Int(i) for i in lst])
+
+def nested(depth):
+    w_x = w_nil
+    for i in range(depth):
+        w_x = W_Pair(w_x, w_nil)
+    return w_x
+
+def circular(lst):
+    w_list = ints(lst)
+    w_last = w_list
+    while w_last.w_cdr is not w_nil:
+        w_last = w_last.w_cdr
+    w_last.w_cdr = w_list
+    return w_list
+
+class TestPrint(TestCase):
+    def test_simple(self):
+        w_vector = make_vector(2, W_Float(0.5))
+        w_x = list_to_pair([W_Int(1), ints([2, 3]), w_vector], symbol('a'))
+        self.assertEquals(to_string(w_x), '(1 (2 3) #(0.5 0.5) . a)')
+        self.assertEquals(to_string(W_Pair(w_nil, w_nil)), '(())')
+
+    def test_long_and_deep(self):
+        n = 100000
+        self.assertEquals(len(ints([0] * n).to_string()), 2 * n + 1)
+        self.assertEquals(nested(n).to_string(), '(' * n + '()' + ')' * n)
+
+    def test_cycles(self):
+        s = circular([1, 2, 3]).to_string()
+        self.assertTrue(s.startswith('(1 2 3 1 2 3'))
+        self.assertTrue(s.endswith(' . ...)'))
+        w_pair = W_Pair(w_nil, w_nil)
+        w_pair.w_car = w_pair
+        self.assertIn('(...)', w_pair.to_string())
+        w_vector = make_vector(1, w_nil)
+        w_vector.setitem(0, w_vector)
+        self.assertIn('#(...)', w_vector.to_string())
+
+    def test_shared(self):
+        w_x = ints([1])
+        w_shared = list_to_pair([w_x] * 20000)
+        self.assertEquals(w_shared.to_string(),
+                          '(' + ' '.join(['(1)'] * 20000) + ')')
+
+class TestEqual(TestCase):
+    def test_simple(self):
+        self.assertTrue(equal(ints([1, 2]), ints([1, 2])))
+        self.assertFalse(equal(ints([1, 2]), ints([1, 3])))
+        self.assertFalse(equal(ints([1, 2]), ints([1])))
+        self.assertIs(ints([1]).equal_w(W_Int(1)), w_false)
+        w_ints = make_vector(2, W_Int(0))
+        w_objects = make_vector(2, symbol('a'))
+        w_objects.setitem(0, W_Int(0))
+        w_objects.setitem(1, W_Int(0))
+        self.assertIs(w_ints.equal_w(w_objects), w_true)
+
+    def test_long_and_deep(self):
+        n = 100000
+        self.assertTrue(equal(ints(range(n)), ints(range(n))))
+        self.assertFalse(equal(ints(range(n)), ints(range(n - 1) + [0])))
+        self.assertTrue(equal(nested(n), nested(n)))
+        self.assertFalse(equal(nested(n), nested(n + 1)))
+
+    def test_cycles(self):
+        self.assertTrue(equal(circular([1, 2]), circular([1, 2, 1, 2])))
+        self.assertFalse(equal(circular([1, 2]), circular([1, 2, 1, 3])))
+
+class TestToList(TestCase):
+    def test_circular(self):
+        items_w, w_rest = ints([1, 2, 3]).to_list()
+        self.assertEquals(len(items_w), 3)
+        self.assertIs(w_rest, w_nil)
+        self.assertRaises(OperationError, circular([1]).to_list)
+        self.assertRaises(OperationError, circular([1, 2, 3, 4]).to_list)
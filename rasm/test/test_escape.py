@@ -0,0 +1,87 @@
+from unittest import TestCase
+from rasm.lang.model import symbol
+from rasm.compiler.ast import Seq, Apply, Def, Lambda, Var, Const
+from rasm.compiler.parser import parse_string
+from rasm.compiler.astbuilder import Builder
+from rasm.compiler.cps import Rewriter
+from rasm.compiler.simplify import Census
+from rasm.compiler.escape import stack_conts
+
+def cps_source(source):
+    nodelist = Builder(parse_string(source)).getast()
+    return Rewriter(nodelist, toplevel=True).run()
+
+def analyze(node):
+    census = Census()
+    census.run(node)
+    return stack_conts(node, census)
+
+def cont_lambdas(node):
+    """ The continuation lambdas in node, by name. """
+    found = {}
+    worklist = [node]
+    while worklist:
+        node = worklist.pop()
+        if isinstance(node, Lambda):
+            if node.is_cont:
+                found[node.name] = node
+            worklist.extend(node.body)
+        elif isinstance(node, Seq):
+            worklist.extend(node.nodelist)
+        elif isinstance(node, Apply):
+            worklist.append(node.proc)
+            worklist.extend(node.args)
+        elif isinstance(node, Def):
+            worklist.append(node.form)
+        elif hasattr(node, 'fst'):
+            worklist.extend([node.fst, node.snd, node.trd])
+    return found
+
+def var(name):
+    return Var(symbol(name))
+
+class TestEscape(TestCase):
+    def test_call_conts(self):
+        node = cps_source('(define (fibo n)'
+                          '  (if (< n 2) n (+ (fibo (- n 1))'
+                          '                   (fibo (- n 2)))))'
+                          '(fibo 10)')
+        conts = cont_lambdas(node)
+        self.assertTrue(conts)
+        stack = analyze(node)
+        for lam in conts.values():
+            self.assertIn(lam, stack)
+
+    def test_join_cont(self):
+        # The join is called from one branch and passed from the other.
+        node = cps_source('(define (g x) (if (< x 0) (g (- 0 x)) x))'
+                          '(define (f x)'
+                          '  (display (if (< x 0) (g x) x)) (newline) x)')
+        joins = [lam for name, lam in cont_lambdas(node).items()
+                 if name.startswith('$JoinCont_')]
+        self.assertEquals(len(joins), 1)
+        self.assertIn(joins[0], analyze(node))
+
+    def test_escaping_join(self):
+        # (define j (lambda (rv) ...)) (f j k): j is passed as a value.
+        join = Lambda([var('rv')], [Apply(var('k'), [var('rv')])],
+                      is_cont=True)
+        node = Lambda([var('k')], [Seq([
+            Def(var('j'), join),
+            Apply(var('f'), [var('j'), var('k')]),
+        ])])
+        self.assertNotIn(join, analyze(node))
+
+    def test_captured_cont_var(self):
+        # (lambda (k) (g (lambda (y k2) (k y)) (lambda (rv) (k rv)))):
+        # the inner lambda may call k whenever, so nothing goes on the
+        # stack.
+        cont = Lambda([var('rv')], [Apply(var('k'), [var('rv')])],
+                      is_cont=True)
+        inner = Lambda([var('y'), var('k2')], [Apply(var('k'),
+                                                     [var('y')])])
+        node = Lambda([var('k')], [Apply(var('g'), [inner, cont])])
+        self.assertEquals(analyze(node), {})
+        node = Lambda([var('k')], [Apply(var('g'), [Const(symbol('x')),
+                                                    cont])])
+        self.assertIn(cont, analyze(node))
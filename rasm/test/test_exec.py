@@ -1,13 +1,28 @@
+import os
+import tempfile
 from unittest import TestCase
 from rasm.lang.model import W_Int, symbol, w_nil, w_true, w_false, W_Pair
 from rasm.lang.env import ModuleDict
-from rasm.rt.code import Op, W_Proto, W_Cont
+from rasm.rt.code import (Op, W_Proto, W_Cont, W_StackCont, decode, emit,
+                          fetch, callcache_stats)
 from rasm.rt.execution import Frame
+from rasm.rt.image import prelude_image, get_report_env
+from rasm.compiler.parser import parse_string
+from rasm.compiler.astbuilder import Builder
+from rasm.compiler.cps import Rewriter
+from rasm.compiler.codegen import compile_all
 from rasm.error import OperationError
 
 def makecode(lst):
     return ''.join(map(chr, lst))
 
+def run_source(source):
+    nodelist = Builder(parse_string(source)).getast()
+    cpsform = Rewriter(nodelist, toplevel=True).run()
+    w_maincont, proto_w = compile_all(cpsform, get_report_env(),
+                                      prelude_image.proto_w)
+    return Frame(w_maincont, proto_w).run()
+
 class TestExec(TestCase):
     def test_simple_add(self):
         simple_add = makecode([
@@ -71,11 +86,42 @@ class TestExec(TestCase):
                               upval_descr=[], const_w=[])
         w_maincont = W_Cont(w_mainproto, upval_w=[])
         w_callproto = W_Proto(callcode, nb_args=0, nb_locals=0,
-                              upval_descr=[chr(0)], const_w=[])
+                              upval_descr=[0], const_w=[])
         frame = Frame(w_maincont, [w_callproto])
         w_ret = frame.run()
         self.assertEquals(w_ret.to_int(), 42)
 
+    def test_upval_of_upval(self):
+        # The middle proto passes its upval on: past its one local, the
+        # descr index 1 is its upval 0.
+        maincode = makecode([
+            Op.INT, 42, 0,
+            Op.STORE, 0,
+            Op.BUILDCONT, 0, 0,
+            Op.CONT,
+        ])
+        middlecode = makecode([
+            Op.INT, 1, 0,
+            Op.STORE, 0,
+            Op.BUILDCONT, 1, 0,
+            Op.CONT,
+        ])
+        innercode = makecode([
+            Op.GETUPVAL, 0,
+            Op.HALT,
+        ])
+        w_maincont = W_Cont(W_Proto(maincode, 0, 1, [], []), [])
+        proto_w = [W_Proto(middlecode, 0, 1, [0], []),
+                   W_Proto(innercode, 0, 0, [1], [])]
+        frame = Frame(w_maincont, proto_w)
+        for i in range(4):
+            frame.dispatch(frame.w_proto.insns)
+        # Entered the middle proto: its upval is not on the stack.
+        self.assertIs(frame.w_proto, proto_w[0])
+        self.assertEquals(frame.stacktop, 1)
+        self.assertEquals(frame.upval_w[0].to_int(), 42)
+        self.assertEquals(frame.run().to_int(), 42)
+
     def test_recur(self):
         maincode = makecode([
             Op.INT, 10, 0,
@@ -132,10 +178,10 @@ class TestExec(TestCase):
                              w_module=w_module)
         w_maincont = W_Cont(proto_w[0], upval_w=[])
         proto_w[1] = W_Proto(fibo_k0, nb_args=1, nb_locals=1,
-                             upval_descr=[chr(0), chr(1)],
+                             upval_descr=[0, 1],
                              const_w=const_w1, w_module=w_module)
         proto_w[2] = W_Proto(fibo_k1, nb_args=1, nb_locals=1,
-                             upval_descr=[chr(0), chr(2)],
+                             upval_descr=[0, 2],
                              const_w=const_w1, w_module=w_module)
         proto_w[3] = W_Proto(fibo_entry, nb_args=2, nb_locals=2,
                              upval_descr=[],
@@ -154,3 +200,414 @@ class TestExec(TestCase):
         w_ret = frame.run()
         self.assertEquals(w_ret.to_int(), 55)
 
+
+class TestDecode(TestCase):
+    def test_operands(self):
+        code = makecode([
+            Op.INT, 0x34, 0x12,
+            Op.LOAD, 3,
+            Op.IADD,
+            Op.HALT,
+        ])
+        self.assertEquals(decode(code), [Op.INT, 0x1234,
+                                         Op.LOAD, 3,
+                                         Op.IADD, 0,
+                                         Op.HALT, 0])
+
+    def test_branch_targets(self):
+        code = makecode([
+            Op.TRUE,
+            Op.BRANCHIFNOT, 4, 0,
+            Op.INT, 1, 0,
+            Op.HALT,
+            Op.INT, 2, 0,
+            Op.HALT,
+        ])
+        insns = decode(code)
+        # The else branch starts at the fifth instruction.
+        self.assertEquals(insns[2:4], [Op.BRANCHIFNOT, 8])
+        self.assertEquals(insns[8:10], [Op.INT, 2])
+
+    def test_extended_arg(self):
+        code = []
+        emit(code, Op.LOAD, 0x1234)
+        emit(code, Op.BUILDCONT, 0x56789)
+        emit(code, Op.LOAD, 7)
+        code = ''.join(code)
+        self.assertEquals(code, makecode([
+            Op.EXTENDED_ARG, 0x12, 0,
+            Op.LOAD, 0x34,
+            Op.EXTENDED_ARG, 5, 0,
+            Op.BUILDCONT, 0x89, 0x67,
+            Op.LOAD, 7,
+        ]))
+        self.assertEquals(fetch(code, 0), (Op.LOAD, 0x1234, 5))
+        self.assertEquals(decode(code), [Op.LOAD, 0x1234,
+                                         Op.BUILDCONT, 0x56789,
+                                         Op.LOAD, 7])
+
+class TestCallCache(TestCase):
+    def setUp(self):
+        callcache_stats.reset()
+
+    def test_hits(self):
+        source = ('(define (fibo n)'
+                  '  (if (< n 2) n (+ (fibo (- n 1)) (fibo (- n 2)))))'
+                  '(fibo 15)')
+        self.assertEquals(run_source(source).to_int(), 610)
+        # Each call site misses once, when its cache is first filled.
+        self.assertTrue(callcache_stats.misses <= 3)
+        self.assertTrue(callcache_stats.hits > 1000)
+
+    def test_redefined_callee(self):
+        # The second define makes a cell and a new module version, the
+        # set! only changes what the cell holds.
+        source = ('(define (f) 1)'
+                  '(define (g) (f))'
+                  '(define a (g))'
+                  '(define (f) 2)'
+                  '(define b (g))'
+                  '(set! f (lambda () 3))'
+                  '(cons a (cons b (g)))')
+        self.assertEquals(run_source(source).to_string(), '(1 2 . 3)')
+
+    def test_arity_checked_on_miss(self):
+        source = ('(define (f x) x)'
+                  '(define (g) (f 1))'
+                  '(g)'
+                  '(set! f (lambda () 0))'
+                  '(g)')
+        # The error is printed and the frame returns nothing.
+        self.assertEquals(run_source(source), None)
+        self.assertEquals(callcache_stats.hits, 0)
+
+class TestArgs(TestCase):
+    def run_call(self, argcode):
+        """ Runs up to the call of a one argument proto, which must
+            not keep the pair in the caller's local 1 alive.
+        """
+        maincode = makecode([
+            Op.NIL,
+            Op.NIL,
+            Op.CONS,
+            Op.STORE, 1,
+        ] + argcode + [
+            Op.BUILDCONT, 0, 0,
+            Op.CONT,
+        ])
+        callcode = makecode([
+            Op.LOAD, 0,
+            Op.HALT,
+        ])
+        w_mainproto = W_Proto(maincode, 0, 2, [], [])
+        w_callproto = W_Proto(callcode, 1, 1, [], [])
+        frame = Frame(W_Cont(w_mainproto, []), [w_callproto])
+        w_pair = None
+        while frame.w_proto is w_mainproto:
+            frame.dispatch(w_mainproto.insns)
+            if w_pair is None:
+                w_pair = frame.stack_w[1]
+        self.assertEquals(frame.stacktop, 1)
+        self.assertEquals(frame.stack_w[0].to_int(), 7)
+        for w_slot in frame.stack_w:
+            self.assertIsNot(w_slot, w_pair)
+        self.assertEquals(frame.run().to_int(), 7)
+
+    def test_pushed_arg(self):
+        self.run_call([Op.INT, 7, 0])
+
+    def test_placed_arg(self):
+        self.run_call([Op.INT, 7, 0, Op.SETARG, 0])
+
+    def test_mixed_args(self):
+        # The pushed 7 goes to slot 0, below the one put in place.
+        maincode = makecode([
+            Op.INT, 7, 0,
+            Op.INT, 8, 0,
+            Op.SETARG, 1,
+            Op.BUILDCONT, 0, 0,
+            Op.CONT,
+        ])
+        callcode = makecode([
+            Op.LOAD, 0,
+            Op.LOAD, 1,
+            Op.CONS,
+            Op.HALT,
+        ])
+        w_mainproto = W_Proto(maincode, 0, 2, [], [])
+        w_callproto = W_Proto(callcode, 2, 2, [], [])
+        frame = Frame(W_Cont(w_mainproto, []), [w_callproto])
+        self.assertEquals(frame.run().to_string(), '(7 . 8)')
+
+class TestStackConts(TestCase):
+    def run_frame(self, source, stack_conts=True):
+        nodelist = Builder(parse_string(source)).getast()
+        cpsform = Rewriter(nodelist, toplevel=True).run()
+        w_maincont, proto_w = compile_all(cpsform, get_report_env(),
+                                          prelude_image.proto_w,
+                                          stack_conts=stack_conts)
+        frame = Frame(w_maincont, proto_w)
+        return frame, frame.run()
+
+    def assertSameResult(self, source, expected):
+        for stack_conts in [False, True]:
+            _, w_ret = self.run_frame(source, stack_conts)
+            self.assertEquals(w_ret.to_string(), expected)
+
+    def test_empty_at_halt(self):
+        frame, w_ret = self.run_frame(
+                '(define (fibo n)'
+                '  (if (< n 2) n (+ (fibo (- n 1)) (fibo (- n 2)))))'
+                '(fibo 10)')
+        self.assertEquals(w_ret.to_int(), 55)
+        self.assertEquals(frame.contdepth, 0)
+        self.assertEquals(frame.contstack_w, [])
+
+    def test_upvals(self):
+        maincode = makecode([
+            Op.INT, 5, 0,
+            Op.STORE, 0,
+            Op.INT, 7, 0,
+            Op.PUSHCONT, 0, 0,
+            Op.CONT,
+        ])
+        contcode = makecode([
+            Op.LOAD, 0,
+            Op.GETUPVAL, 0,
+            Op.CONS,
+            Op.HALT,
+        ])
+        w_mainproto = W_Proto(maincode, 0, 1, [], [])
+        w_contproto = W_Proto(contcode, 1, 1, [0], [])
+        frame = Frame(W_Cont(w_mainproto, []), [w_contproto])
+        self.assertEquals(frame.run().to_string(), '(7 . 5)')
+        self.assertEquals(frame.contdepth, 0)
+
+    def test_not_on_top(self):
+        maincode = makecode([
+            Op.INT, 7, 0,
+            Op.PUSHCONT, 0, 0,
+            Op.PUSHCONT, 0, 0,
+            Op.POP,
+            Op.CONT,
+        ])
+        contcode = makecode([
+            Op.LOAD, 0,
+            Op.HALT,
+        ])
+        w_mainproto = W_Proto(maincode, 0, 0, [], [])
+        w_contproto = W_Proto(contcode, 1, 1, [], [])
+        frame = Frame(W_Cont(w_mainproto, []), [w_contproto])
+        for i in range(4):
+            frame.dispatch(w_mainproto.insns)
+        self.assertIsInstance(frame.peek(), W_StackCont)
+        self.assertRaises(OperationError, frame.dispatch,
+                          w_mainproto.insns)
+
+    def test_reentered_continuation(self):
+        self.assertSameResult(
+                "(define r '())"
+                '(define k #f)'
+                '(define n 0)'
+                '(set! r (cons (+ 100 (call/cc (lambda (c) (set! k c) 1)))'
+                '              r))'
+                '(set! n (+ n 1))'
+                '(if (< n 4) (k n) r)',
+                '(103 102 101 101)')
+
+    def test_escape(self):
+        self.assertSameResult(
+                '(define (find-first p lst)'
+                '  (call/cc (lambda (return)'
+                '    (define (walk l)'
+                '      (if (null? l) #f'
+                '          (begin (if (p (car l)) (return (car l)) #f)'
+                '                 (walk (cdr l)))))'
+                '    (walk lst))))'
+                '(define (deep n)'
+                "  (if (< n 1) (find-first (lambda (x) (< 2 x)) '(1 2 3 4))"
+                '      (+ 1 (deep (- n 1)))))'
+                '(cons (deep 50) (deep 3))',
+                '(53 . 6)')
+
+class TestDeepNesting(TestCase):
+    # Past the recursion limit, if the compiler recursed on nesting.
+    DEPTH = 1500
+
+    def nest(self, head, inner, tail):
+        return head * self.DEPTH + inner + tail * self.DEPTH
+
+    def test_calls(self):
+        source = '(define (f x) (+ x 1))' + self.nest('(f ', '0', ')')
+        self.assertEquals(run_source(source).to_int(), self.DEPTH)
+
+    def test_primitives(self):
+        source = self.nest('(+ 1 ', '0', ')')
+        self.assertEquals(run_source(source).to_int(), self.DEPTH)
+
+    def test_ifs(self):
+        source = self.nest('(+ 1 (if #t ', '0', ' 0))')
+        self.assertEquals(run_source(source).to_int(), self.DEPTH)
+
+    def test_lambdas(self):
+        source = self.nest('((lambda (x) (+ x ', '0', ')) 1)')
+        self.assertEquals(run_source(source).to_int(), self.DEPTH)
+
+    def test_begins(self):
+        source = self.nest('(begin (define x 1) ', 'x', ')')
+        self.assertEquals(run_source(source).to_int(), 1)
+
+class TestBigInt(TestCase):
+    def test_overflow(self):
+        source = ('(define (fact n) (if (< n 1) 1 (* n (fact (- n 1)))))'
+                  '(define (fib n a b)'
+                  '  (if (< n 1) a (fib (- n 1) b (+ a b))))'
+                  '(cons (fact 25) (fib 100 0 1))')
+        self.assertEquals(run_source(source).to_string(),
+                          '(15511210043330985984000000 . '
+                          '354224848179261915075)')
+
+    def test_back_to_int(self):
+        # The largest int that a tagged build has too.
+        w_ret = run_source('(- (+ 4611686018427387903 1) 1)')
+        self.assertIsInstance(w_ret, W_Int)
+        self.assertEquals(w_ret.to_int(), 4611686018427387903)
+        w_ret = run_source('(- -9223372036854775807 10)')
+        self.assertEquals(w_ret.to_string(), '-9223372036854775817')
+
+    def test_compare(self):
+        source = ("(define big 100000000000000000000)"
+                  "(cons (< 1 big) (cons (< big (* big 2))"
+                  "      (cons (< (- 0 big) 1) (integer? big))))")
+        self.assertEquals(run_source(source).to_string(), '(#t #t #t . #t)')
+
+class TestFloat(TestCase):
+    def test_generic(self):
+        source = ("(cons (+ 1 2.5) (cons (- 1.5 1) (cons (* 2 0.25)"
+                  "      (cons (< 1 1.5) (< 2.5 2)))))")
+        self.assertEquals(run_source(source).to_string(),
+                          '(3.5 0.5 0.5 #t . #f)')
+
+    def test_div(self):
+        source = ("(cons (/ 8 2) (cons (/ 7 2) (cons (/ 1.0 4)"
+                  "      (/ 100000000000000000000 10))))")
+        self.assertEquals(run_source(source).to_string(),
+                          '(4 3.5 0.25 . 10000000000000000000)')
+        self.assertIsNone(run_source('(/ 1 0)'))
+
+    def test_fl_ops(self):
+        source = ("(define (norm x y) (flsqrt (fl+ (fl* x x) (fl* y y))))"
+                  "(cons (norm 3.0 (exact->inexact 4))"
+                  "      (cons (fl/ (fl- 1.0 0.5) 2.0) (fl< 1.0 2.0)))")
+        self.assertEquals(run_source(source).to_string(), '(5.0 0.25 . #t)')
+        self.assertIsNone(run_source('(fl+ 1 2.0)'))
+
+    def test_fl_builtins(self):
+        source = ("(cons (map exact->inexact '(1 2))"
+                  "      ((lambda (f) (f 1.0 2.0)) fl*))")
+        self.assertEquals(run_source(source).to_string(), '((1.0 2.0) . 2.0)')
+
+class TestVector(TestCase):
+    def test_ops(self):
+        source = ("(define v (make-vector 3 0))"
+                  "(vector-set! v 1 5)"
+                  "(vector-set! v 2 (+ (vector-ref v 1) 1))"
+                  "(cons v (cons (vector-length v) (vector? v)))")
+        self.assertEquals(run_source(source).to_string(),
+                          '(#(0 5 6) 3 . #t)')
+
+    def test_builtins(self):
+        source = ("(define v (list->vector '(1 2.5 a)))"
+                  "(cons (vector->list v) (map vector? (cons v '(1))))")
+        self.assertEquals(run_source(source).to_string(),
+                          '((1 2.5 a) #t #f)')
+
+    def test_errors(self):
+        self.assertIsNone(run_source('(vector-ref (make-vector 2 0) 2)'))
+        self.assertIsNone(run_source('(vector-ref (cons 1 2) 0)'))
+
+    def test_bulk(self):
+        source = ("(define v (list->vector '(1 2 3)))"
+                  "(define w (list->vector '(10 20 30)))"
+                  "(vector-map! - w v)"
+                  "(define d (make-vector 4 0))"
+                  "(vector-copy! d 1 v)"
+                  "(cons (vector-sum w) (cons (vector-dot v v) d))")
+        self.assertEquals(run_source(source).to_string(),
+                          '(54 14 . #(0 1 2 3))')
+        self.assertIsNone(run_source(
+                "(define v (make-vector 2 1)) (vector-map! car v v)"))
+
+class TestHashTable(TestCase):
+    def test_ops(self):
+        source = ("(define t (make-equal-hashtable))"
+                  "(hashtable-set! t '(1 2) 'a)"
+                  "(hashtable-set! t 'x 'b)"
+                  "(hashtable-set! t 3 'c)"
+                  "(hashtable-delete! t 'x)"
+                  "(cons (hashtable-ref t (cons 1 (cons 2 '())) #f)"
+                  "      (cons (hashtable-ref t 'x 'none)"
+                  "            (cons (hashtable-count t)"
+                  "                  (hashtable-contains? t 3))))")
+        self.assertEquals(run_source(source).to_string(), '(a none 2 . #t)')
+
+    def test_walk(self):
+        source = ("(define t (make-eq-hashtable))"
+                  "(define (fill i)"
+                  "  (if (< i 5) (begin (hashtable-set! t i (* i i))"
+                  "                     (fill (+ i 1)))))"
+                  "(fill 0)"
+                  "(define sum 0)"
+                  "(hashtable-walk t (lambda (k v) (set! sum (+ sum v))))"
+                  "(cons sum (hashtable-values t))")
+        self.assertEquals(run_source(source).to_string(),
+                          '(30 . #(0 1 4 9 16))')
+
+    def test_errors(self):
+        self.assertIsNone(run_source("(hashtable-ref '() 1 2)"))
+
+class TestPort(TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_file_port(self):
+        source = ('(define p (open-output-file "%s"))'
+                  "(display '(1 \"two\" #\\3) p)"
+                  '(newline p)'
+                  '(write-string "x" p)'
+                  '(write-char #\\y p)'
+                  '(close-output-port p)' % self.path)
+        run_source(source)
+        self.assertEquals(open(self.path).read(), '(1 two 3)\nxy')
+
+    def test_flushed_on_halt(self):
+        w_port = run_source('(define p (open-output-file "%s"))'
+                            '(flush-output)'
+                            '(write-string "left open" p)'
+                            'p' % self.path)
+        self.assertEquals(open(self.path).read(), 'left open')
+        w_port.close()
+
+    def test_read(self):
+        f = open(self.path, 'w')
+        f.write('1 (2 3)\n4.5 "six"')
+        f.close()
+        source = ('(define p (open-input-file "%s"))'
+                  '(define (read-all acc) (next (read p) acc))'
+                  '(define (next x acc)'
+                  '  (if (eof-object? x) (reverse acc)'
+                  '      (read-all (cons x acc))))'
+                  '(read-all (quote ()))' % self.path)
+        self.assertEquals(run_source(source).to_string(),
+                          '(1 (2 3) 4.5 six)')
+
+    def test_errors(self):
+        self.assertIsNone(run_source('(write-string 1)'))
+        self.assertIsNone(run_source('(display 1 2)'))
+        self.assertIsNone(run_source('(define p (open-output-file "%s"))'
+                                     '(close-output-port p)'
+                                     '(newline p)' % self.path))
@@ -1,6 +1,8 @@
 from unittest import TestCase
-from rasm.rt.code import W_Proto, W_Cont
+from rasm.rt.code import (Op, W_Proto, W_Cont, BytecodeError,
+                          max_stackdepth)
 from rasm.rt.opimpl import Frame
+from rasm.rt.prelude import builtin_stacksize
 from rasm.lang.model import W_Int, symbol
 from rasm.error import OperationError
 
@@ -8,7 +10,7 @@ class TestFrame(TestCase):
     def setUp(self):
         self.w_proto = W_Proto([], 0, 0, [], [], w_module=None)
         self.w_cont = W_Cont(self.w_proto, [])
-        self.frame = Frame(self.w_cont, [self.w_proto])
+        self.frame = Frame(self.w_cont, [self.w_proto], stacksize=4)
 
     def test_ctor(self):
         self.assertEquals(self.frame.stacktop, 0)
@@ -41,3 +43,62 @@ class TestFrame(TestCase):
         self.assertEquals(self.frame.stacktop, 1)
         self.assertIs(i2, i3)
 
+
+def makecode(lst):
+    return ''.join(map(chr, lst))
+
+class TestStackSize(TestCase):
+    def test_straight_line(self):
+        code = makecode([Op.INT, 1, 0, Op.INT, 2, 0, Op.IADD, Op.HALT])
+        self.assertEquals(max_stackdepth(code, 0, 0), 2)
+        # Upvals are read from the continuation, not from the stack.
+        self.assertEquals(max_stackdepth(code, 3, 1), 5)
+
+    def test_branches(self):
+        code = makecode([
+            Op.LOAD, 0,
+            Op.BRANCHIFNOT, 5, 0,
+            Op.INT, 1, 0,
+            Op.DUP,
+            Op.HALT,
+            Op.LOAD, 0,
+            Op.HALT,
+        ])
+        w_proto = W_Proto(code, 1, 1, [], [])
+        self.assertEquals(w_proto.stacksize, 3)
+
+    def test_bad_operands(self):
+        self.assertRaises(BytecodeError, W_Proto,
+                          makecode([Op.LOAD, 1, Op.HALT]), 1, 1, [], [])
+        self.assertRaises(BytecodeError, W_Proto,
+                          makecode([Op.GETUPVAL, 0, Op.HALT]), 0, 0, [], [])
+        self.assertRaises(BytecodeError, W_Proto,
+                          makecode([Op.HALT]), 2, 1, [], [])
+
+    def test_inconsistent_depth(self):
+        code = makecode([
+            Op.TRUE,
+            Op.BRANCHIFNOT, 1, 0,
+            Op.NIL,
+            Op.NIL,
+            Op.HALT,
+        ])
+        self.assertRaises(BytecodeError, max_stackdepth, code, 0, 0)
+
+    def test_frame_is_sized_from_protos(self):
+        w_small = W_Proto(makecode([Op.NIL, Op.HALT]), 0, 0, [], [])
+        w_big = W_Proto(makecode([Op.NIL] * 40 + [Op.HALT]), 0, 2, [], [])
+        frame = Frame(W_Cont(w_small, []), [w_big])
+        self.assertEquals(len(frame.stack_w),
+                          max(w_big.stacksize, builtin_stacksize))
+        self.assertEquals(w_big.stacksize, 42)
+
+    def test_overflow_is_detected(self):
+        # A continuation whose proto the frame was not sized for.
+        w_big = W_Proto(makecode([Op.NIL] * 40 + [Op.HALT]), 0, 0, [], [])
+        w_main = W_Proto(makecode([Op.LOADCONST, 0, Op.CONT]), 0, 0, [],
+                         [W_Cont(w_big, [])])
+        frame = Frame(W_Cont(w_main, []), [])
+        self.assertTrue(len(frame.stack_w) < w_big.stacksize)
+        frame.dispatch(w_main.insns)
+        self.assertRaises(OperationError, frame.dispatch, w_main.insns)
@@ -0,0 +1,69 @@
+from unittest import TestCase
+from rasm.lang.model import (W_Int, W_Float, W_Pair, symbol, list_to_pair,
+                             w_nil)
+from rasm.lang.vector import make_vector
+from rasm.lang.hashtable import W_HashTable, equal_hash, HASH_BUDGET
+
+def ints(lst):
+    return list_to_pair([W_Int(i) for i in lst])
+
+class TestHashTable(TestCase):
+    def test_equal(self):
+        w_table = W_HashTable(True)
+        w_table.set(ints([1, 2]), symbol('a'))
+        w_table.set(W_Float(2.5), symbol('b'))
+        self.assertIs(w_table.get(ints([1, 2]), w_nil), symbol('a'))
+        self.assertIs(w_table.get(W_Float(2.5), w_nil), symbol('b'))
+        self.assertIs(w_table.get(ints([1]), w_nil), w_nil)
+        w_table.set(ints([1, 2]), symbol('c'))
+        self.assertEquals(w_table.count, 2)
+        self.assertIs(w_table.get(ints([1, 2]), w_nil), symbol('c'))
+
+    def test_eq(self):
+        w_table = W_HashTable(False)
+        w_key = ints([1])
+        w_table.set(w_key, symbol('a'))
+        w_table.set(W_Int(7), symbol('b'))
+        self.assertIs(w_table.get(w_key, w_nil), symbol('a'))
+        self.assertIs(w_table.get(ints([1]), w_nil), w_nil)
+        self.assertIs(w_table.get(W_Int(7), w_nil), symbol('b'))
+
+    def test_grow_and_delete(self):
+        w_table = W_HashTable(True)
+        for i in range(1000):
+            w_table.set(W_Int(i), W_Int(i * 2))
+        for i in range(0, 1000, 2):
+            w_table.delete(W_Int(i))
+        w_table.delete(W_Int(0))
+        self.assertEquals(w_table.count, 500)
+        for i in range(1000):
+            self.assertEquals(w_table.contains(W_Int(i)), i % 2 == 1)
+        self.assertEquals(w_table.get(W_Int(999), w_nil).to_int(), 1998)
+        for i in range(1000, 2000):
+            w_table.set(W_Int(i), w_nil)
+        self.assertEquals(w_table.count, 1500)
+        self.assertTrue(len(w_table.keys_w) * 3 < len(w_table.indices) * 2)
+
+    def test_keys_values(self):
+        w_table = W_HashTable(True)
+        for name in ['c', 'a', 'b']:
+            w_table.set(symbol(name), W_Int(len(name)))
+        w_table.delete(symbol('a'))
+        self.assertEquals(w_table.keys().to_string(), '#(c b)')
+        self.assertEquals(w_table.values().to_string(), '#(1 1)')
+
+    def test_equal_hash(self):
+        self.assertEquals(equal_hash(ints([1, 2, 3])),
+                          equal_hash(ints([1, 2, 3])))
+        w_ints = make_vector(2, W_Int(1))
+        w_objects = make_vector(2, symbol('a'))
+        w_objects.setitem(0, W_Int(1))
+        w_objects.setitem(1, W_Int(1))
+        self.assertEquals(equal_hash(w_ints), equal_hash(w_objects))
+        # Past the budget, lists that differ still are different keys.
+        w_table = W_HashTable(True)
+        size = HASH_BUDGET * 2
+        w_table.set(ints(range(size)), symbol('a'))
+        w_table.set(ints(range(size - 1) + [0]), symbol('b'))
+        self.assertEquals(w_table.count, 2)
+        self.assertIs(w_table.get(ints(range(size)), w_nil), symbol('a'))
@@ -0,0 +1,43 @@
+from unittest import TestCase
+from rasm.lang.model import symbol
+from rasm.compiler.parser import parse_string
+from rasm.compiler.astbuilder import Builder
+from rasm.compiler.cps import Rewriter
+from rasm.compiler.codegen import compile_all
+from rasm.rt.image import prelude_image, get_report_env
+from rasm.rt.execution import Frame
+
+def run_source(source, w_module):
+    nodelist = Builder(parse_string(source)).getast()
+    cpsform = Rewriter(nodelist, toplevel=True).run()
+    w_maincont, proto_w = compile_all(cpsform, w_module,
+                                      prelude_image.proto_w)
+    return Frame(w_maincont, proto_w).run()
+
+class TestImage(TestCase):
+    def test_stdlib_bound(self):
+        w_module = get_report_env()
+        for name in ['car', 'display', 'call/cc', 'map', 'assoc', 'reverse']:
+            self.assertIsNot(w_module.getitem(symbol(name)), None)
+
+    def test_stdlib_closures(self):
+        # map's continuations are built from the image's protos.
+        w_ret = run_source("(map (lambda (x) (* x x)) '(1 2 3))",
+                           get_report_env())
+        self.assertEquals(w_ret.to_string(), '(1 4 9)')
+        w_ret = run_source("(reverse (append '(1 2) '(3)))",
+                           get_report_env())
+        self.assertEquals(w_ret.to_string(), '(3 2 1)')
+        w_ret = run_source("(assoc '(b) '(((a) 1) ((b) 2)))",
+                           get_report_env())
+        self.assertEquals(w_ret.to_string(), '((b) 2)')
+
+    def test_envs_are_isolated(self):
+        w_env1 = get_report_env()
+        w_env2 = get_report_env()
+        run_source('(define (map f lst) 42)', w_env1)
+        self.assertEquals(run_source("(map car '())", w_env1).to_int(), 42)
+        self.assertEquals(run_source("(map car '())", w_env2).to_string(),
+                          '()')
+        self.assertIsNot(prelude_image.w_module.getitem(symbol('map')),
+                         w_env1.getitem(symbol('map')))
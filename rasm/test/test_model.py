@@ -1,6 +1,9 @@
 from unittest import TestCase
-from rasm.lang.model import (W_Int, symbol, w_nil, w_true, w_false, W_Pair,
-                             list_to_pair)
+from pypy.rlib.rbigint import rbigint
+from rasm.lang.model import (W_Int, W_BigInt, W_Float, W_String, W_Char,
+                             symbol, w_nil,
+                             w_true, w_false, W_Pair, list_to_pair, wrap_int,
+                             wrap_bigint)
 from rasm.error import OperationError
 
 class TestModel(TestCase):
@@ -9,6 +12,37 @@ class TestModel(TestCase):
         self.assertEquals(i.to_int(), 5)
         self.assertEquals(i.to_string(), '5')
 
+    def test_bigint(self):
+        w_small = wrap_bigint(rbigint.fromint(5).mul(rbigint.fromint(3)))
+        self.assertIsInstance(w_small, W_Int)
+        self.assertEquals(w_small.to_int(), 15)
+        w_big = wrap_bigint(rbigint.fromdecimalstr('1' * 30))
+        self.assertIsInstance(w_big, W_BigInt)
+        self.assertEquals(w_big.to_string(), '1' * 30)
+        self.assertRaises(OperationError, w_big.to_int)
+        w_same = W_BigInt(rbigint.fromdecimalstr('1' * 30))
+        self.assertIs(w_big.equal_w(w_same), w_true)
+        self.assertIs(w_big.equal_w(wrap_int(1)), w_false)
+
+    def test_float(self):
+        self.assertEquals(W_Float(1.0).to_string(), '1.0')
+        self.assertEquals(W_Float(-0.1).to_string(), '-0.1')
+        self.assertEquals(W_Float(1e22).to_string(), '1e+22')
+        self.assertIs(W_Float(1.5).equal_w(W_Float(1.5)), w_true)
+        self.assertIs(W_Float(1.0).equal_w(wrap_int(1)), w_false)
+        self.assertEquals(wrap_int(3).to_float(), 3.0)
+        self.assertRaises(OperationError, symbol('s').to_float)
+
+    def test_string_and_char(self):
+        w_string = W_String('ab')
+        self.assertEquals(w_string.to_string(), 'ab')
+        self.assertIs(w_string.equal_w(W_String('ab')), w_true)
+        self.assertIs(w_string.equal_w(symbol('ab')), w_false)
+        self.assertEquals(w_string.hash_w(), W_String('ab').hash_w())
+        self.assertEquals(W_Char('a').to_string(), 'a')
+        self.assertIs(W_Char('a').equal_w(W_Char('a')), w_true)
+        self.assertIs(W_Char('a').equal_w(W_String('a')), w_false)
+
     def test_symbol_ctor(self):
         s1 = symbol('s')
         s2 = symbol('s')
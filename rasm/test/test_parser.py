@@ -0,0 +1,106 @@
+from unittest import TestCase
+from rasm.lang.model import (W_Int, W_BigInt, W_Float, W_String, W_Char,
+                             W_Pair, symbol, w_nil, w_true, w_false)
+from rasm.compiler.parser import (parse_string, Reader, StringSource,
+                                  ParseError)
+
+class TestParser(TestCase):
+    def test_atoms(self):
+        exprs_w = parse_string('42 -7 +3 foo #t #f - ...')
+        self.assertEquals(exprs_w[0].to_int(), 42)
+        self.assertEquals(exprs_w[1].to_int(), -7)
+        self.assertEquals(exprs_w[2].to_int(), 3)
+        self.assertIs(exprs_w[3], symbol('foo'))
+        self.assertIs(exprs_w[4], w_true)
+        self.assertIs(exprs_w[5], w_false)
+        self.assertIs(exprs_w[6], symbol('-'))
+        self.assertIs(exprs_w[7], symbol('...'))
+
+    def test_big_literals(self):
+        exprs_w = parse_string('123456789012345678901234567890 '
+                               '-9223372036854775808')
+        self.assertIsInstance(exprs_w[0], W_BigInt)
+        self.assertEquals(exprs_w[0].to_string(),
+                          '123456789012345678901234567890')
+        # The most negative int only overflows while its digits are read.
+        self.assertEquals(exprs_w[1].to_string(), '-9223372036854775808')
+
+    def test_floats(self):
+        exprs_w = parse_string('1.5 -.5 +2. 1e3 -2.5E-1 1e 1.2.3 .e1')
+        for i, value in enumerate([1.5, -0.5, 2.0, 1000.0, -0.25]):
+            self.assertIsInstance(exprs_w[i], W_Float)
+            self.assertEquals(exprs_w[i].floatval, value)
+        self.assertIs(exprs_w[5], symbol('1e'))
+        self.assertIs(exprs_w[6], symbol('1.2.3'))
+        self.assertIs(exprs_w[7], symbol('.e1'))
+
+    def test_strings_and_chars(self):
+        exprs_w = parse_string(r'"a b" "q\"\\\n" "" #\a #\( #\space (#\x)')
+        self.assertIsInstance(exprs_w[0], W_String)
+        self.assertEquals(exprs_w[0].sval, 'a b')
+        self.assertEquals(exprs_w[1].sval, 'q"\\\n')
+        self.assertEquals(exprs_w[2].sval, '')
+        self.assertIsInstance(exprs_w[3], W_Char)
+        self.assertEquals(exprs_w[3].chval, 'a')
+        self.assertEquals(exprs_w[4].chval, '(')
+        self.assertEquals(exprs_w[5].chval, ' ')
+        self.assertEquals(exprs_w[6].to_string(), '(x)')
+        reader = Reader(StringSource('"abc\ndef" #\\newline'), chunksize=2)
+        self.assertEquals(reader.read().to_string(), 'abc\ndef')
+        self.assertEquals(reader.read().to_string(), '\n')
+
+    def test_lists(self):
+        exprs_w = parse_string('(define (f x) ; comment\n  (+ x 1)) ()')
+        self.assertEquals(exprs_w[0].to_string(), '(define (f x) (+ x 1))')
+        self.assertIs(exprs_w[1], w_nil)
+
+    def test_dotted_and_quote(self):
+        exprs_w = parse_string("(a . b) '(1 2 . 3) ''x")
+        self.assertEquals(exprs_w[0].to_string(), '(a . b)')
+        self.assertEquals(exprs_w[1].to_string(), '(quote (1 2 . 3))')
+        self.assertEquals(exprs_w[2].to_string(), '(quote (quote x))')
+
+    def test_streaming(self):
+        # A tiny chunk size makes tokens straddle chunk boundaries.
+        reader = Reader(StringSource('(foobar 12345)\n(baz . quux) end'),
+                        chunksize=3)
+        self.assertEquals(reader.read().to_string(), '(foobar 12345)')
+        self.assertEquals(reader.read().to_string(), '(baz . quux)')
+        self.assertIs(reader.read(), symbol('end'))
+        self.assertIs(reader.read(), None)
+
+    def test_deep_nesting(self):
+        depth = 100000
+        w_expr = parse_string('(' * depth + ')' * depth)[0]
+        for i in xrange(depth - 1):
+            w_expr = w_expr.car_w()
+        self.assertIs(w_expr, w_nil)
+
+    def test_errors(self):
+        for source, msg in [('(a b', "expected ')'"),
+                            ('(a))', "unexpected ')'"),
+                            ('(. a)', "unexpected '.'"),
+                            ('(a . b c)', "expected ')'"),
+                            ("'", 'expected datum after quote'),
+                            ('"ab', 'unterminated string'),
+                            (r'"\q"', "unknown escape '\\q'"),
+                            ('#\\', 'expected character'),
+                            ('#\\nope', 'unknown character name')]:
+            try:
+                parse_string(source)
+            except ParseError as e:
+                self.assertEquals(e.msg, msg)
+            else:
+                self.fail('no error for %r' % source)
+
+    def test_nice_error_message(self):
+        try:
+            parse_string('(a\n  (b ])')
+        except ParseError as e:
+            self.assertEquals(e.nice_error_message('<test>'),
+                              '  File <test>, line 2\n'
+                              '  (b ])\n'
+                              '     ^\n'
+                              "ParseError: unexpected character ']'")
+        else:
+            self.fail('no error')
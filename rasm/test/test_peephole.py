@@ -0,0 +1,183 @@
+from unittest import TestCase
+from rasm.rt.code import Op
+from rasm.compiler.peephole import peephole
+from rasm.compiler.parser import parse_string
+from rasm.compiler.astbuilder import Builder
+from rasm.compiler.cps import Rewriter
+from rasm.compiler.codegen import compile_all
+from rasm.rt.image import prelude_image, get_report_env
+from rasm.rt.execution import Frame
+
+def makecode(lst):
+    return ''.join(map(chr, lst))
+
+def compile_source(source, fold=True, fuse=True):
+    nodelist = Builder(parse_string(source)).getast()
+    cpsform = Rewriter(nodelist, toplevel=True).run()
+    return compile_all(cpsform, get_report_env(), prelude_image.proto_w,
+                       fold=fold, fuse=fuse)
+
+def run_source(source, fold=True, fuse=True):
+    w_maincont, proto_w = compile_source(source, fold, fuse)
+    return Frame(w_maincont, proto_w).run()
+
+class TestFold(TestCase):
+    def test_arith(self):
+        code = makecode([
+            Op.INT, 1, 0,
+            Op.INT, 2, 0,
+            Op.INT, 3, 0,
+            Op.IMUL,
+            Op.IADD,
+            Op.HALT,
+        ])
+        self.assertEquals(peephole(code), makecode([
+            Op.INT, 7, 0,
+            Op.HALT,
+        ]))
+
+    def test_out_of_range(self):
+        code = makecode([
+            Op.INT, 1, 0,
+            Op.INT, 2, 0,
+            Op.ISUB,
+            Op.HALT,
+        ])
+        self.assertEquals(peephole(code, fuse=False), code)
+
+    def test_branch(self):
+        # (if (< 1 2) a b), then (if (eq? '() #f) a b).
+        code = makecode([
+            Op.INT, 1, 0,
+            Op.INT, 2, 0,
+            Op.LT,
+            Op.BRANCHIFNOT, 3, 0,
+            Op.LOAD, 0,
+            Op.HALT,
+            Op.LOAD, 1,
+            Op.HALT,
+        ])
+        self.assertEquals(peephole(code, fuse=False), makecode([
+            Op.LOAD, 0,
+            Op.HALT,
+        ]))
+        code = makecode([
+            Op.NIL,
+            Op.FALSE,
+            Op.IS,
+            Op.BRANCHIFNOT, 3, 0,
+            Op.LOAD, 0,
+            Op.HALT,
+            Op.LOAD, 1,
+            Op.HALT,
+        ])
+        self.assertEquals(peephole(code, fuse=False), makecode([
+            Op.LOAD, 1,
+            Op.HALT,
+        ]))
+
+    def test_unspec_pop(self):
+        code = makecode([
+            Op.INT, 1, 0,
+            Op.STORE, 0,
+            Op.UNSPEC,
+            Op.POP,
+            Op.LOAD, 0,
+            Op.HALT,
+        ])
+        self.assertEquals(peephole(code, fuse=False), makecode([
+            Op.INT, 1, 0,
+            Op.STORE, 0,
+            Op.LOAD, 0,
+            Op.HALT,
+        ]))
+
+    def test_source(self):
+        source = ('(define (f x)'
+                  '  (define y 3)'
+                  '  (if (< (* 2 3) 5) 0 (+ x (- 10 y))))'
+                  '(f 1)')
+        w_maincont, proto_w = compile_source(source, fuse=False)
+        new_proto_w = proto_w[len(prelude_image.proto_w):]
+        for w_proto in [w_maincont.w_proto] + new_proto_w:
+            opcodes = w_proto.insns[::2]
+            self.assertNotIn(Op.POP, opcodes)
+            self.assertNotIn(Op.BRANCHIFNOT, opcodes)
+        self.assertEquals(run_source(source, fold=False).to_int(), 8)
+        self.assertEquals(run_source(source).to_int(), 8)
+
+class TestFuse(TestCase):
+    def test_fuse(self):
+        code = makecode([
+            Op.LOAD, 0,
+            Op.LOAD, 1,
+            Op.IADD,
+            Op.INT, 1, 0,
+            Op.ISUB,
+            Op.GETGLOBAL, 0,
+            Op.CONT,
+        ])
+        self.assertEquals(peephole(code), makecode([
+            Op.LOAD2_IADD, 0, 1,
+            Op.ISUBI, 1, 0,
+            Op.GETGLOBALCONT, 0,
+        ]))
+
+    def test_fuse_args(self):
+        code = makecode([
+            Op.LOAD, 2,
+            Op.SETARG, 1,
+            Op.GETUPVAL, 0,
+            Op.SETARG, 0,
+            Op.BUILDCONT, 5, 0,
+            Op.SETARG, 2,
+            Op.LOADCONT, 3,
+        ])
+        self.assertEquals(peephole(code), makecode([
+            Op.LOADARG, 2, 1,
+            Op.GETUPVALARG, 0, 0,
+            Op.EXTENDED_ARG, 2, 0,
+            Op.BUILDCONTARG, 5, 0,
+            Op.LOADCONT, 3,
+        ]))
+
+    def test_branch_offsets(self):
+        code = makecode([
+            Op.LOAD, 0,
+            Op.INT, 2, 0,
+            Op.LT,
+            Op.BRANCHIFNOT, 3, 0,
+            Op.LOAD, 1,
+            Op.CONT,
+            Op.LOAD, 0,
+            Op.LOAD, 2,
+            Op.CONT,
+        ])
+        self.assertEquals(peephole(code), makecode([
+            Op.LOAD, 0,
+            Op.INT, 2, 0,
+            Op.BRANCHIFNOTLT, 2, 0,
+            Op.LOADCONT, 1,
+            Op.LOAD, 0,
+            Op.LOADCONT, 2,
+        ]))
+
+    def test_branch_target_is_not_fused(self):
+        # The else branch starts at the CONT: the LOAD before it is on
+        # the other path only.
+        code = makecode([
+            Op.TRUE,
+            Op.BRANCHIFNOT, 2, 0,
+            Op.LOAD, 0,
+            Op.CONT,
+        ])
+        self.assertEquals(peephole(code, fold=False), code)
+
+    def test_same_result(self):
+        source = ('(define (fibo n)'
+                  '  (if (< n 2) n (+ (fibo (- n 1)) (fibo (- n 2)))))'
+                  '(define (sum n s) (if (< n 1) s (sum (- n 1) (+ s n))))'
+                  '(cons (fibo 10) (sum 100 0))')
+        self.assertEquals(run_source(source, False, False).to_string(),
+                          '(55 . 5050)')
+        self.assertEquals(run_source(source).to_string(), '(55 . 5050)')
@@ -0,0 +1,87 @@
+import os
+import tempfile
+from unittest import TestCase
+from rasm.lang.model import W_Int, W_String, list_to_pair, w_eof
+from rasm.lang import port
+from rasm.lang.port import (BUFFER_SIZE, open_output_file, open_ports,
+                            flush_all, open_input_file, MapSource)
+from rasm.error import OperationError
+
+class TestOutputPort(TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.w_port = open_output_file(self.path)
+
+    def tearDown(self):
+        self.w_port.close()
+        os.remove(self.path)
+
+    def written(self):
+        return os.fstat(self.w_port.fd).st_size
+
+    def test_buffered(self):
+        self.w_port.write('a' * (BUFFER_SIZE - 1))
+        self.assertEquals(self.written(), 0)
+        self.w_port.write('b')
+        self.assertEquals(self.written(), BUFFER_SIZE)
+        self.w_port.display(list_to_pair([W_Int(1), W_String('two')]))
+        self.assertEquals(self.written(), BUFFER_SIZE)
+        flush_all()
+        self.assertEquals(self.written(), BUFFER_SIZE + len('(1 two)'))
+
+    def test_close(self):
+        self.w_port.write('x')
+        self.w_port.close()
+        self.assertNotIn(self.w_port, open_ports)
+        self.assertEquals(open(self.path).read(), 'x')
+        self.assertRaises(OperationError, self.w_port.write, 'y')
+
+    def test_open_error(self):
+        self.assertRaises(OperationError, open_output_file,
+                          os.path.join(self.path, 'not-a-dir'))
+
+class TestInputPort(TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def open_with(self, data):
+        f = open(self.path, 'w')
+        f.write(data)
+        f.close()
+        return open_input_file(self.path)
+
+    def test_read(self):
+        w_port = self.open_with('(a\n "b c")  12 ; done\n#\\x')
+        self.assertEquals(w_port.read().to_string(), '(a b c)')
+        self.assertEquals(w_port.read().to_int(), 12)
+        self.assertEquals(w_port.read().to_string(), 'x')
+        self.assertIs(w_port.read(), w_eof)
+        self.assertIs(w_port.read(), w_eof)
+        w_port.close()
+        self.assertRaises(OperationError, w_port.read)
+
+    def test_mapped(self):
+        saved = port.MMAP_THRESHOLD
+        port.MMAP_THRESHOLD = 0
+        try:
+            w_port = self.open_with('(1 2) 3')
+        finally:
+            port.MMAP_THRESHOLD = saved
+        self.assertIsInstance(w_port.reader.source, MapSource)
+        self.assertEquals(w_port.read().to_string(), '(1 2)')
+        self.assertEquals(w_port.read().to_int(), 3)
+        self.assertIs(w_port.read(), w_eof)
+        w_port.close()
+
+    def test_errors(self):
+        w_port = self.open_with('1 (2 .)')
+        self.assertEquals(w_port.read().to_int(), 1)
+        self.assertRaises(OperationError, w_port.read)
+        w_port.close()
+        self.assertRaises(OperationError, open_input_file,
+                          os.path.join(self.path, 'not-a-dir'))
@@ -0,0 +1,60 @@
+from unittest import TestCase
+from rasm.compiler.parser import parse_string
+from rasm.compiler.astbuilder import Builder
+from rasm.compiler.cps import Rewriter
+from rasm.compiler.codegen import compile_all
+from rasm.rt.image import prelude_image, get_report_env
+from rasm.rt.execution import Frame
+
+def cps_source(source, optimize=True):
+    nodelist = Builder(parse_string(source)).getast()
+    return Rewriter(nodelist, toplevel=True, optimize=optimize).run()
+
+def run_source(source, optimize=True):
+    w_maincont, proto_w = compile_all(cps_source(source, optimize),
+                                      get_report_env(),
+                                      prelude_image.proto_w)
+    return Frame(w_maincont, proto_w).run()
+
+class TestSimplify(TestCase):
+    def assertSameResult(self, source, expected):
+        self.assertEquals(run_source(source, False).to_string(), expected)
+        self.assertEquals(run_source(source, True).to_string(), expected)
+
+    def test_small_join_is_copied(self):
+        source = '(define (f x) (+ 1 (if (< x 0) (- 0 x) x)))'
+        self.assertIn('$JoinCont_', cps_source(source, False).to_string())
+        self.assertNotIn('$JoinCont_', cps_source(source).to_string())
+        self.assertSameResult(source + '(cons (f -3) (f 4))', '(4 . 5)')
+
+    def test_escaping_join_is_kept(self):
+        # One branch passes the join continuation to a call.
+        source = ('(define (g x) (if (< x 0) (g (- 0 x)) x))'
+                  '(define (f x) (display (if (< x 0) (g x) x)) (newline) x)')
+        self.assertIn('$JoinCont_', cps_source(source).to_string())
+        self.assertSameResult(source + '(f -2)', '-2')
+
+    def test_direct_application(self):
+        source = "((lambda (a b) (cons b a)) 1 '(2))"
+        s = cps_source(source).to_string()
+        self.assertNotIn('Lambda', s)
+        self.assertSameResult(source, '((2) . 1)')
+
+    def test_direct_application_assigned_formal(self):
+        self.assertSameResult('((lambda (a b) (set! a (+ a b)) a) 3 4)', '7')
+
+    def test_direct_application_locals(self):
+        # The inlined body's own defines must not clash with the caller's.
+        source = ('(define (f x)'
+                  '  (define y 1)'
+                  '  ((lambda (z) (define y 10) (set! x (+ y z))) 5)'
+                  '  (+ x y))'
+                  '(f 0)')
+        self.assertSameResult(source, '16')
+
+    def test_no_capture(self):
+        # Substituting b for a would put b under the inner lambda's b.
+        source = ('(define (f b)'
+                  '  ((lambda (a) (lambda (b) (cons a b))) b))'
+                  '((f 1) 2)')
+        self.assertSameResult(source, '(1 . 2)')
@@ -0,0 +1,88 @@
+from unittest import TestCase
+from rasm.lang.model import W_Int, W_Float, symbol, w_true, w_false
+from rasm.lang.vector import (W_Vector, make_vector, int_strategy,
+                              float_strategy, object_strategy, vector_sum,
+                              vector_dot, vector_map, vector_fill,
+                              vector_copy, OP_ADD, OP_MUL)
+from rasm.error import OperationError
+
+class TestVector(TestCase):
+    def test_int(self):
+        w_vector = make_vector(3, W_Int(0))
+        self.assertIs(w_vector.strategy, int_strategy)
+        w_vector.setitem(1, W_Int(5))
+        self.assertIs(w_vector.strategy, int_strategy)
+        self.assertEquals(w_vector.length(), 3)
+        self.assertEquals(w_vector.getitem(1).to_int(), 5)
+        self.assertEquals(w_vector.to_string(), '#(0 5 0)')
+
+    def test_float(self):
+        w_vector = make_vector(2, W_Float(1.5))
+        self.assertIs(w_vector.strategy, float_strategy)
+        w_vector.setitem(0, W_Float(-1.0))
+        self.assertEquals(w_vector.to_string(), '#(-1.0 1.5)')
+
+    def test_switch_to_objects(self):
+        w_vector = make_vector(2, W_Int(7))
+        w_vector.setitem(0, symbol('a'))
+        self.assertIs(w_vector.strategy, object_strategy)
+        self.assertEquals(w_vector.to_string(), '#(a 7)')
+        w_vector = make_vector(2, W_Float(0.5))
+        w_vector.setitem(1, W_Int(1))
+        self.assertIs(w_vector.strategy, object_strategy)
+        self.assertEquals(w_vector.to_string(), '#(0.5 1)')
+
+    def test_equal(self):
+        w_ints = make_vector(2, W_Int(1))
+        w_objects = make_vector(2, symbol('a'))
+        w_objects.setitem(0, W_Int(1))
+        w_objects.setitem(1, W_Int(1))
+        self.assertIs(w_ints.equal_w(w_objects), w_true)
+        self.assertIs(w_ints.equal_w(make_vector(3, W_Int(1))), w_false)
+
+    def test_errors(self):
+        w_vector = make_vector(2, W_Int(0))
+        self.assertRaises(OperationError, w_vector.check_index, 2, 'test')
+        self.assertRaises(OperationError, w_vector.check_index, -1, 'test')
+        self.assertRaises(OperationError, make_vector, -1, W_Int(0))
+
+def make_ints(ints):
+    w_vector = make_vector(len(ints), W_Int(0))
+    for i in range(len(ints)):
+        w_vector.setitem(i, W_Int(ints[i]))
+    return w_vector
+
+class TestBulk(TestCase):
+    def test_sum_dot(self):
+        w_x = make_ints([1, 2, 3])
+        self.assertEquals(vector_sum(w_x).to_int(), 6)
+        self.assertEquals(vector_dot(w_x, make_ints([4, 5, 6])).to_int(), 32)
+        w_f = make_vector(2, W_Float(0.5))
+        self.assertEquals(vector_dot(w_f, w_f).to_string(), '0.5')
+        w_x.setitem(0, W_Float(0.5))
+        self.assertEquals(vector_sum(w_x).to_string(), '5.5')
+        self.assertRaises(OperationError, vector_dot, w_x, w_f)
+
+    def test_overflow(self):
+        w_x = make_vector(2, W_Int(4611686018427387903))
+        self.assertEquals(vector_sum(w_x).to_string(), '9223372036854775806')
+        vector_map(OP_MUL, w_x, w_x)
+        self.assertIs(w_x.strategy, object_strategy)
+        self.assertEquals(w_x.getitem(1).to_string(),
+                          '21267647932558653957237540927630737409')
+
+    def test_map(self):
+        w_x = make_ints([1, 2])
+        vector_map(OP_ADD, w_x, make_ints([10, 20]))
+        self.assertIs(w_x.strategy, int_strategy)
+        self.assertEquals(w_x.to_string(), '#(11 22)')
+
+    def test_fill_copy(self):
+        w_x = make_ints([1, 2, 3])
+        vector_fill(w_x, W_Float(1.0))
+        self.assertIs(w_x.strategy, float_strategy)
+        self.assertEquals(w_x.to_string(), '#(1.0 1.0 1.0)')
+        vector_copy(w_x, 1, make_ints([7, 8]))
+        self.assertEquals(w_x.to_string(), '#(1.0 7 8)')
+        self.assertRaises(OperationError, vector_copy, w_x, 2,
+                          make_ints([7, 8]))
@@ -0,0 +1,32 @@
+;; Counts the points of a size x size grid over [-1.5, 0.5] x [-1, 1]
+;; that stay bounded for max-iter iterations of z = z^2 + c.
+
+(define size 400)
+(define max-iter 50)
+
+(define (bounded? cr ci zr zi i)
+  (if (< i 1) #t
+      (if (fl< 4.0 (fl+ (fl* zr zr) (fl* zi zi))) #f
+          (bounded? cr ci
+                    (fl+ (fl- (fl* zr zr) (fl* zi zi)) cr)
+                    (fl+ (fl* 2.0 (fl* zr zi)) ci)
+                    (- i 1)))))
+
+(define (coord i offset)
+  (fl- (fl/ (fl* 2.0 (exact->inexact i)) (exact->inexact size)) offset))
+
+(define (count-row y x acc)
+  (if (< x size)
+      (count-row y (+ x 1)
+                 (if (bounded? (coord x 1.5) (coord y 1.0) 0.0 0.0 max-iter)
+                     (+ acc 1)
+                     acc))
+      acc))
+
+(define (count y acc)
+  (if (< y size)
+      (count (+ y 1) (count-row y 0 acc))
+      acc))
+
+(display (count 0 0))
+(newline)
@@ -0,0 +1,153 @@
+;; The n-body kernel of the benchmarks game: the sun and four planets,
+;; each a list (x y z vx vy vz mass). Each step builds new bodies instead
+;; of updating them in place. All arithmetic goes through the fl ops.
+
+(define steps 100000)
+
+(define pi 3.141592653589793)
+(define solar-mass (fl* 4.0 (fl* pi pi)))
+(define days-per-year 365.24)
+
+(define (make-body x y z vx vy vz mass)
+  (cons x (cons y (cons z (cons vx (cons vy (cons vz (cons mass '()))))))))
+
+(define (body-x b) (car b))
+(define (body-y b) (car (cdr b)))
+(define (body-z b) (car (cdr (cdr b))))
+(define (body-vx b) (car (cdr (cdr (cdr b)))))
+(define (body-vy b) (car (cdr (cdr (cdr (cdr b))))))
+(define (body-vz b) (car (cdr (cdr (cdr (cdr (cdr b)))))))
+(define (body-mass b) (car (cdr (cdr (cdr (cdr (cdr (cdr b))))))))
+
+(define (planet x y z vx vy vz mass)
+  (make-body x y z
+             (fl* vx days-per-year)
+             (fl* vy days-per-year)
+             (fl* vz days-per-year)
+             (fl* mass solar-mass)))
+
+(define sun (make-body 0.0 0.0 0.0 0.0 0.0 0.0 solar-mass))
+
+(define jupiter
+  (planet 4.84143144246472090e+00
+          -1.16032004402742839e+00
+          -1.03622044471123109e-01
+          1.66007664274403694e-03
+          7.69901118419740425e-03
+          -6.90460016972063023e-05
+          9.54791938424326609e-04))
+
+(define saturn
+  (planet 8.34336671824457987e+00
+          4.12479856412430479e+00
+          -4.03523417114321381e-01
+          -2.76742510726862411e-03
+          4.99852801234917238e-03
+          2.30417297573763929e-05
+          2.85885980666130812e-04))
+
+(define uranus
+  (planet 1.28943695621391310e+01
+          -1.51111514016986312e+01
+          -2.23307578892655734e-01
+          2.96460137564761618e-03
+          2.37847173959480950e-03
+          -2.96589568540237556e-05
+          4.36624404335156298e-05))
+
+(define neptune
+  (planet 1.53796971148509165e+01
+          -2.59193146099879641e+01
+          1.79258772950371181e-01
+          2.68067772490389322e-03
+          1.62824170038242295e-03
+          -9.51592254519715870e-05
+          5.15138902046611451e-05))
+
+;; Calls k with the total momentum of bodies.
+(define (momentum bodies px py pz k)
+  (if (null? bodies) (k px py pz)
+      (momentum (cdr bodies)
+                (fl+ px (fl* (body-vx (car bodies)) (body-mass (car bodies))))
+                (fl+ py (fl* (body-vy (car bodies)) (body-mass (car bodies))))
+                (fl+ pz (fl* (body-vz (car bodies)) (body-mass (car bodies))))
+                k)))
+
+;; Gives the sun the velocity that makes the total momentum zero.
+(define (offset-momentum bodies)
+  (momentum bodies 0.0 0.0 0.0
+            (lambda (px py pz)
+              (cons (make-body 0.0 0.0 0.0
+                               (fl/ (fl- 0.0 px) solar-mass)
+                               (fl/ (fl- 0.0 py) solar-mass)
+                               (fl/ (fl- 0.0 pz) solar-mass)
+                               solar-mass)
+                    (cdr bodies)))))
+
+(define (distance b o)
+  ((lambda (dx dy dz)
+     (flsqrt (fl+ (fl* dx dx) (fl+ (fl* dy dy) (fl* dz dz)))))
+   (fl- (body-x b) (body-x o))
+   (fl- (body-y b) (body-y o))
+   (fl- (body-z b) (body-z o))))
+
+(define (kinetic b)
+  (fl* 0.5 (fl* (body-mass b)
+                (fl+ (fl* (body-vx b) (body-vx b))
+                     (fl+ (fl* (body-vy b) (body-vy b))
+                          (fl* (body-vz b) (body-vz b)))))))
+
+(define (potential b others e)
+  (if (null? others) e
+      (potential b (cdr others)
+                 (fl- e (fl/ (fl* (body-mass b) (body-mass (car others)))
+                             (distance b (car others)))))))
+
+(define (energy bodies e)
+  (if (null? bodies) e
+      (energy (cdr bodies)
+              (potential (car bodies) (cdr bodies)
+                         (fl+ e (kinetic (car bodies)))))))
+
+;; The new b: its velocity pulled by every other body, then moved.
+(define (step-body b bodies dt vx vy vz)
+  (if (null? bodies)
+      (make-body (fl+ (body-x b) (fl* dt vx))
+                 (fl+ (body-y b) (fl* dt vy))
+                 (fl+ (body-z b) (fl* dt vz))
+                 vx vy vz (body-mass b))
+      (if (eq? b (car bodies))
+          (step-body b (cdr bodies) dt vx vy vz)
+          (pull b (car bodies) (cdr bodies) dt vx vy vz))))
+
+(define (pull b o rest dt vx vy vz)
+  ((lambda (dx dy dz)
+     ((lambda (d2)
+        ((lambda (mag)
+           (step-body b rest dt
+                      (fl- vx (fl* dx mag))
+                      (fl- vy (fl* dy mag))
+                      (fl- vz (fl* dz mag))))
+         (fl/ (fl* dt (body-mass o)) (fl* d2 (flsqrt d2)))))
+      (fl+ (fl* dx dx) (fl+ (fl* dy dy) (fl* dz dz)))))
+   (fl- (body-x b) (body-x o))
+   (fl- (body-y b) (body-y o))
+   (fl- (body-z b) (body-z o))))
+
+(define (advance bodies dt)
+  (map (lambda (b)
+         (step-body b bodies dt (body-vx b) (body-vy b) (body-vz b)))
+       bodies))
+
+(define (run n bodies)
+  (if (< n 1) bodies
+      (run (- n 1) (advance bodies 0.01))))
+
+(define system
+  (offset-momentum
+    (cons sun (cons jupiter (cons saturn (cons uranus (cons neptune '())))))))
+
+(display (energy system 0.0))
+(newline)
+(display (energy (run steps system) 0.0))
+(newline)
@@ -1,14 +1,18 @@
 import sys 
 from rasm.error import OperationError
 from rasm.ffi.libreadline import getline
-from rasm.compiler.parser import parse_string, BacktrackException
+from rasm.compiler.parser import (parse_string, Reader, StreamSource,
+                                  ParseError)
 from rasm.compiler.astbuilder import Builder
 from rasm.compiler.cps import Rewriter
 from rasm.compiler.codegen import compile_all
 from rasm.compiler.codeviewer import dis_proto
-from rasm.rt.prelude import get_report_env
+from rasm.compiler.cache import (file_hash, cache_path, read_cache,
+                                 write_cache)
+from rasm.rt.image import prelude_image, get_report_env
 from rasm.rt.execution import Frame
-from rasm.lang.model import w_unspec
+from rasm.rt.code import callcache_stats
+from rasm.lang.model import w_unspec, USING_SMALLINT
 
 from pypy.jit.codewriter.policy import JitPolicy
 from pypy.rlib.streamio import open_file_as_stream
@@ -18,31 +22,43 @@ EXE_NAME = "interp-c"
 
 def target(driver, argl):
     driver.exe_name = EXE_NAME
+    if USING_SMALLINT:
+        driver.config.translation.taggedpointers = True
     return main, None
 
 def jitpolicy(driver):
     return JitPolicy()
 
-def run_file(filename):
-    fp = open_file_as_stream(filename)
-    source = fp.readall()
+def run_file(filename, show_stats=False):
+    # Neither the hash nor the reader needs the whole file in memory; on
+    # a cache miss the file is read a second time, by the reader.
     toplevel_env = get_report_env()
-    try:
-        exprs_w = parse_string(source)
-    except BacktrackException as e:
-        print e.error.nice_error_message('<file %s>' % filename, source)
-        return 1
-    try:
-        nodelist = Builder(exprs_w).getast()
-    except OperationError as e:
-        print e.unwrap().to_string()
-        return 1
-    cpsform = Rewriter(nodelist, toplevel=True).run()
-    try:
-        w_maincont, proto_w = compile_all(cpsform, toplevel_env)
-    except OperationError as e:
-        print e.unwrap().to_string()
-        return 1
+    srchash = file_hash(filename)
+    w_maincont, proto_w = read_cache(cache_path(filename), srchash,
+                                     toplevel_env, prelude_image)
+    if w_maincont is None:
+        fp = open_file_as_stream(filename)
+        try:
+            exprs_w = Reader(StreamSource(fp)).read_all()
+        except ParseError as e:
+            print e.nice_error_message('<file %s>' % filename)
+            return 1
+        finally:
+            fp.close()
+        try:
+            nodelist = Builder(exprs_w).getast()
+        except OperationError as e:
+            print e.unwrap().to_string()
+            return 1
+        cpsform = Rewriter(nodelist, toplevel=True).run()
+        try:
+            w_maincont, proto_w = compile_all(cpsform, toplevel_env,
+                                              prelude_image.proto_w)
+        except OperationError as e:
+            print e.unwrap().to_string()
+            return 1
+        write_cache(cache_path(filename), w_maincont, proto_w, srchash,
+                    prelude_image)
     #print 'ast:', map(lambda o: o.to_string(), nodelist)
     #print cpsform.to_string()
     #print w_maincont, 'dis:'
@@ -53,6 +69,8 @@ def run_file(filename):
     #return 0
     frame = Frame(w_maincont, proto_w)
     frame.run()
+    if show_stats:
+        print callcache_stats.to_string()
     return 0
 
 def repl():
@@ -65,8 +83,8 @@ def repl():
 
         try:
             exprs_w = parse_string(line)
-        except BacktrackException as e:
-            print e.error.nice_error_message('<stdin>', line)
+        except ParseError as e:
+            print e.nice_error_message('<stdin>', line)
             continue
 
         try:
@@ -77,7 +95,8 @@ def repl():
 
         cpsform = Rewriter(nodelist, toplevel=True).run()
         try:
-            w_maincont, proto_w = compile_all(cpsform, toplevel_env)
+            w_maincont, proto_w = compile_all(cpsform, toplevel_env,
+                                              prelude_image.proto_w)
         except OperationError as e:
             print e.unwrap().to_string()
             continue
@@ -85,9 +104,9 @@ def repl():
         print 'cps:', cpsform.to_string()
         print w_maincont.to_string(), 'dis:'
         print dis_proto(w_maincont.w_proto)
-        for w_proto in proto_w:
-            print w_proto.to_string(), 'dis:'
-            print dis_proto(w_proto)
+        for i in xrange(len(prelude_image.proto_w), len(proto_w)):
+            print proto_w[i].to_string(), 'dis:'
+            print dis_proto(proto_w[i])
         #frame = Frame(w_maincont, proto_w)
         #w_res = frame.run()
         #if w_res and w_res is not w_unspec:
@@ -100,11 +119,12 @@ def main(argv):
         filename = argv[1]
     except IndexError:
         if we_are_translated():
-            print 'Usage: %s [filename]' % argv[0]
+            print 'Usage: %s [filename [--stats]]' % argv[0]
             return 1
         else:
             return repl()
-    return run_file(filename)
+    show_stats = len(argv) > 2 and argv[2] == '--stats'
+    return run_file(filename, show_stats)
 
 if __name__ == '__main__':
     main(sys.argv)